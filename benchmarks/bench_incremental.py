@@ -0,0 +1,231 @@
+"""benchmark pytest-incremental on a synthetic project
+
+Generate a package with a configurable number of modules, imports and
+test files, then time each phase of the plugin:
+
+ - discovery: find python files in watched folders
+ - graph: find imports of all modules and build the graph (cold)
+ - closures: compute all dependencies of every test module
+ - topsort: topological sort of the graph
+ - outdated-cold: find outdated tests with an empty DB
+ - save-success: save all tests as successful
+ - outdated-warm: find outdated tests after all tests succeeded
+
+Results are written as JSON, use `--compare` to check a previous result.
+
+usage::
+
+  $ python benchmarks/bench_incremental.py --modules 1000 -o result.json
+  $ python benchmarks/bench_incremental.py --modules 1000 --compare result.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import pytest_incremental
+from pytest_incremental import IncrementalControl, IncrementalTasks
+
+
+def generate(base_dir, modules=1000, fan_out=3, cycle_density=0.01,
+             conftest_depth=2, test_ratio=0.5, pkg_size=50, seed=0):
+    """generate a synthetic project
+
+    Modules are split in packages of `pkg_size` modules.
+    Packages are nested `conftest_depth` levels deep and every package
+    contains a `conftest.py`.
+    Each module imports `fan_out` random modules with a lower index,
+    and with probability `cycle_density` a module with a higher index
+    (creating a cycle).
+    Test files (one for each `test_ratio` module) import its module.
+
+    :return: (list - str) path of test files
+    """
+    rand = random.Random(seed)
+    pkgs = []  # (dotted name, path)
+    num_pkgs = max(1, (modules + pkg_size - 1) // pkg_size)
+    for num in range(num_pkgs):
+        # nest packages as p<a>/p<b>/... limited by conftest_depth
+        parts = ['proj']
+        rest = num
+        for _ in range(max(conftest_depth - 1, 0)):
+            parts.append('p{}'.format(rest % 10))
+            rest //= 10
+        parts.append('pkg{}'.format(num))
+        pkgs.append(parts)
+
+    def make_pkg(parts):
+        path = base_dir
+        for part in parts:
+            path = os.path.join(path, part)
+            if not os.path.exists(path):
+                os.mkdir(path)
+                with open(os.path.join(path, '__init__.py'), 'w'):
+                    pass
+                with open(os.path.join(path, 'conftest.py'), 'w') as fp:
+                    fp.write('import pytest\n')
+        return path
+
+    mod_names = []
+    mod_paths = []
+    for num in range(modules):
+        parts = pkgs[num // pkg_size]
+        mod_names.append('.'.join(parts + ['mod{}'.format(num)]))
+        mod_paths.append(os.path.join(make_pkg(parts),
+                                      'mod{}.py'.format(num)))
+
+    test_files = []
+    test_dir = make_pkg(['tests'])
+    for num in range(modules):
+        imports = set()
+        if num:
+            for _ in range(fan_out):
+                imports.add(rand.randrange(num))
+        if rand.random() < cycle_density and num + 1 < modules:
+            imports.add(rand.randrange(num + 1, modules))
+        with open(mod_paths[num], 'w') as fp:
+            for imp in sorted(imports):
+                fp.write('import {}\n'.format(mod_names[imp]))
+            fp.write('\ndef func{}():\n    return {}\n'.format(num, num))
+
+        if rand.random() < test_ratio:
+            test_path = os.path.join(test_dir, 'test_mod{}.py'.format(num))
+            with open(test_path, 'w') as fp:
+                fp.write('import {}\n\n'.format(mod_names[num]))
+                fp.write('def test_func():\n    assert True\n')
+            test_files.append(test_path)
+    return test_files
+
+
+class Bench(object):
+    """time and record peak memory of benchmark phases"""
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.results = {}
+
+    def run(self, name, func, *args):
+        if self.memory:
+            tracemalloc.start()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        result = func(*args)
+        entry = {
+            'wall': time.perf_counter() - start_wall,
+            'cpu': time.process_time() - start_cpu,
+        }
+        if self.memory:
+            entry['memory_peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results[name] = entry
+        return result
+
+
+def bench_project(base_dir, test_files, memory=True):
+    """run benchmark on a generated project
+    :return dict: phase name: dict with wall, cpu, memory_peak
+    """
+    bench = Bench(memory)
+    control = bench.run('discovery', IncrementalControl, [base_dir])
+    control.test_files = test_files
+
+    def build_graph():
+        tasks = IncrementalTasks(control.py_files, test_files=test_files)
+        deps = {path: tasks.action_get_dep(path)
+                for path in tasks.py_files}
+        tasks.action_write_graph(deps)
+        return tasks.create_graph()
+    graph = bench.run('graph', build_graph)
+
+    def closures():
+        return sum(len(graph.nodes[test].all_deps()) for test in test_files)
+    bench.run('closures', closures)
+    bench.run('topsort', graph.topsort)
+
+    outdated = bench.run('outdated-cold', control.get_outdated)
+    assert len(outdated) == len(test_files)
+    bench.run('save-success', control.save_success, test_files)
+    outdated = bench.run('outdated-warm', control.get_outdated)
+    assert not outdated
+    return bench.results
+
+
+def compare(old, new):
+    """print relative change of wall time and memory peak per phase"""
+    for name, entry in new['phases'].items():
+        base = old['phases'].get(name)
+        if not base:
+            continue
+        line = '{:<16} wall {:>9.3f}s {:>+7.1%}'.format(
+            name, entry['wall'], entry['wall'] / base['wall'] - 1)
+        if 'memory_peak' in entry and 'memory_peak' in base:
+            line += '   memory {:>12,} {:>+7.1%}'.format(
+                entry['memory_peak'],
+                entry['memory_peak'] / base['memory_peak'] - 1)
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--modules', type=int, default=1000)
+    parser.add_argument('--fan-out', type=int, default=3,
+                        help='number of imports per module')
+    parser.add_argument('--cycle-density', type=float, default=0.01,
+                        help='probability of a module import creating a cycle')
+    parser.add_argument('--conftest-depth', type=int, default=2,
+                        help='number of nested packages with conftest.py')
+    parser.add_argument('--test-ratio', type=float, default=0.5,
+                        help='number of test files per module')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='do not trace memory (tracing slows execution)')
+    parser.add_argument('-o', '--output', help='write JSON result to file')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with result from a previous run')
+    args = parser.parse_args(argv)
+
+    params = {
+        'modules': args.modules,
+        'fan_out': args.fan_out,
+        'cycle_density': args.cycle_density,
+        'conftest_depth': args.conftest_depth,
+        'test_ratio': args.test_ratio,
+        'seed': args.seed,
+    }
+    base_dir = tempfile.mkdtemp(prefix='bench-inc-')
+    cwd = os.getcwd()
+    try:
+        test_files = generate(base_dir, **params)
+        # intermediate files are written on CWD
+        os.chdir(base_dir)
+        phases = bench_project(base_dir, test_files, memory=args.memory)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(base_dir)
+
+    result = {
+        'version': '.'.join(str(v) for v in pytest_incremental.__version__),
+        'python': platform.python_version(),
+        'params': params,
+        'test_files': len(test_files),
+        'phases': phases,
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(result, fp, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(json.load(fp), result)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
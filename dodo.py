@@ -13,6 +13,7 @@ def task_pyflakes():
     flakes = Pyflakes()
     yield flakes.tasks('*.py')
     yield flakes.tasks('tests/*.py')
+    yield flakes.tasks('benchmarks/*.py')
 
 
 
@@ -31,6 +32,21 @@ def task_coverage():
     }
 
 
+def task_bench():
+    """run benchmark on synthetic projects of different sizes"""
+    for modules in (1000, 10000):
+        yield {
+            'name': modules,
+            'actions': [
+                'python benchmarks/bench_incremental.py --no-memory '
+                '--modules {0} -o bench-{0}.json'.format(modules),
+            ],
+            'file_dep': CODE_FILES,
+            'targets': ['bench-{}.json'.format(modules)],
+            'verbosity': 2,
+        }
+
+
 def task_docs():
     doc_files = glob.glob('docs/*.rst') + ['README.rst', ]
     yield docs.spell(doc_files, 'docs/dictionary.txt')
@@ -9,16 +9,44 @@ Copyright (c) 2011-2018 Eduardo Naufel Schettino
 __version__ = (0, 5, 0)
 
 import os
+import sys
+import ast
 import json
+import dbm
+import gc
+import mmap
+import types
+import struct
+import builtins
+import importlib
+import importlib.util
+import time
+import csv
+import bisect
+import difflib
+import hashlib
+import platform
+import sysconfig
 import functools
+import itertools
+import contextlib
+import threading
+import traceback
+import select
+import signal
+import socket
+from array import array
 from collections import defaultdict
+from collections.abc import Mapping
 from io import StringIO
 
-from import_deps import ModuleSet, PyModule
+from import_deps import PyModule
 from doit.task import Task, DelayedLoader
 from doit.cmd_base import ModuleTaskLoader
 from doit.cmd_run import Run
 from doit.reporter import ZeroReporter
+from doit.dependency import DbmDB, JSONCodec, MD5Checker, get_file_md5
+from doit.dependency import Dependency
 from doit import doit_cmd
 from doit.tools import config_changed
 
@@ -73,11 +101,20 @@ class DepGraph(object):
                                 value: (list - str) direct deps
         """
         self.nodes = {}
+        self.order = None  # function returning precomputed topsort
         for name, deps in dep_dict.items():
             node = self._node(name)
             for dep in deps:
                 node.add_dep(self._node(dep))
 
+    @classmethod
+    def from_file(cls, graph_file):
+        """create graph with nodes loaded on demand from a GraphFile"""
+        graph = cls({})
+        graph.nodes = FileNodes(graph_file)
+        graph.order = graph_file.topsort
+        return graph
+
     def _node(self, name):
         """get or create node"""
         node = self.nodes.get(name, None)
@@ -105,11 +142,213 @@ class DepGraph(object):
         stream.write("}\n")
 
 
+    DEPS_FORMATS = ('text', 'jsonl', 'csv')
+
+    def write_deps(self, stream, fmt='text', names=None):
+        """write all (recursive) deps of nodes, paths relative to CWD
+
+        formats:
+          - text: ` - <node>: <dep>, <dep>...`
+          - jsonl: one JSON object per line `{"node": ..., "deps": [...]}`
+          - csv: edges from node to each of its deps (with a header)
+
+        :param stream: Any object with a `write()` method
+        :param fmt: (str) one of DEPS_FORMATS
+        :param names: (iterable - str) only write deps for these nodes
+        """
+        relpaths = {}
+        def rel(name):
+            path = relpaths.get(name)
+            if path is None:
+                path = relpaths[name] = os.path.relpath(name)
+            return path
+
+        if names is None:
+            names = self.nodes
+        writer = csv.writer(stream, lineterminator='\n')
+        if fmt == 'csv':
+            writer.writerow(('node', 'dep'))
+        for name in sorted(names):
+            node = self.nodes[name]
+            deps = [rel(dep) for dep in sorted(n.name for n in node.all_deps())]
+            if fmt == 'text':
+                stream.write(' - {}: {}\n'.format(rel(name), ', '.join(deps)))
+            elif fmt == 'jsonl':
+                stream.write(json.dumps({'node': rel(name), 'deps': deps}))
+                stream.write('\n')
+            else:
+                node_path = rel(name)
+                writer.writerows((node_path, dep) for dep in deps)
+
+
+    def distance(self, source, targets):
+        '''return number of edges on shortest path from `source` to any
+        node in `targets`. implicit deps are also followed.
+
+        :param source: (str) node name
+        :param targets: (set - str) node names
+        :return: (int) or None if no node from `targets` is reachable
+        '''
+        if source in targets:
+            return 0
+        done = set([source])
+        level = [self.nodes[source]]
+        distance = 0
+        while level:
+            distance += 1
+            next_level = []
+            for node in level:
+                for dep in itertools.chain(node.deps, node.implicit_deps):
+                    if dep.name in done:
+                        continue
+                    if dep.name in targets:
+                        return distance
+                    done.add(dep.name)
+                    next_level.append(dep)
+            level = next_level
+        return None
+
+
+    def _reverse(self):
+        """:return dict: node name: list of names of nodes depending on it
+        (directly or by implicit dep)
+        """
+        rdeps = defaultdict(list)
+        for node in self.nodes.values():
+            for dep in itertools.chain(node.deps, node.implicit_deps):
+                rdeps[dep.name].append(node.name)
+        return rdeps
+
+    def shortest_paths(self, pairs):
+        """return a shortest path for each pair of nodes (source, target)
+
+        All paths are computed in a single BFS on the reversed graph,
+        starting from all targets at once.
+        implicit deps are also followed.
+
+        :param pairs: (iterable - tuple) (source, target) node names
+        :return dict: (source, target): list of node names from source to
+                      target, None if target is not reachable from source
+        """
+        paths = {}
+        wanted = defaultdict(set)  # target: sources
+        for source, target in pairs:
+            if source in self.nodes and target in self.nodes:
+                wanted[target].add(source)
+            else:
+                paths[source, target] = None
+        rdeps = self._reverse()
+        # target: dict node name: next node name on path to target
+        parents = {target: {target: None} for target in wanted}
+        remaining = sum(len(v) - (t in v) for t, v in wanted.items())
+        level = [(target, target) for target in wanted]
+        while level and remaining:
+            next_level = []
+            for name, target in level:
+                found = parents[target]
+                for dependent in rdeps[name]:
+                    if dependent in found:
+                        continue
+                    found[dependent] = name
+                    if dependent in wanted[target]:
+                        remaining -= 1
+                    next_level.append((dependent, target))
+            level = next_level
+
+        for target, sources in wanted.items():
+            found = parents[target]
+            for source in sources:
+                if source not in found:
+                    paths[source, target] = None
+                    continue
+                path = [source]
+                while path[-1] != target:
+                    path.append(found[path[-1]])
+                paths[source, target] = path
+        return paths
+
+    def dependents(self, targets):
+        """return names of all nodes that (directly or indirectly) depend on
+        any node in `targets`. implicit deps are also followed.
+
+        :param targets: (iterable - str) node names
+        :return: (set - str) including nodes from `targets` in the graph
+        """
+        rdeps = self._reverse()
+        done = set(name for name in targets if name in self.nodes)
+        todo = list(done)
+        while todo:
+            for name in rdeps[todo.pop()]:
+                if name not in done:
+                    done.add(name)
+                    todo.append(name)
+        return done
+
+
+    def levels(self):
+        '''return dependency level of every node
+
+        Nodes without deps are on level 0, other nodes are one level above
+        its highest dep.
+        All nodes in a cycle (strongly connected component) are on same level.
+        Uses Tarjan's algorithm, SCCs are found after all its deps.
+
+        :return dict: node name: (int) level
+        '''
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        levels = {}
+        for root in self.nodes.values():
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(root.deps))]
+            while work:
+                node, deps = work[-1]
+                for dep in deps:
+                    if dep not in index:
+                        index[dep] = lowlink[dep] = len(index)
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(dep.deps)))
+                        break
+                    if dep in on_stack:
+                        lowlink[node] = min(lowlink[node], index[dep])
+                else:
+                    # all deps from node processed
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] != index[node]:
+                        continue
+                    # node is root of a SCC
+                    scc = set()
+                    while node not in scc:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        scc.add(member)
+                    level = 0
+                    for member in scc:
+                        for dep in member.deps:
+                            if dep not in scc:
+                                level = max(level, levels[dep.name] + 1)
+                    for member in scc:
+                        levels[member.name] = level
+        return levels
+
+
     def topsort(self):
         '''return list of node names in topological order
 
         If A has deps [B, C]. We say that A is a target, B and C are sources
         '''
+        if self.order is not None:
+            return self.order()
         num_src = {}
         targets = defaultdict(list)
         for target in self.nodes.values():
@@ -156,6 +395,411 @@ class DepGraph(object):
 
 
 
+class GraphFile(object):
+    """versioned binary file with the import graph, read through `mmap`
+
+    Only the header is parsed on load, strings and edges are read
+    from the mapped file when accessed.
+
+    Layout (integers are unsigned 32 bits in native byte order,
+    header in little-endian)::
+
+      header: MAGIC, VERSION, BYTE_ORDER, number of nodes, number of
+              strings, number of edges, number of external edges,
+              number of module names, number of module paths,
+              digest of module index (16 bytes)
+      string offsets (strings + 1) + strings data (utf-8, padded)
+      imports: CSR offsets (nodes + 1) + node indexes (edges)
+      externals: CSR offsets (nodes + 1) + string indexes (external edges)
+      topological order of nodes (nodes)
+      module names: sorted names (names) + paths (names)
+      module paths: sorted paths (paths) + names (paths)
+
+    The first strings are the node names (sorted, so a node is found with
+    a binary search), followed by other strings (names of not watched
+    imported modules, dotted module names and paths).
+    Module names and paths are the ModuleIndex used to resolve imports.
+    """
+    MAGIC = b'PYINCGRF'
+    VERSION = 2
+    HEADER = struct.Struct('<8sIIIIIIII16s')
+    BYTE_ORDER = 1 if sys.byteorder == 'little' else 2
+
+    def __init__(self, path, data=None):
+        """
+        :param data: (bytes) graph file content (as returned by dumps()),
+                     if None it is read from `path`
+        :raise ValueError: not a graph file of this version
+        """
+        if data is None:
+            with open(path, 'rb') as fp:
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmap = data
+        if len(self._mmap) < self.HEADER.size:
+            raise ValueError('Invalid graph file: {}'.format(path))
+        (magic, version, byte_order, self.num_nodes, num_strings, num_edges,
+         num_externals, num_mod_names, num_mod_paths,
+         self.index_digest) = self.HEADER.unpack_from(self._mmap)
+        if (magic, version, byte_order) != (self.MAGIC, self.VERSION,
+                                            self.BYTE_ORDER):
+            raise ValueError('Invalid graph file: {}'.format(path))
+        view = memoryview(self._mmap)
+        pos = self.HEADER.size
+        def section(count):
+            nonlocal pos
+            data = view[pos:pos + 4 * count].cast('I')
+            pos += 4 * count
+            return data
+        self._offsets = section(num_strings + 1)
+        size = self._offsets[-1]
+        self._strings = view[pos:pos + size]
+        pos += size + (-size % 4)
+        self._deps_ptr = section(self.num_nodes + 1)
+        self._deps = section(num_edges)
+        self._ext_ptr = section(self.num_nodes + 1)
+        self._ext = section(num_externals)
+        self._order = section(self.num_nodes)
+        self._mod_names = section(num_mod_names)
+        self._mod_name_paths = section(num_mod_names)
+        self._mod_paths = section(num_mod_paths)
+        self._mod_path_names = section(num_mod_paths)
+        # decoded strings and lookups are cached, they are used repeatedly
+        self._names = {}  # number: name
+        self._found = {}  # name: number
+
+    @classmethod
+    def write(cls, path, imports, externals=None, module_index=None):
+        """write graph file (atomically), see dumps() for parameters"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(cls.dumps(imports, externals, module_index))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def dumps(cls, imports, externals=None, module_index=None):
+        """:return bytes: graph file content
+
+        :param imports: (dict) node name: list of direct deps names
+        :param externals: (dict) node name: list of imported external names
+        :param module_index: (ModuleIndex) saved to resolve imports
+                             without re-building the index
+        """
+        externals = externals or {}
+        names = sorted(imports)
+        index = {name: i for i, name in enumerate(names)}
+
+        strings = list(names)
+        def string_num(value):
+            num = index.get(value)
+            if num is None:
+                num = index[value] = len(strings)
+                strings.append(value)
+            return num
+
+        deps_ptr, deps = array('I', [0]), array('I')
+        ext_ptr, ext = array('I', [0]), array('I')
+        for name in names:
+            deps.extend(sorted(index[dep] for dep in imports[name]
+                               if dep in index))
+            deps_ptr.append(len(deps))
+            ext.extend(string_num(n) for n in externals.get(name, ()))
+            ext_ptr.append(len(ext))
+        order = array('I', (index[name] for name in
+                            DepGraph(imports).topsort() if name in index))
+
+        mod_names, mod_name_paths = array('I'), array('I')
+        mod_paths, mod_path_names = array('I'), array('I')
+        digest = b'\0' * 16
+        if module_index is not None:
+            digest = module_index.digest
+            mod_by_name, mod_by_path = module_index.to_dict()
+            for name in sorted(mod_by_name):
+                mod_names.append(string_num(name))
+                mod_name_paths.append(string_num(mod_by_name[name]))
+            for mod_path in sorted(mod_by_path):
+                mod_paths.append(string_num(mod_path))
+                mod_path_names.append(string_num(mod_by_path[mod_path]))
+
+        offsets = array('I', [0])
+        data = []
+        for value in strings:
+            encoded = value.encode('utf-8')
+            data.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+        data.append(b'\0' * (-offsets[-1] % 4))
+
+        chunks = [cls.HEADER.pack(
+            cls.MAGIC, cls.VERSION, cls.BYTE_ORDER, len(names),
+            len(strings), len(deps), len(ext), len(mod_names),
+            len(mod_paths), digest), offsets.tobytes()]
+        chunks.extend(data)
+        for section in (deps_ptr, deps, ext_ptr, ext, order,
+                        mod_names, mod_name_paths,
+                        mod_paths, mod_path_names):
+            chunks.append(section.tobytes())
+        return b''.join(chunks)
+
+    @classmethod
+    def is_valid(cls, path):
+        """check file exists and was created by this version"""
+        try:
+            with open(path, 'rb') as fp:
+                header = fp.read(cls.HEADER.size)
+        except OSError:
+            return False
+        return (len(header) == cls.HEADER.size and
+                cls.HEADER.unpack(header)[:3] == (cls.MAGIC, cls.VERSION,
+                                                  cls.BYTE_ORDER))
+
+    def name(self, num):
+        """:return str: name of node/string number `num`"""
+        name = self._names.get(num)
+        if name is None:
+            start, end = self._offsets[num], self._offsets[num + 1]
+            name = str(self._strings[start:end], 'utf-8')
+            self._names[num] = name
+        return name
+
+    def _bisect(self, nums, name):
+        """binary search on string numbers sorted by string value
+
+        :return int: position of `name` in `nums` or None
+        """
+        data = name.encode('utf-8')
+        strings, offsets = self._strings, self._offsets
+        low, high = 0, len(nums)
+        while low < high:
+            mid = (low + high) // 2
+            num = nums[mid]
+            if strings[offsets[num]:offsets[num + 1]].tobytes() < data:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(nums) and self.name(nums[low]) == name:
+            return low
+        return None
+
+    def find(self, name):
+        """:return int: number of node `name` or None"""
+        if name not in self._found:
+            self._found[name] = self._bisect(range(self.num_nodes), name)
+        return self._found[name]
+
+    def deps(self, num):
+        """:return: sequence with numbers of direct deps of node `num`"""
+        return self._deps[self._deps_ptr[num]:self._deps_ptr[num + 1]]
+
+    def _externals(self, num):
+        start, end = self._ext_ptr[num], self._ext_ptr[num + 1]
+        if start == end:
+            return []
+        return [self.name(i) for i in self._ext[start:end]]
+
+    def get_externals(self, name, default=()):
+        """:return list: imported external names of node `name`"""
+        num = self.find(name)
+        if num is None:
+            return default
+        return self._externals(num)
+
+    def to_dict(self):
+        """:return (dict, dict): node name: list of direct deps names,
+                                 node name: list of imported external names
+        """
+        imports = {}
+        externals = {}
+        for num in range(self.num_nodes):
+            name = self.name(num)
+            imports[name] = [self.name(dep) for dep in self.deps(num)]
+            externals[name] = self._externals(num)
+        return imports, externals
+
+    def topsort(self):
+        """:return list: node names in topological order"""
+        return [self.name(num) for num in self._order]
+
+    def module_path(self, name):
+        """:return str: path of module with dotted `name` or None"""
+        pos = self._bisect(self._mod_names, name)
+        if pos is None:
+            return None
+        return self.name(self._mod_name_paths[pos])
+
+    def module_name(self, path):
+        """:return str: dotted name of module from `path` or None"""
+        pos = self._bisect(self._mod_paths, path)
+        if pos is None:
+            return None
+        return self.name(self._mod_path_names[pos])
+
+    def modules(self):
+        """:return (dict, dict): module name: path, path: module name"""
+        by_name = {self.name(name): self.name(path) for name, path in
+                   zip(self._mod_names, self._mod_name_paths)}
+        by_path = {self.name(path): self.name(name) for path, name in
+                   zip(self._mod_paths, self._mod_path_names)}
+        return by_name, by_path
+
+
+class FileGNode(GNode):
+    """GNode with direct deps read from a GraphFile when first accessed"""
+    def __init__(self, name, num, nodes):
+        self._deps = None
+        self._num = num
+        self._nodes = nodes
+        GNode.__init__(self, name)
+
+    @property
+    def deps(self):
+        if self._deps is None:
+            self._deps = set(self._nodes.by_number(num) for num in
+                             self._nodes.graph_file.deps(self._num))
+        return self._deps
+
+    @deps.setter
+    def deps(self, value):
+        # GNode.__init__ sets an empty set, deps are loaded on access
+        if value:
+            self._deps = value
+
+
+class FileNodes(Mapping):
+    """nodes of a DepGraph, created from a GraphFile on access"""
+    def __init__(self, graph_file):
+        self.graph_file = graph_file
+        self._nodes = {}  # number: FileGNode
+
+    def by_number(self, num):
+        node = self._nodes.get(num)
+        if node is None:
+            node = FileGNode(self.graph_file.name(num), num, self)
+            self._nodes[num] = node
+        return node
+
+    def __getitem__(self, name):
+        num = self.graph_file.find(name)
+        if num is None:
+            raise KeyError(name)
+        return self.by_number(num)
+
+    def __contains__(self, name):
+        return self.graph_file.find(name) is not None
+
+    def __iter__(self):
+        return (self.graph_file.name(num)
+                for num in range(self.graph_file.num_nodes))
+
+    def __len__(self):
+        return self.graph_file.num_nodes
+
+    def values(self):
+        return (self.by_number(num)
+                for num in range(self.graph_file.num_nodes))
+
+    def items(self):
+        return ((node.name, node) for node in self.values())
+
+
+######### profiling
+
+class _NullPhase(object):
+    """phase context manager used when profiling is disabled"""
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+
+class Profiler(object):
+    '''record wall time, CPU time and counters of executed phases
+
+    Executions of phases with same name are aggregated on `stats`.
+    Counters `hit` and `miss` are reported as a cache hit rate.
+
+    :ivar stats: (dict) phase name: dict with calls, wall, cpu, counters
+    :ivar events: (list - dict) Chrome trace-event of every phase execution
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stats = {}
+        self.events = []
+        self._start = time.perf_counter()
+
+    def _stat(self, name):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = {
+                'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                'counters': defaultdict(int)}
+        return stat
+
+    def phase(self, name, **counters):
+        """context manager to record a phase execution
+
+        The dict returned on `with` can be used to add counters.
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        return self._phase(name, counters)
+
+    @contextlib.contextmanager
+    def _phase(self, name, counters):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield counters
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            stat = self._stat(name)
+            stat['calls'] += 1
+            stat['wall'] += wall
+            stat['cpu'] += cpu
+            for key, value in counters.items():
+                stat['counters'][key] += value
+            self.events.append({
+                'name': name, 'ph': 'X', 'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'ts': (start_wall - self._start) * 1e6,
+                'dur': wall * 1e6,
+                'args': dict(counters, cpu=cpu),
+            })
+
+    def count(self, name, **counters):
+        """add counters to a phase (without recording an execution)"""
+        if not self.enabled:
+            return
+        stat_counters = self._stat(name)['counters']
+        for key, value in counters.items():
+            stat_counters[key] += value
+
+    def summary(self):
+        """:return list - str: lines of table with phases stats"""
+        lines = ['{:<24} {:>7} {:>9} {:>9} {:>6}  {}'.format(
+            'phase', 'calls', 'wall(s)', 'cpu(s)', 'hit', 'counters')]
+        for name, stat in self.stats.items():
+            counters = dict(stat['counters'])
+            hit_rate = ''
+            if 'hit' in counters or 'miss' in counters:
+                total = counters.get('hit', 0) + counters.get('miss', 0)
+                if total:
+                    hit_rate = '{:.0%}'.format(counters.get('hit', 0) / total)
+            lines.append('{:<24} {:>7} {:>9.3f} {:>9.3f} {:>6}  {}'.format(
+                name, stat['calls'], stat['wall'], stat['cpu'], hit_rate,
+                ' '.join('{}={}'.format(k, v)
+                         for k, v in sorted(counters.items()))))
+        return lines
+
+    def write_trace(self, file_name):
+        """write JSON file in Chrome trace-event format"""
+        with open(file_name, 'w') as fp:
+            json.dump({'traceEvents': self.events,
+                       'displayTimeUnit': 'ms'}, fp)
+
+
 ######### start doit section
 
 def gen_after(name, after_task):
@@ -171,27 +815,383 @@ def gen_after(name, after_task):
     return decorated
 
 
+def stdlib_modules():
+    """:return set - str: top-level names of modules from standard library
+
+    Before python 3.10 (no `sys.stdlib_module_names`) names are taken from
+    the content of the standard library folders.
+    """
+    if hasattr(sys, 'stdlib_module_names'):
+        return set(sys.stdlib_module_names)
+    names = set(sys.builtin_module_names)
+    stdlib = sysconfig.get_paths()['stdlib']
+    for folder in (stdlib, os.path.join(stdlib, 'lib-dynload')):
+        try:
+            entries = os.listdir(folder)
+        except OSError:
+            continue
+        for entry in entries:
+            # i.e. `json`, `os.py`, `_ssl.cpython-39-x86_64-linux-gnu.so`
+            name = entry.split('.', 1)[0]
+            if name.isidentifier() and name != '__pycache__':
+                if '.' in entry or os.path.isdir(os.path.join(folder, entry)):
+                    names.add(name)
+    return names
+
+STDLIB_MODULES = stdlib_modules()
+
+
+class Distributions(object):
+    """versions of installed distributions (third-party packages)
+
+    Uses `importlib.metadata.packages_distributions()` (python 3.10+ or
+    package `importlib_metadata`), if not available no distributions
+    are found.
+
+    Reading the metadata of all installed distributions is slow,
+    so the result is cached while the modification time of the
+    folders in `sys.path` does not change.
+
+    :ivar cache: (dict) keys `key`, `packages`, `versions`, saved in the
+                 state file by IncrementalControl
+    :ivar modified: (bool) cache was modified and must be saved
+    """
+    def __init__(self, profiler=None, exclude=()):
+        """
+        :param exclude: (list - str) folders ignored when computing the
+                        cache key (watched folders are modified often)
+        """
+        self.profiler = profiler or Profiler(enabled=False)
+        self.exclude = tuple(os.path.join(os.path.abspath(p), '')
+                             for p in exclude)
+        self.cache = None
+        self.modified = False
+        self._packages = None  # top-level name: list of distribution names
+        self._versions = {}  # distribution name: version
+        self._module = None  # importlib.metadata module
+
+    def cache_key(self):
+        """:return str: digest of modification time of `sys.path` folders"""
+        stamps = []
+        for path in sys.path:
+            path = os.path.abspath(path or os.curdir)
+            if os.path.join(path, '').startswith(self.exclude):
+                continue
+            try:
+                stamps.append([path, os.stat(path).st_mtime_ns])
+            except OSError:
+                continue
+        data = json.dumps(stamps).encode('utf-8')
+        return hashlib.md5(data).hexdigest()
+
+    def _load(self):
+        with self.profiler.phase('distributions') as info:
+            key = self.cache_key()
+            if self.cache and self.cache.get('key') == key:
+                self._packages = self.cache['packages']
+                self._versions = self.cache['versions']
+                info['cached'] = 1
+            else:
+                self._load_packages()
+                self.cache = {'key': key, 'packages': self._packages,
+                              'versions': self._versions}
+                self.modified = True
+            info['packages'] = len(self._packages)
+
+    @staticmethod
+    def _metadata():
+        """:return module: `importlib.metadata` or `importlib_metadata`
+        with `packages_distributions()`, None if not available
+        """
+        try:
+            from importlib import metadata
+        except ImportError: # pragma: no cover
+            metadata = None
+        if not hasattr(metadata, 'packages_distributions'):
+            try:
+                import importlib_metadata as metadata
+            except ImportError:
+                return None
+        return metadata
+
+    def _load_packages(self):
+        metadata = self._metadata()
+        if metadata is None:
+            self._packages = {}
+            return
+        self._module = metadata
+        self._packages = metadata.packages_distributions()
+
+    def _version(self, dist):
+        """:return str: version of distribution, None if not installed
+        (removed after the cache was loaded) or its metadata is broken
+        """
+        if self._module is None:
+            self._module = self._metadata()
+        try:
+            return self._module.version(dist)
+        except self._module.PackageNotFoundError:
+            return None
+
+    def versions(self, names):
+        """:param names: (iterable - str) top-level name of imported modules
+        :return dict: distribution name: version
+        """
+        if self._packages is None:
+            self._load()
+        result = {}
+        for name in names:
+            for dist in self._packages.get(name, ()):
+                if dist not in self._versions:
+                    self._versions[dist] = self._version(dist)
+                    self.modified = True
+                result[dist] = self._versions[dist]
+        return result
+
+
+def get_environment(env_vars=(), plugins=()):
+    """describe environment where tests are executed
+
+    :param env_vars: (list - str) name of relevant environment variables
+    :param plugins: (list - str) plugins from command line (`-p`)
+    :return dict:
+    """
+    return {
+        'python': '{} {}.{}'.format(platform.python_implementation(),
+                                    *sys.version_info[:2]),
+        # virtualenvs with same python version have different packages
+        'prefix': sys.prefix,
+        'env': {name: os.environ.get(name) for name in env_vars},
+        'plugins': sorted(plugins),
+    }
+
+def outdated_name(test, env_key=None):
+    """name of `outdated` sub-task for a test file"""
+    if env_key is None:
+        return test
+    return '{}@{}'.format(test, env_key)
+
+HEX_DIGITS = '0123456789abcdef'
+
+def split_outdated_name(name):
+    """inverse of outdated_name()
+    :return tuple: (test path, env key or None)
+    """
+    test, sep, env_key = name.rpartition('@')
+    if sep and len(env_key) == 12 and not env_key.strip(HEX_DIGITS):
+        return test, env_key
+    return name, None
+
+
+class ModuleIndex(object):
+    """resolve dotted module names to watched python modules
+
+    Built from the list of discovered files, the file system is not
+    accessed: a folder is a package if its `__init__.py` was discovered.
+    Besides the name given by its packages, modules are also found by
+    its path relative to a source root (a watched folder or its `src`
+    folder), this includes namespace packages (folders without
+    `__init__.py`).
+
+    :ivar by_name: (dict) dotted name: path
+    :ivar by_path: (dict) path: dotted name (given by its packages)
+    :ivar digest: (bytes) digest of files and source roots
+    """
+    def __init__(self, py_files, source_roots=()):
+        files = set(py_files)
+        self.digest = self.get_digest(files, source_roots)
+        self.by_name = {}
+        self.by_path = {}
+        packages = {}  # folder path: list of package names
+        def get_package(dir_path):
+            fqn = packages.get(dir_path)
+            if fqn is None:
+                fqn = []
+                parent = os.path.dirname(dir_path)
+                if (parent != dir_path and
+                        os.path.join(dir_path, '__init__.py') in files):
+                    fqn = get_package(parent) + [os.path.basename(dir_path)]
+                packages[dir_path] = fqn
+            return fqn
+
+        for path in sorted(files):
+            dir_path, file_name = os.path.split(path)
+            fqn = get_package(dir_path) + [file_name[:-3]]
+            name = '.'.join(fqn)
+            self.by_path[path] = name
+            self.by_name.setdefault(name, path)
+            if fqn[-1] == '__init__' and len(fqn) > 1:
+                # package takes precedence over module with same name
+                self.by_name['.'.join(fqn[:-1])] = path
+
+        for root in source_roots:
+            for base in (root, os.path.join(root, 'src')):
+                prefix = os.path.join(base, '')
+                for path in sorted(files):
+                    if not path.startswith(prefix):
+                        continue
+                    parts = path[len(prefix):-3].split(os.sep)
+                    if parts[-1] == '__init__' and len(parts) > 1:
+                        parts.pop()
+                    self.by_name.setdefault('.'.join(parts), path)
+
+    @staticmethod
+    def get_digest(files, source_roots=()):
+        """:return bytes: digest used to check a saved index is valid"""
+        data = json.dumps([sorted(files), list(source_roots)])
+        return hashlib.md5(data.encode('utf-8')).digest()
+
+    def __contains__(self, path):
+        return path in self.by_path
+
+    def fqn(self, path):
+        """:return list - str: full qualified name of module from `path`"""
+        return self.by_path[path].split('.')
+
+    def resolve(self, name):
+        """get path of imported module
+
+        :param name: (str) dotted name of imported module or of an object
+                     from the module (`from module import obj`)
+        :return str: path or None if not a watched module
+        """
+        path = self.by_name.get(name)
+        if path is None and '.' in name:
+            path = self.by_name.get(name.rsplit('.', 1)[0])
+        return path
+
+    def package_init(self, path):
+        """:return str: path of `__init__.py` from package of module `path`
+                        or None (not part of a package)
+        """
+        dir_path = os.path.dirname(path)
+        if os.path.basename(path) == '__init__.py':
+            dir_path = os.path.dirname(dir_path)
+        init = os.path.join(dir_path, '__init__.py')
+        return init if init in self else None
+
+    def to_dict(self):
+        """:return (dict, dict): by_name, by_path"""
+        return self.by_name, self.by_path
+
+
+class FileModuleIndex(ModuleIndex):
+    """ModuleIndex read from a GraphFile (on demand)"""
+    def __init__(self, graph_file):
+        self.graph_file = graph_file
+        self.digest = graph_file.index_digest
+        self._by_path = {}  # cache of path: dotted name
+
+    def __contains__(self, path):
+        return self._name(path) is not None
+
+    def _name(self, path):
+        if path not in self._by_path:
+            self._by_path[path] = self.graph_file.module_name(path)
+        return self._by_path[path]
+
+    def fqn(self, path):
+        return self._name(path).split('.')
+
+    def resolve(self, name):
+        path = self.graph_file.module_path(name)
+        if path is None and '.' in name:
+            path = self.graph_file.module_path(name.rsplit('.', 1)[0])
+        return path
+
+    def to_dict(self):
+        return self.graph_file.modules()
+
+
 class PyTasks(object):
     """generate doit tasks related to python modules import dependencies
 
-    :ivar ModuleSet py_mods:
+    :cvar int GET_DEP_VERSION: changing it forces re-computation of
+                               saved import info
     :ivar py_files: (list - str) files being watched for changes
-    :ivar json_file str: name of intermediate file with import info from all
-                         modules
+    :ivar source_roots: (list - str) folders used as roots to find modules
+                        by its path (see ModuleIndex)
+    :ivar graph_file str: name of intermediate file with import info from
+                          all modules (see GraphFile)
+    :ivar externals: (GraphFile) `get_externals(path)` returns top-level
+                     names of imported modules not being watched
+                     (set by create_graph())
+    :ivar Profiler profiler:
+    :ivar deps_format: (str) format used by `print-deps`
+                       (see DepGraph.write_deps())
+    :ivar deps_filter: (str) `print-deps` only for 'tests' or modules
+                       from given path
+    :ivar roots: (list - str) if not None, only modules reachable from
+                 `roots` are analysed (see find_scope())
+    :ivar scope: (set - str) modules analysed, None for all `py_files`.
+                 Computed from `roots` when tasks are generated.
+    :ivar prefetch: (Prefetch) if not None, module index and imports
+                    parsed on background are used
+    :ivar readonly: (bool) graph file is not written, if imports were
+                    modified the graph is kept in memory
+    :ivar dep_manager: (doit.dependency.Dependency) if not None, find_scope()
+                       uses imports from the graph file for modules not
+                       modified since its `get_dep` task was executed
     """
-    def __init__(self, py_files, json_file='deps.json'):
-        self.json_file = json_file
+    GET_DEP_VERSION = 3
+
+    def __init__(self, py_files, graph_file='deps.graph', profiler=None,
+                 deps_format='text', deps_filter=None, roots=None,
+                 scope=None, source_roots=(), prefetch=None, readonly=False):
+        self.graph_file = graph_file
+        self.readonly = readonly
+        self._graph_data = None  # graph file content not written (readonly)
+        self.source_roots = list(source_roots)
+        self.roots = roots
+        self.scope = scope
+        self.deps_format = deps_format
+        self.deps_filter = deps_filter
+        self.test_files = None
+        self.profiler = profiler or Profiler(enabled=False)
         self.py_files = list(set(py_files))
-        self.py_mods = ModuleSet(self.py_files)
+        self._py_mods = None # ModuleIndex created on first use
+        self._index_digest = None
+        self.externals = None
         self._graph = None # DepGraph cached on first use
+        self._get_dep_executed = False
+        self._imports = {}  # path: import info, modules parsed on this run
+        self.dep_manager = None
+        if prefetch is not None:
+            self._imports.update(prefetch.join())
+            self._py_mods = prefetch.tasks.py_mods
 
 
     def create_graph(self):
-        """create Graph from json file"""
-        with open(self.json_file) as fp:
-            deps = json.load(fp)
-        return DepGraph(deps)
+        """create Graph from graph file"""
+        with self.profiler.phase('create-graph') as info:
+            self.externals = GraphFile(self.graph_file, self._graph_data)
+            info['nodes'] = self.externals.num_nodes
+            return DepGraph.from_file(self.externals)
+
 
+    @property
+    def index_digest(self):
+        """digest of watched files, see ModuleIndex.get_digest()"""
+        if self._index_digest is None:
+            self._index_digest = ModuleIndex.get_digest(self.py_files,
+                                                        self.source_roots)
+        return self._index_digest
+
+    @property
+    def py_mods(self):
+        """ModuleIndex, read from graph file if saved for same files"""
+        if self._py_mods is None:
+            with self.profiler.phase('module-index') as info:
+                if GraphFile.is_valid(self.graph_file):
+                    graph_file = GraphFile(self.graph_file)
+                    if graph_file.index_digest == self.index_digest:
+                        self._py_mods = FileModuleIndex(graph_file)
+                        info['saved'] = 1
+                if self._py_mods is None:
+                    self._py_mods = ModuleIndex(self.py_files,
+                                                self.source_roots)
+                    info['files'] = len(self.py_files)
+        return self._py_mods
 
     @property
     def graph(self):
@@ -204,27 +1204,162 @@ class PyTasks(object):
     def action_get_dep(self, module_path):
         """action: return list of direct imports from a single py module
 
-        :return dict: single value 'imports', value set of str file paths
+        :return dict: 'imports': list of str file paths,
+                      'externals': list of top-level names of imported
+                                   modules not being watched (non stdlib)
         """
-        mod = self.py_mods.by_path[module_path]
-        return {'imports': list(str(s) for s in self.py_mods.get_imports(mod))}
-
+        self._get_dep_executed = True
+        return self.get_imports(module_path)
+
+    def get_imports(self, module_path):
+        """parse module imports, result is cached (see action_get_dep())"""
+        info = self._imports.get(module_path)
+        if info is None:
+            info = self._parse_imports(module_path)
+            self._imports[module_path] = info
+        return info
+
+    def _parse_imports(self, module_path):
+        with self.profiler.phase('get_dep', files=1):
+            py_mods = self.py_mods
+            fqn = py_mods.fqn(module_path)
+            with open(module_path, 'rb') as fp:
+                tree = ast.parse(fp.read(), module_path)
+            imports = set()
+            # importing a module executes `__init__` from its package
+            init = py_mods.package_init(module_path)
+            if init:
+                imports.add(init)
+            externals = set()
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Import):
+                    names = [alias.name for alias in node.names]
+                    level = 0
+                elif isinstance(node, ast.ImportFrom):
+                    level = node.level
+                    names = ['.'.join(s for s in (node.module, alias.name)
+                                      if s)
+                             for alias in node.names]
+                else:
+                    continue
+                for name in names:
+                    if level:
+                        name = '.'.join(fqn[:-level] + [name])
+                    imported = py_mods.resolve(name)
+                    if imported:
+                        imports.add(imported)
+                    elif not level:
+                        externals.add(name.split('.')[0])
+            externals.difference_update(STDLIB_MODULES)
+            return {'imports': list(imports), 'externals': sorted(externals)}
+
+
+    def scope_deps(self, path):
+        """:return list: modules that are deps of `path` but not imported"""
+        return []
+
+    def _saved_imports(self):
+        """imports saved in the graph file of modules not modified since
+        its `get_dep` task was executed
+
+        :return function: path -> list of imported paths,
+                          None if the module must be parsed
+        """
+        def not_saved(path):
+            return None
+        if self.dep_manager is None or not GraphFile.is_valid(self.graph_file):
+            return not_saved
+        graph_file = GraphFile(self.graph_file)
+        if graph_file.index_digest != self.index_digest:
+            return not_saved  # watched files changed, get_dep is executed
+        backend = self.dep_manager.backend
+        checker = self.dep_manager.checker
+        def saved(path):
+            num = graph_file.find(path)
+            state = backend.get('get_dep:' + path, path)
+            if num is None or state is None:
+                return None
+            try:
+                if checker.check_modified(path, os.stat(path), state):
+                    return None
+            except OSError:
+                return None
+            return [graph_file.name(dep) for dep in graph_file.deps(num)]
+        return saved
+
+    def find_scope(self, roots):
+        """find modules reachable from `roots`
+
+        Only modules modified since the graph file was written are parsed.
+
+        :param roots: (iterable - str) path of modules
+        :return set - str: path of modules
+        """
+        with self.profiler.phase('scope') as info:
+            py_mods = self.py_mods
+            saved = self._saved_imports()
+            scope = set()
+            todo = [path for path in roots if path in py_mods]
+            info['saved'] = 0
+            while todo:
+                path = todo.pop()
+                if path in scope:
+                    continue
+                scope.add(path)
+                imports = None
+                if path not in self._imports:
+                    imports = saved(path)
+                if imports is None:
+                    imports = self.get_imports(path)['imports']
+                else:
+                    info['saved'] += 1
+                todo.extend(imports)
+                todo.extend(self.scope_deps(path))
+            info['modules'] = len(scope)
+        return scope
+
+    def action_write_graph(self, imports):
+        """write graph file with direct imports of all modules
+
+        If only a `scope` was analysed, other modules keep import info
+        from the previous graph file.
+        """
+        with self.profiler.phase('dep-graph', files=len(imports)):
+            externals = {k: v.get('externals', []) for k, v in imports.items()}
+            imports = {k: v['imports'] for k, v in imports.items()}
+            if self.scope is not None and GraphFile.is_valid(self.graph_file):
+                old_imports, old_externals = GraphFile(
+                    self.graph_file).to_dict()
+                for name, deps in old_imports.items():
+                    if name not in imports and name in self.py_mods:
+                        imports[name] = deps
+                        externals[name] = old_externals[name]
+            if self.readonly:
+                self._graph_data = GraphFile.dumps(imports, externals,
+                                                   self.py_mods)
+            else:
+                GraphFile.write(self.graph_file, imports, externals,
+                                self.py_mods)
 
-    def action_write_json_deps(self, imports):
-        """write JSON file with direct imports of all modules"""
-        result = {k: v['imports'] for k, v in imports.items()}
-        with open(self.json_file, 'w') as fp:
-            json.dump(result, fp)
+    def check_graph_uptodate(self, task, values):
+        """graph file is up-to-date if no import info was modified"""
+        return (not self._get_dep_executed and
+                GraphFile.is_valid(self.graph_file))
 
     def gen_deps(self):
         """generate doit tasks to find imports
 
         generated tasks:
             * get_dep:<path> => find imported moudules
-            * dep-json => save import info in a JSON file
+            * dep-graph => save import info in a graph file
         """
-        watched_modules = str(list(sorted(self.py_files)))
-        for mod in self.py_files:
+        # saved by every get_dep task, use a digest not the list of files
+        watched_modules = '{}:{}'.format(self.GET_DEP_VERSION,
+                                         self.index_digest.hex())
+        if self.scope is None and self.roots is not None:
+            self.scope = self.find_scope(self.roots)
+        modules = self.py_files if self.scope is None else sorted(self.scope)
+        for mod in modules:
             # direct dependencies
             yield {
                 'basename': 'get_dep',
@@ -234,37 +1369,41 @@ class PyTasks(object):
                 'uptodate': [config_changed(watched_modules)],
                 }
 
-        # Create an intermediate json file with import information.
+        # Create an intermediate file with import information.
         # It is required to create an intermediate file because DelayedTasks
         # can not have get_args to use values from other tasks.
         yield {
-            'basename': 'dep-json',
-            'actions': [self.action_write_json_deps],
+            'basename': 'dep-graph',
+            'actions': [self.action_write_graph],
             'task_dep': ['get_dep'],
             'getargs': {'imports': ('get_dep', None)},
-            'targets': [self.json_file],
-            'doc': 'save dep info in {}'.format(self.json_file),
+            'targets': [self.graph_file],
+            'uptodate': [config_changed(watched_modules),
+                         self.check_graph_uptodate],
+            'doc': 'save dep info in {}'.format(self.graph_file),
         }
 
 
-    @staticmethod
-    def action_print_dependencies(node):
-        '''print a node's name and its dependencies to SDTOUT'''
-        node_list = sorted(n.name for n in node.all_deps())
-        node_path = os.path.relpath(node.name)
-        deps_path = (os.path.relpath(p) for p in node_list)
-        print(' - {}: {}'.format(node_path, ', '.join(deps_path)))
-
-    @gen_after(name='print-deps', after_task='dep-json')
+    def action_print_dependencies(self):
+        '''print all nodes and its dependencies to SDTOUT'''
+        names = None
+        if self.deps_filter == 'tests':
+            names = self.test_files or []
+        elif self.deps_filter:
+            prefix = os.path.abspath(self.deps_filter)
+            names = [name for name in self.graph.nodes
+                     if name == prefix or
+                     name.startswith(os.path.join(prefix, ''))]
+        self.graph.write_deps(sys.stdout, self.deps_format, names)
+
+    @gen_after(name='print-deps', after_task='dep-graph')
     def gen_print_deps(self):
-        '''create tasks for printing node info to STDOUT'''
-        for node in self.graph.nodes.values():
-            yield {
-                'basename': 'print-deps',
-                'name': node.name,
-                'actions': [(self.action_print_dependencies, [node])],
-                'verbosity': 2,
-            }
+        '''create task for printing node info to STDOUT'''
+        yield {
+            'basename': 'print-deps',
+            'actions': [self.action_print_dependencies],
+            'verbosity': 2,
+        }
 
 
 
@@ -275,17 +1414,17 @@ class PyTasks(object):
             graph.write_dot(fp)
 
 
-    @gen_after(name='dep-dot', after_task='dep-json')
+    @gen_after(name='dep-dot', after_task='dep-graph')
     def gen_dep_graph_dot(self, dot_file='deps.dot'):
         """generate tasks for creating a `dot` graph of module imports"""
         yield {
             'basename': 'dep-dot',
             'actions': [(self.action_write_dot, ['deps.dot', self.graph])],
-            'file_dep': [self.json_file],
+            'file_dep': [self.graph_file],
             'targets': [dot_file],
         }
 
-    @gen_after(name='dep-image', after_task='dep-json')
+    @gen_after(name='dep-image', after_task='dep-graph')
     def gen_dep_graph_image(self, dot_file='deps.dot', img_file='deps.svg'):
         # generate SVG with bottom-up tree
         dot_cmd = 'dot -Tsvg '
@@ -299,42 +1438,300 @@ class PyTasks(object):
 
 
 
+class ConftestFixtures(object):
+    """fingerprint of each fixture defined in a conftest file
+
+    Module code not in a fixture (imports, hooks, helpers) is fingerprinted
+    as a pseudo-fixture named `MODULE_CODE` that is always used.
+    Fingerprints are taken from the AST, so changes in comments or
+    formatting are ignored.
+
+    Modules imported at module level are executed when the conftest is
+    loaded, so they are dependencies of `MODULE_CODE`.
+    Only modules imported inside a fixture body are narrowed to the fixture.
+
+    :ivar fingerprints: (dict) fixture name: (str) md5
+    :ivar imports: (dict) fixture name: (set - str) path of modules imported
+                   by the fixture code
+    """
+    MODULE_CODE = ''
+
+    def __init__(self, path, py_mods):
+        with open(path) as fp:
+            tree = ast.parse(fp.read(), path)
+        fqn = py_mods.fqn(path)
+
+        self.fingerprints = {}
+        self.imports = defaultdict(set)
+        module_code = []
+        for stmt in tree.body:
+            name = self._fixture_name(stmt)
+            if name is None:
+                module_code.append(stmt)
+                continue
+            self._add(name, [stmt])
+            self.imports[name].update(
+                self._imported(ast.walk(stmt), fqn, py_mods))
+        self._add(self.MODULE_CODE, module_code)
+        self.imports[self.MODULE_CODE].update(
+            self._imported(tree.body, fqn, py_mods))
+        # fixtures from plugins might be used by any test
+        for plugin in self._plugins(tree):
+            imported = py_mods.resolve(plugin)
+            if imported:
+                self.imports[self.MODULE_CODE].add(imported)
+
+    def _add(self, name, stmts):
+        dump = ''.join(ast.dump(stmt) for stmt in stmts)
+        self.fingerprints[name] = hashlib.md5(dump.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _imported(nodes, fqn, py_mods):
+        """:return set - str: path of modules imported by import nodes"""
+        imported = set()
+        for node in nodes:
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ''
+                if node.level:
+                    parts = fqn[:-node.level] + ([base] if base else [])
+                    base = '.'.join(parts)
+                names = ['.'.join(p for p in (base, alias.name) if p)
+                         for alias in node.names]
+            else:
+                continue
+            for name in names:
+                path = py_mods.resolve(name)
+                if path:
+                    imported.add(path)
+        return imported
+
+    @staticmethod
+    def _plugins(tree):
+        """:return list - str: module names from `pytest_plugins`"""
+        plugins = []
+        for stmt in tree.body:
+            if not isinstance(stmt, ast.Assign):
+                continue
+            if not any(isinstance(target, ast.Name) and
+                       target.id == 'pytest_plugins'
+                       for target in stmt.targets):
+                continue
+            values = getattr(stmt.value, 'elts', [stmt.value])
+            for value in values:
+                # ast.Str on python < 3.8
+                name = getattr(value, 'value', getattr(value, 's', None))
+                if isinstance(name, str):
+                    plugins.append(name)
+        return plugins
+
+    @staticmethod
+    def _fixture_name(stmt):
+        """:return str: name of fixture defined by stmt or None"""
+        if not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            return None
+        for decorator in stmt.decorator_list:
+            func = decorator.func if isinstance(decorator, ast.Call) else decorator
+            func_name = getattr(func, 'attr', None) or getattr(func, 'id', None)
+            if func_name not in ('fixture', 'yield_fixture'):
+                continue
+            for keyword in getattr(decorator, 'keywords', []):
+                # ast.Str on python < 3.8
+                value = getattr(keyword.value, 'value',
+                                getattr(keyword.value, 's', None))
+                if keyword.arg == 'name' and isinstance(value, str):
+                    return value
+            return stmt.name
+        return None
+
+    def get_used(self, fixture_names):
+        """get fingerprints and imports of used fixtures
+        :param fixture_names: (iterable - str) fixtures used by a test file
+        :return (dict, set): fixture name: md5, imported paths
+        """
+        used = set(fixture_names)
+        used.add(self.MODULE_CODE)
+        fingerprints = {}
+        imports = set()
+        for name in used:
+            if name in self.fingerprints:
+                fingerprints[name] = self.fingerprints[name]
+                imports.update(self.imports.get(name, ()))
+        return fingerprints, imports
+
+
 class IncrementalTasks(PyTasks):
-    """Manage creation of all tasks for pytest-incremental plugin"""
+    """Manage creation of all tasks for pytest-incremental plugin
+
+    :ivar fixtures: (dict) test path: list of fixture names used by the test
+                    or None if fixture-level conftest dependencies is disabled
+    :ivar extra_deps: (dict) test path: list of non-python file dependencies
+    :ivar observed: (dict) test path: list of files used on execution
+    :ivar distributions: (Distributions) if not None, tests depend on
+                         version of third-party packages in its imports
+    :ivar env_key: (str) environment key, results of outdated tasks
+                   are saved separately for each environment
+    """
 
-    def __init__(self, pyfiles, test_files=None, **kwargs):
+    def __init__(self, pyfiles, test_files=None, fixtures=None,
+                 extra_deps=None, observed=None, distributions=None,
+                 env_key=None, **kwargs):
         PyTasks.__init__(self, pyfiles, **kwargs)
+        self.env_key = env_key
         self.test_files = test_files
+        self.fixtures = fixtures
+        self.extra_deps = extra_deps or {}
+        self.observed = observed or {}
+        self.distributions = distributions
+        self._conftest_fixtures = {}  # path: ConftestFixtures
 
     def create_graph(self):
-        """overwrite to add implicit dep to conftest file"""
+        """overwrite to add implicit dep to conftest file
+
+        A module depends on all `conftest.py` from its folder and
+        parent folders.
+        """
         graph = super(IncrementalTasks, self).create_graph()
-        conftest = [mod for mod in graph.nodes.keys()
-                    if mod.endswith('conftest.py')]
-        for conf in conftest:
-            conftest_node = graph.nodes[conf]
-            base_dir = os.path.dirname(conf)
-            for path, node in graph.nodes.items():
-                if path.startswith(base_dir) and path != conf:
-                    node.implicit_deps.append(conftest_node)
+        # python modules observed on test execution are deps of test module
+        for test, paths in self.observed.items():
+            node = graph.nodes.get(test)
+            if node is None:
+                continue
+            for path in paths:
+                dep = graph.nodes.get(path)
+                if dep is not None and dep is not node:
+                    node.add_dep(dep)
+        with self.profiler.phase('conftest-deps') as info:
+            if self.scope is None:
+                nodes = list(graph.nodes.items())
+            else:
+                nodes = [(path, graph.nodes[path]) for path in self.scope
+                         if path in graph.nodes]
+            conftests = {}  # dir path: conftest node
+            for path, node in nodes:
+                if os.path.basename(path) == 'conftest.py':
+                    conftests[os.path.dirname(path)] = node
+            info['conftests'] = len(conftests)
+            if not conftests:
+                return graph
+
+            # dir path: list of conftest nodes from dir and its parents
+            chains = {}
+            def get_chain(dir_path):
+                chain = chains.get(dir_path)
+                if chain is None:
+                    parent = os.path.dirname(dir_path)
+                    chain = [] if parent == dir_path else get_chain(parent)
+                    if dir_path in conftests:
+                        chain = [conftests[dir_path]] + chain
+                    chains[dir_path] = chain
+                return chain
+
+            for path, node in nodes:
+                for conftest_node in get_chain(os.path.dirname(path)):
+                    if conftest_node is not node:
+                        node.implicit_deps.append(conftest_node)
         return graph
 
+    def scope_deps(self, path):
+        """conftest files from module folder and its parents, and
+        python modules observed on test execution
+        """
+        py_mods = self.py_mods
+        deps = [p for p in self.observed.get(path, ()) if p in py_mods]
+        dir_path = os.path.dirname(path)
+        while True:
+            conftest = os.path.join(dir_path, 'conftest.py')
+            if conftest in py_mods and conftest != path:
+                deps.append(conftest)
+            parent = os.path.dirname(dir_path)
+            if parent == dir_path:
+                return deps
+            dir_path = parent
+
     def check_success(self):
         """check if task should succeed based on GLOBAL parameter"""
         return doit_cmd.get_var('success', False)
 
-    @gen_after(name='outdated', after_task='dep-json')
+    def _explicit_deps(self, node):
+        """:return set - str: all deps from node, without implicit deps"""
+        done = set([node.name])
+        todo = [node]
+        while todo:
+            for dep in todo.pop().deps:
+                if dep.name not in done:
+                    done.add(dep.name)
+                    todo.append(dep)
+        return done
+
+    def get_fixture_deps(self, test, used):
+        """get dependencies of a test file including from its conftest files
+        only code from used fixtures (and their imports)
+
+        :param used: (list - str) fixtures used by the test file
+        :return (set - str, dict): file deps, conftest path: used fixtures
+                                   fingerprints
+        """
+        nodes = self.graph.nodes
+        node = nodes[test]
+        file_deps = self._explicit_deps(node)
+        fingerprints = {}
+        for conftest in node.implicit_deps:
+            if conftest.name in file_deps:
+                continue  # explicitly imported, depends on whole file
+            info = self._conftest_fixtures.get(conftest.name)
+            if info is None:
+                info = ConftestFixtures(conftest.name, self.py_mods)
+                self._conftest_fixtures[conftest.name] = info
+            fingerprints[conftest.name], imports = info.get_used(used)
+            for path in imports:
+                if path in nodes:
+                    file_deps.update(self._explicit_deps(nodes[path]))
+                else:  # not in scope of --inc-demand
+                    file_deps.add(path)
+        return file_deps, fingerprints
+
+    @gen_after(name='outdated', after_task='dep-graph')
     def gen_outdated(self):
         """generate tasks used by py.test to keep-track of successful results"""
         nodes = self.graph.nodes
+        with self.profiler.phase('closures') as info:
+            file_deps = {test: [n.name for n in nodes[test].all_deps()]
+                         for test in self.test_files}
+            info['tests'] = len(file_deps)
+            info['deps'] = sum(len(deps) for deps in file_deps.values())
         for test in self.test_files:
-            yield {
+            task = {
                 'basename': 'outdated',
-                'name': test,
+                'name': outdated_name(test, self.env_key),
                 'actions': [self.check_success],
-                'file_dep': [n.name for n in nodes[test].all_deps()],
+                'file_dep': file_deps[test],
                 'verbosity': 0,
                 }
+            # values saved by config_changed
+            config = {}
+            used = (self.fixtures or {}).get(test)
+            if used is not None:
+                deps, fingerprints = self.get_fixture_deps(test, used)
+                task['file_dep'] = list(deps)
+                config['fixtures'] = fingerprints
+            if self.distributions is not None:
+                names = set()
+                for path in file_deps[test]:
+                    names.update(self.externals.get_externals(path))
+                versions = self.distributions.versions(names)
+                if versions:
+                    config['distributions'] = versions
+            if config:
+                task['uptodate'] = [config_changed(config)]
+            extra = set(self.extra_deps.get(test, ()))
+            # observed files that are not python modules
+            extra.update(p for p in self.observed.get(test, ())
+                         if p not in nodes and os.path.exists(p))
+            if extra:
+                task['file_dep'] = task['file_dep'] + list(extra)
+            yield task
 
     def create_doit_tasks(self):
         '''create all tasks used by the incremental plugin
@@ -348,15 +1745,44 @@ class IncrementalTasks(PyTasks):
 
 
 
-class OutdatedReporter(ZeroReporter):
-    """A doit reporter specialized to return list of outdated tasks"""
+class CountReporter(ZeroReporter):
+    """A doit reporter that counts executed and up-to-date tasks
+
+    :ivar stats: (dict) task basename: dict with keys `hit` (up-to-date) and
+                 `miss` (executed)
+    """
     def __init__(self, outstream, options):
-        self.outdated = []
         self.outstream = outstream
+        self.stats = defaultdict(lambda: {'hit': 0, 'miss': 0})
+
+    def _count(self, task, key):
+        # group tasks do not check dependencies, dont count them
+        if not task.has_subtask:
+            self.stats[task.name.split(':', 1)[0]][key] += 1
+
+    def execute_task(self, task):
+        self._count(task, 'miss')
+
+    def skip_uptodate(self, task):
+        self._count(task, 'hit')
+
+
+class OutdatedReporter(CountReporter):
+    """A doit reporter specialized to return list of outdated tasks
+
+    :ivar changed: (dict) test path: list of modified files since last success
+    """
+    def __init__(self, outstream, options):
+        CountReporter.__init__(self, outstream, options)
+        self.outdated = []
+        self.changed = {}
 
     def execute_task(self, task):
+        CountReporter.execute_task(self, task)
         if task.name.startswith('outdated:'):
-            self.outdated.append(task.name.split(':', 1)[1])
+            test = split_outdated_name(task.name.split(':', 1)[1])[0]
+            self.outdated.append(test)
+            self.changed[test] = getattr(task, 'dep_changed', None) or []
 
     def add_failure(self, task, exception):
         if task.name.startswith('outdated'):
@@ -371,23 +1797,749 @@ class OutdatedReporter(ZeroReporter):
         self.outstream.write(outdated_info)
 
 
+def git_blob_id(path):
+    """:return str: id (sha1) of file content as a git blob"""
+    with open(path, 'rb') as fp:
+        sha1 = hashlib.sha1(b'blob %d\0' % os.fstat(fp.fileno()).st_size)
+        while True:
+            data = fp.read(65536)
+            if not data:
+                return sha1.hexdigest()
+            sha1.update(data)
+
+
+class GitIndex(object):
+    """blob ids of files tracked by git, read from the index file
+
+    No git command is executed. Supports index versions 2, 3 and 4,
+    split index is not supported.
+
+    :ivar work_tree: (str) path of git work tree
+    :ivar entries: (dict) absolute path: (mtime_ns, size, blob id bytes)
+    """
+    SIGNATURE = b'DIRC'
+    ENTRY = struct.Struct('>10I20sH')  # up to flags, before path name
+    S_IFMT = 0o170000
+    S_IFREG = 0o100000
+    EXTENDED = 0x4000
+    NAME_MASK = 0xfff
+    STAGE_MASK = 0x3000
+    SKIP_WORKTREE = 0x4000  # extended flags
+    INTENT_TO_ADD = 0x2000
+
+    def __init__(self, work_tree, index_path):
+        """:raise ValueError: invalid or unsupported index file"""
+        self.work_tree = work_tree
+        self.entries = {}
+        with open(index_path, 'rb') as fp:
+            self._mtime_ns = os.fstat(fp.fileno()).st_mtime_ns
+            data = fp.read()
+        self._parse(data)
+
+    @classmethod
+    def find(cls, path):
+        """find git repository containing `path`
+
+        :return GitIndex: or None if not in a (supported) git repository
+        """
+        dir_path = os.path.abspath(path)
+        while True:
+            dot_git = os.path.join(dir_path, '.git')
+            if os.path.isdir(dot_git):
+                git_dir = dot_git
+                break
+            if os.path.isfile(dot_git):
+                # worktree or submodule: "gitdir: <path>"
+                with open(dot_git) as fp:
+                    content = fp.read().strip()
+                if not content.startswith('gitdir:'):
+                    return None
+                git_dir = os.path.join(dir_path, content[7:].strip())
+                break
+            parent = os.path.dirname(dir_path)
+            if parent == dir_path:
+                return None
+            dir_path = parent
+        try:
+            return cls(dir_path, os.path.join(git_dir, 'index'))
+        except (OSError, ValueError):
+            return None
+
+    def _parse(self, data):
+        if len(data) < 12 or data[:4] != self.SIGNATURE:
+            raise ValueError('Invalid git index')
+        version, count = struct.unpack_from('>II', data, 4)
+        if version not in (2, 3, 4):
+            raise ValueError('Unsupported git index version')
+        pos = 12
+        name = b''
+        for _ in range(count):
+            start = pos
+            (_, _, mtime, mtime_ns, _, _, mode, _, _, size, blob_id,
+             flags) = self.ENTRY.unpack_from(data, pos)
+            pos += self.ENTRY.size
+            extended = 0
+            if flags & self.EXTENDED:
+                extended = struct.unpack_from('>H', data, pos)[0]
+                pos += 2
+            if version == 4:
+                # path compressed: strip N bytes from previous path
+                strip, pos = self._varint(data, pos)
+                end = data.index(b'\0', pos)
+                name = name[:len(name) - strip] + data[pos:end]
+                pos = end + 1
+            else:
+                length = flags & self.NAME_MASK
+                if length == self.NAME_MASK:
+                    length = data.index(b'\0', pos) - pos
+                name = data[pos:pos + length]
+                pos += length
+                # entries are padded with 1-8 NUL to multiple of 8 bytes
+                pos += 8 - (pos - start) % 8
+            if ((mode & self.S_IFMT) != self.S_IFREG or
+                    flags & self.STAGE_MASK or
+                    extended & (self.SKIP_WORKTREE | self.INTENT_TO_ADD)):
+                continue
+            path = os.path.join(self.work_tree,
+                                *name.decode('utf-8').split('/'))
+            self.entries[path] = (mtime * 10**9 + mtime_ns, size, blob_id)
+
+        # extensions: 4 bytes signature + 4 bytes size
+        while pos + 8 <= len(data) - 20:
+            signature, size = struct.unpack_from('>4sI', data, pos)
+            if signature == b'link':
+                raise ValueError('Split git index not supported')
+            pos += 8 + size
+
+    @staticmethod
+    def _varint(data, pos):
+        """decode git offset varint used on index version 4"""
+        byte = data[pos]
+        pos += 1
+        value = byte & 0x7f
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            value = ((value + 1) << 7) | (byte & 0x7f)
+        return value, pos
+
+    def blob_id(self, path, file_stat):
+        """get blob id of a tracked file not modified since it was indexed
+
+        :return str: blob id or None
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        mtime_ns, size, blob_id = entry
+        if (mtime_ns != file_stat.st_mtime_ns or size != file_stat.st_size or
+                # "racily clean", modified on same timestamp as index
+                mtime_ns >= self._mtime_ns):
+            return None
+        return blob_id.hex()
+
+
+class FileSignature(object):
+    """signature of file content: md5 (same as doit MD5Checker)
+
+    :cvar CHECKER: name of doit checker class using this signature,
+                   doit consider all tasks outdated if checker changes
+    """
+    CHECKER = 'MD5Checker'
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler or Profiler(enabled=False)
+
+    def hash_file(self, path, size):
+        with self.profiler.phase('hash', files=1, bytes=size):
+            return get_file_md5(path)
+
+    def __call__(self, path, file_stat):
+        return self.hash_file(path, file_stat.st_size)
+
+
+class GitSignature(FileSignature):
+    """signature of file content: git blob id
+
+    Taken from git index for tracked files not modified,
+    other files are hashed.
+    """
+    CHECKER = 'GitChecker'
+
+    def __init__(self, git_index, profiler=None):
+        FileSignature.__init__(self, profiler)
+        self.git_index = git_index
+
+    def hash_file(self, path, size):
+        with self.profiler.phase('hash', files=1, bytes=size):
+            return git_blob_id(path)
+
+    def __call__(self, path, file_stat):
+        blob_id = self.git_index.blob_id(path, file_stat)
+        if blob_id is not None:
+            self.profiler.count('git-index', hit=1)
+            return blob_id
+        self.profiler.count('git-index', miss=1)
+        return self.hash_file(path, file_stat.st_size)
+
+
+# file signatures selected by option --inc-signature
+FILE_SIGNATURES = ('md5', 'git')
+
+
+class HashCacheChecker(MD5Checker):
+    """doit checker using a FileSignature and signatures computed in
+    advance (see Prefetch)
+
+    Use `HashCacheChecker.create()`, the class name must be the one
+    from the signature as doit consider all tasks outdated if checker
+    changes.
+
+    :cvar signature: (FileSignature)
+    :cvar hashes: (dict) path: (mtime, size, signature)
+    """
+    signature = FileSignature()
+    hashes = {}
+
+    @classmethod
+    def create(cls, signature, hashes=None, **attrs):
+        """create a checker class using given signature and hashes"""
+        attrs.update(signature=signature, hashes=hashes or {})
+        return type(signature.CHECKER, (cls,), attrs)
+
+    def _signature(self, path, file_stat):
+        cached = self.hashes.get(path)
+        if cached and cached[:2] == (file_stat.st_mtime, file_stat.st_size):
+            return cached[2]
+        return self.signature(path, file_stat)
+
+    def check_modified(self, file_path, file_stat, state):
+        # same as MD5Checker
+        timestamp, size, signature = state
+        if file_stat.st_mtime == timestamp:
+            return False
+        if file_stat.st_size != size:
+            return True
+        return signature != self._signature(file_path, file_stat)
+
+    def get_state(self, dep, current_state):
+        file_stat = os.stat(dep)
+        if current_state and current_state[0] == file_stat.st_mtime:
+            return None
+        return (file_stat.st_mtime, file_stat.st_size,
+                self._signature(dep, file_stat))
+
+
+class ProfileChecker(HashCacheChecker):
+    """HashCacheChecker that records file checks on a profiler
+
+    Use `ProfileChecker.create()`
+    """
+    profiler = None
+
+    def check_modified(self, file_path, file_stat, state):
+        timestamp, size, _ = state
+        if file_stat.st_mtime == timestamp or file_stat.st_size != size:
+            self.profiler.count('file-check', hit=1)
+        else:
+            self.profiler.count('file-check', miss=1)
+        return HashCacheChecker.check_modified(self, file_path, file_stat,
+                                               state)
+
+
+class Prefetch(object):
+    """prepare data used by doit tasks on a background thread
+
+    Started before pytest collects tests, python files modified since
+    a given time are hashed (see HashCacheChecker) and its imports
+    parsed (see PyTasks.get_imports()).
+
+    Hashing releases the GIL, parsing does not, so only part of the work
+    is executed in parallel with collection.
+
+    :ivar tasks: (PyTasks) holds module index and parsed imports
+    :ivar since: (float) only files modified after this time are used,
+                 None for all files
+    :ivar signature: (FileSignature)
+    :ivar hashes: (dict) path: (mtime, size, signature)
+    """
+    def __init__(self, py_files, since=None, signature=None, profiler=None,
+                 **tasks_options):
+        self.profiler = profiler or Profiler(enabled=False)
+        self.tasks = PyTasks(py_files, profiler=self.profiler,
+                             **tasks_options)
+        self.since = since
+        self.signature = signature or FileSignature()
+        self.hashes = {}
+        self._wall = 0.0
+        self._error = None
+        self._thread = threading.Thread(target=self._run,
+                                        name='pytest-incremental')
+        self._thread.daemon = True
+        self._joined = False
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            with self.profiler.phase('prefetch') as info:
+                self.tasks.py_mods  # load or create module index
+                for path in self.tasks.py_files:
+                    file_stat = os.stat(path)
+                    mtime = file_stat.st_mtime
+                    if self.since is not None and mtime <= self.since:
+                        continue
+                    self.hashes[path] = (mtime, file_stat.st_size,
+                                         self.signature(path, file_stat))
+                    try:
+                        self.tasks.get_imports(path)
+                    except SyntaxError:
+                        pass  # reported when task is executed
+                info['files'] = len(self.hashes)
+        except Exception as exception:
+            self._error = exception
+        self._wall = time.perf_counter() - start
+
+    def join(self):
+        """wait for background thread
+
+        :return dict: path: import info of modules not modified since
+                      they were parsed
+        """
+        if not self._joined:
+            self._joined = True
+            with self.profiler.phase('prefetch-wait') as info:
+                start = time.perf_counter()
+                self._thread.join()
+                wait = time.perf_counter() - start
+                info['hidden_ms'] = int(max(self._wall - wait, 0) * 1000)
+            if self._error is not None:
+                raise self._error
+        imports = {}
+        for path, info in self.tasks._imports.items():
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            if self.hashes[path][:2] == (file_stat.st_mtime,
+                                         file_stat.st_size):
+                imports[path] = info
+        return imports
+
+
 ##################### end doit section
 
 
+class ReadOnlyDbmDB(DbmDB):
+    """doit DB backend that never writes to the DB file
+
+    The file is opened only for reading (gdbm without a lock).
+    Modified entries are kept in memory and discarded on `dump()`.
+    """
+    def __init__(self, name, codec):
+        self.name = name
+        self.codec = codec
+        self._db = {}
+        self.dirty = set()
+        backend = dbm.whichdb(name)
+        if backend is None:  # DB does not exist
+            self._dbm = {}
+        elif backend == 'dbm.gnu':
+            self._dbm = importlib.import_module(backend).open(name, 'ru')
+        else:
+            self._dbm = dbm.open(name, 'r')
+
+    def dump(self):
+        """close DBM file"""
+        if not isinstance(self._dbm, dict):
+            self._dbm.close()
+
+    def remove(self, task_id):
+        self._db[task_id] = {}
+        self.dirty.discard(task_id)
+
+    def remove_all(self):
+        self.dump()
+        self._dbm = {}
+        self._db = {}
+        self.dirty = set()
+
+
+class StateStore(object):
+    """plugin data saved together with doit tasks data in the DB file
+
+    Entries are not related to doit tasks, they use doit's DB backend
+    with a key in the format `<kind>:<path>`.
+    Must not be opened while doit is running.
+    """
+    def __init__(self, db_file, readonly=False):
+        db_class = ReadOnlyDbmDB if readonly else DbmDB
+        self.backend = db_class(db_file, codec=JSONCodec())
+
+    def get(self, kind, path):
+        """:return: saved value or None"""
+        return self.backend.get('{}:{}'.format(kind, path), 'value')
+
+    def get_all(self, kind, paths):
+        """:return dict: path: value (only paths with a saved value)"""
+        values = {}
+        for path in paths:
+            value = self.get(kind, path)
+            if value is not None:
+                values[path] = value
+        return values
+
+    def set(self, kind, path, value):
+        self.backend.set('{}:{}'.format(kind, path), 'value', value)
+
+    def close(self):
+        """write modified entries to file"""
+        self.backend.dump()
+
+
+# suffixes of files created by dbm backends
+DBM_SUFFIXES = ('', '.db', '.dat', '.dir', '.pag', '.bak')
+
+def db_size(db_file):
+    """:return int: size in bytes of all files of a dbm DB"""
+    size = 0
+    for suffix in DBM_SUFFIXES:
+        if os.path.exists(db_file + suffix):
+            size += os.path.getsize(db_file + suffix)
+    return size
+
+
+def compact_db(db_file, keep):
+    """rewrite a dbm DB with only the entries selected by `keep`
+
+    dbm files never shrink, removed or replaced values leave unused space.
+    The new DB is written to temporary files (same dbm backend) that
+    replace the current ones with `os.replace()`.
+    For backends using a single file (gdbm) the replacement is atomic.
+
+    :param keep: (callable) receives a dict key: value (bytes) with all
+                 entries, returns the keys to be kept
+    :return tuple: (size before, size after) in bytes,
+                   None if the DB does not exist
+    """
+    backend = dbm.whichdb(db_file)
+    if not backend:
+        return None
+    old_db = dbm.open(db_file, 'r')
+    try:
+        entries = {k.decode('utf-8'): old_db[k] for k in old_db.keys()}
+    finally:
+        old_db.close()
+    kept = keep(entries)
+    before = db_size(db_file)
+    tmp_file = '{}.gc-{}'.format(db_file, os.getpid())
+    try:
+        new_db = importlib.import_module(backend).open(tmp_file, 'n')
+        try:
+            for key in kept:
+                new_db[key] = entries[key]
+        finally:
+            new_db.close()
+        created = [s for s in DBM_SUFFIXES if os.path.exists(tmp_file + s)]
+        for suffix in created:
+            os.replace(tmp_file + suffix, db_file + suffix)
+    except Exception:
+        for suffix in DBM_SUFFIXES:
+            if os.path.exists(tmp_file + suffix):
+                os.remove(tmp_file + suffix)
+        raise
+    for suffix in DBM_SUFFIXES:
+        if suffix not in created and os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
+    return before, db_size(db_file)
+
+
+######### line level selection
+# Lines executed by tests are saved as flat lists of closed intervals
+# `[start1, end1, start2, end2, ...]` (1-based line numbers).
+
+def to_intervals(lines):
+    """:param lines: (iterable - int) line numbers
+    :return list: flat list of intervals
+    """
+    intervals = []
+    for line in sorted(lines):
+        if intervals and intervals[-1] + 1 >= line:
+            intervals[-1] = line
+        else:
+            intervals.extend((line, line))
+    return intervals
+
+def iter_intervals(intervals):
+    """:return generator: line numbers in intervals"""
+    for pos in range(0, len(intervals), 2):
+        yield from range(intervals[pos], intervals[pos + 1] + 1)
+
+def intervals_overlap(intervals, start, end):
+    """check if any interval overlaps the closed range start..end"""
+    # position of first interval boundary >= start
+    pos = bisect.bisect_left(intervals, start)
+    if pos % 2:  # start inside an interval
+        return True
+    return pos < len(intervals) and intervals[pos] <= end
+
+def line_digests(path):
+    """:return list: digest of every line in file"""
+    with open(path, 'rb') as fp:
+        return [hashlib.md5(line.rstrip()).hexdigest()[:8] for line in fp]
+
+
+def statement_lines(path):
+    """find lines of statements
+
+    The span of a compound statement (`def`, `if`...) contains only its
+    header, so spans do not overlap.
+
+    :return (list, list): intervals with first line of every statement,
+        flat list of spans `[start1, end1, ...]` of every statement
+        (not merged, sorted)
+    """
+    with open(path, 'rb') as fp:
+        tree = ast.parse(fp.read(), path)
+    firsts = []
+    spans = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.stmt):
+            continue
+        firsts.append(node.lineno)
+        body = getattr(node, 'body', None)
+        if isinstance(body, list) and body:
+            end = max(node.lineno, body[0].lineno - 1)
+        else:
+            # end_lineno only on python 3.8+
+            end = getattr(node, 'end_lineno', None) or max(
+                getattr(child, 'lineno', node.lineno)
+                for child in ast.walk(node))
+        spans.add((node.lineno, end))
+    return to_intervals(firsts), [line for span in sorted(spans)
+                                  for line in span]
+
+
+class LineDiff(object):
+    """changes between two versions of a file, in terms of old line numbers
+
+    A change touches the old lines it modifies.
+    When statements are added where there was none (i.e. new code
+    between two lines) the change also touches the adjacent old lines.
+    Touched lines are widened to the whole (old) statements they are
+    part of, as only some lines of a multi-line statement are reported
+    as executed.
+    """
+    def __init__(self, old, new, old_statements, new_statements, old_spans):
+        """
+        :param old, new: (list - str) line digests
+        :param old_statements, new_statements: (list - int) intervals
+               of statement lines
+        :param old_spans: (list - int) spans of old statements,
+               see statement_lines()
+        """
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        self.opcodes = matcher.get_opcodes()
+        self._starts = old_spans[::2]
+        self._ends = old_spans[1::2]
+        self.ranges = []  # (start, end) of touched old lines
+        for tag, i1, i2, j1, j2 in self.opcodes:
+            if tag == 'equal':
+                continue
+            if (intervals_overlap(new_statements, j1 + 1, j2) and
+                    not intervals_overlap(old_statements, i1 + 1, i2)):
+                self.ranges.append(self._widen(i1, i2 + 1))
+            elif i2 > i1:
+                self.ranges.append(self._widen(i1 + 1, i2))
+            else:
+                # lines inserted inside a multi-line statement
+                pos = bisect.bisect_right(self._starts, i1) - 1
+                if pos >= 0 and self._ends[pos] > i1:
+                    self.ranges.append(
+                        (self._starts[pos], self._ends[pos]))
+
+    def _widen(self, start, end):
+        """:return tuple: range extended to statements overlapping it"""
+        first = bisect.bisect_left(self._ends, start)
+        last = bisect.bisect_right(self._starts, end)
+        if first < last:
+            start = min(start, self._starts[first])
+            end = max(end, self._ends[last - 1])
+        return start, end
+
+    def touches(self, intervals):
+        """check if any changed line is in intervals"""
+        return any(intervals_overlap(intervals, start, end)
+                   for start, end in self.ranges)
+
+    def remap(self, intervals):
+        """map old line numbers to new ones,
+        intervals must not be touched by changes
+        """
+        blocks = [(i1, i2, j1) for tag, i1, i2, j1, _ in self.opcodes
+                  if tag == 'equal']
+        starts = [block[0] for block in blocks]
+        lines = []
+        for line in iter_intervals(intervals):
+            pos = bisect.bisect_left(starts, line)
+            if not pos:
+                continue
+            i1, i2, j1 = blocks[pos - 1]
+            if line <= i2:
+                lines.append(line + j1 - i1)
+        return to_intervals(lines)
+
+
+######### execution order of outdated test files
+# A strategy receives (IncrementalControl, outdated) after get_outdated()
+# and returns a function used as sort key for an outdated test path.
+
+def order_topsort(control, outdated):
+    """dependencies first, tests for lower level modules are executed first"""
+    return outdated.get
+
+def order_failed(control, outdated):
+    """test files that failed on last execution first, then recent failures"""
+    history = control.load_history(outdated)
+    def key(path):
+        failed = history.get(path, {}).get('failed', [])
+        return (not (failed and failed[-1]), -sum(failed))
+    return key
+
+def order_duration(control, outdated):
+    """fastest test files first"""
+    history = control.load_history(outdated)
+    return control.get_durations(outdated, history).get
+
+def order_closest(control, outdated):
+    """test files closer (in import graph) to a modified file first"""
+    def key(path):
+        distance = control.get_distance(path)
+        return len(control.graph.nodes) if distance is None else distance
+    return key
+
+def order_fixtures(control, outdated):
+    """test files using the same expensive package scoped fixtures together
+
+    Test files are grouped by the fixtures (from `setup_fixtures`) that
+    took at least FIXTURE_SETUP_MIN seconds to set up on previous runs.
+    Groups are placed at the position (topological) of its first test file.
+    """
+    used = control.setup_fixtures
+    costs = control.load_fixture_setup(
+        set(itertools.chain.from_iterable(used.get(p, ()) for p in outdated)))
+    groups = {}  # fixtures: position of first test file
+    keys = {}  # path: fixtures
+    for path in outdated:
+        fixtures = tuple(sorted(
+            f for f in used.get(path, ())
+            if costs.get(f, 0) >= control.FIXTURE_SETUP_MIN))
+        if fixtures:
+            keys[path] = fixtures
+            groups[fixtures] = min(groups.get(fixtures, outdated[path]),
+                                   outdated[path])
+    def key(path):
+        fixtures = keys.get(path)
+        return outdated[path] if fixtures is None else groups[fixtures]
+    return key
+
+ORDER_STRATEGIES = {
+    'topsort': order_topsort,
+    'failed': order_failed,
+    'duration': order_duration,
+    'closest': order_closest,
+    'fixtures': order_fixtures,
+}
+
+
 class IncrementalControl(object):
     '''control which modules need to execute tests
 
     :cvar str DB_FILE: file name used as doit db file
+    :cvar int HISTORY_RUNS: number of test results kept in history
+    :cvar int LINE_SNAPSHOTS: number of versions of a module kept
+                              for line level selection
+    :cvar float DEFAULT_DURATION: duration (seconds) used for test files
+                                  without history
+    :cvar float FIXTURE_SETUP_MIN: setup duration (seconds) of a fixture
+                                   to be considered by `fixtures` order
+    :cvar int ENV_RETAIN: number of environments (most recently used)
+                          kept by gc()
+    :cvar int GC_MIN_SIZE: state file size (bytes) to start automatic gc
+    :cvar float GC_GROWTH: automatic gc when state file grows this ratio
+                           of its size after last gc
+    :cvar GC_PATH_KINDS: (tuple - str) kind of entries keyed by a file path
+    :ivar pkg_folders: (list - str) watched folders
     :ivar py_files: (list - str) relative path of test and code under test
+    :ivar fixture_deps: (bool) test files depend only on used fixtures
+                        from conftest files (not whole conftest)
+    :ivar extra_deps: (dict) test path: list of non-python file dependencies
+    :ivar record_deps: (bool) use files observed on test execution as deps
+    :ivar distributions: (Distributions) version of installed third-party
+                         packages, None to ignore them
+    :ivar environment: (dict) as returned by get_environment(),
+                       test results are kept for each environment
+    :ivar line_deps: (bool) skip outdated test files that did not execute
+                     any modified line on its last execution
+    :ivar demand: (bool) only analyse modules reachable from test files
+    :ivar prefetch: (Prefetch) started by start_prefetch()
+    :ivar signature: (str) signature of file contents, one of
+                     FILE_SIGNATURES. `git` uses git index blob ids
+                     (md5 is used if not in a git repository).
+    :ivar readonly: (bool) never write state file and graph file,
+                    results must not be saved
+    :ivar setup_fixtures: (dict) test path: set of package scoped fixtures
+                          (see fixture_id()) used by the test file
+    :ivar scope: (set - str) modules analysed on demand mode,
+                 set by first execution of doit
+    :ivar graph: (DepGraph) set by get_outdated()
+    :ivar levels: (dict) path: dependency level, computed on demand
+    :ivar changed: (dict) set by get_outdated(),
+                   outdated test path: list of files modified since success
     '''
     DB_FILE = '.pytest-incremental'
-
-    def __init__(self, pkg_folders):
+    HISTORY_RUNS = 5
+    LINE_SNAPSHOTS = 3
+    DEFAULT_DURATION = 1.0
+    FIXTURE_SETUP_MIN = 0.01
+    ENV_RETAIN = 8
+    GC_MIN_SIZE = 1024 * 1024
+    GC_GROWTH = 2.0
+    GC_PATH_KINDS = ('get_dep', 'outdated', 'history', 'fixtures',
+                     'observed', 'lines', 'snapshot', 'distributions',
+                     'fixture-setup')
+
+    def __init__(self, pkg_folders, profiler=None):
         assert isinstance(pkg_folders, list)
+        self.profiler = profiler or Profiler(enabled=False)
         self.test_files = None
+        self.fixture_deps = False
+        self.extra_deps = {}
+        self.record_deps = False
+        self.distributions = Distributions(
+            self.profiler, exclude=pkg_folders + [os.getcwd()])
+        self.environment = get_environment()
+        self.line_deps = False
+        self._line_updates = {}  # unaffected test path: remapped lines
+        self._line_imports = {}  # module path: remapped import lines
+        self.demand = False
+        self.scope = None
+        self.prefetch = None
+        self.signature = 'md5'
+        self.readonly = False
+        self.setup_fixtures = defaultdict(set)
+        self._git_index = None  # GitIndex, False if not in git repository
+        self.graph = None
+        self.changed = {}
+        self._levels = None
+        self.pkg_folders = pkg_folders
         self.py_files = []
-        for pkg in pkg_folders:
-            self.py_files.extend(self._get_pkg_modules(pkg))
+        with self.profiler.phase('discovery') as info:
+            for pkg in pkg_folders:
+                self.py_files.extend(self._get_pkg_modules(pkg))
+            info['files'] = len(self.py_files)
 
     def _get_pkg_modules(self, pkg_name, get_sub_folders=True):
         """get all package modules recursively
@@ -404,15 +2556,79 @@ class IncrementalControl(object):
                     this_modules.extend(self._get_pkg_modules(sub_path))
         return this_modules
 
-    def _run_doit(self, sel_tasks, reporter=None, doit_vars=None):
-        """load this file as dodo file to collect tasks"""
-        inc = IncrementalTasks(self.py_files, test_files=list(self.test_files))
+    def start_prefetch(self):
+        """start hashing and parsing files modified since last execution
+        on a background thread
+        """
+        db_files = glob.glob(self.DB_FILE + '*')
+        since = max(os.path.getmtime(p) for p in db_files) if db_files else None
+        self.prefetch = Prefetch(self.py_files, since=since,
+                                 signature=self.create_signature(),
+                                 source_roots=self.pkg_folders,
+                                 profiler=self.profiler)
+        self.prefetch.start()
+
+    def create_signature(self, profiler=None):
+        """:return FileSignature: for selected `signature`"""
+        if self.signature == 'git':
+            if self._git_index is None:
+                with self.profiler.phase('git-index-load') as info:
+                    self._git_index = GitIndex.find(self.pkg_folders[0])
+                    if self._git_index is None:
+                        # not in a git repository, fallback to md5
+                        self._git_index = False
+                    else:
+                        info['entries'] = len(self._git_index.entries)
+            if self._git_index:
+                return GitSignature(self._git_index, profiler)
+        return FileSignature(profiler)
+
+    def _run_doit(self, sel_tasks, reporter=None, doit_vars=None,
+                  **tasks_options):
+        """load this file as dodo file to collect tasks
+
+        :param tasks_options: extra arguments to IncrementalTasks
+        """
+        fixtures = None
+        if self.fixture_deps:
+            fixtures = self.load_fixtures(self.test_files)
+        observed = None
+        if self.record_deps:
+            observed = self.load_observed(self.test_files)
+        if self.distributions and self.distributions.cache is None:
+            self.distributions.cache = self._load(
+                'distributions', [sys.prefix]).get(sys.prefix)
+        roots = None
+        if self.demand and (self.scope is None or
+                            not self.scope.issuperset(self.test_files)):
+            roots = list(self.test_files)
+            self.scope = None
+        inc = IncrementalTasks(self.py_files, test_files=list(self.test_files),
+                               fixtures=fixtures, extra_deps=self.extra_deps,
+                               observed=observed,
+                               distributions=self.distributions,
+                               env_key=self.env_key, roots=roots,
+                               scope=self.scope,
+                               source_roots=self.pkg_folders,
+                               prefetch=self.prefetch,
+                               readonly=self.readonly,
+                               profiler=self.profiler, **tasks_options)
         output = StringIO()
         config = {
             'dep_file': self.DB_FILE,
             'continue': True,
             'outfile': output,
         }
+        hashes = self.prefetch.hashes if self.prefetch else None
+        signature = self.create_signature(self.profiler)
+        if self.profiler.enabled:
+            config['check_file_uptodate'] = ProfileChecker.create(
+                signature, hashes, profiler=self.profiler)
+            if reporter is None:
+                reporter = CountReporter(output, None)
+        elif hashes is not None or signature.CHECKER != 'MD5Checker':
+            config['check_file_uptodate'] = HashCacheChecker.create(
+                signature, hashes)
         if reporter:
             config['reporter'] = reporter
 
@@ -426,11 +2642,32 @@ class IncrementalControl(object):
                 doit_cmd.set_var(key, value)
         loader = ModuleTaskLoader(ctx)
         cmd = Run(task_loader=loader)
+        # also used by the tasks generator (see PyTasks.find_scope())
+        cmd.dep_manager = Dependency(
+            ReadOnlyDbmDB if self.readonly else DbmDB, self.DB_FILE,
+            codec_cls=JSONCodec,
+            checker_cls=config.get('check_file_uptodate', MD5Checker))
+        inc.dep_manager = cmd.dep_manager
         cmd.parse_execute(sel_tasks)
+        self.scope = inc.scope
+        if (self.distributions and self.distributions.modified and
+                not self.readonly):
+            store = StateStore(self.DB_FILE)
+            store.set('distributions', sys.prefix, self.distributions.cache)
+            store.close()
+            self.distributions.modified = False
+        for basename, stats in getattr(reporter, 'stats', {}).items():
+            self.profiler.count('task:' + basename, **stats)
         output.seek(0)
         return inc.graph, output.read()
 
 
+    @property
+    def env_key(self):
+        """:return str: digest of environment"""
+        data = json.dumps(self.environment, sort_keys=True)
+        return hashlib.md5(data.encode('utf-8')).hexdigest()[:12]
+
     def get_outdated(self):
         """run doit to find out which test files are "outdated"
         A test file is outdated if there was a change in the content in any
@@ -438,28 +2675,424 @@ class IncrementalControl(object):
 
         :return set(str): list of outdated files
         """
-        outdated_tasks = ['outdated']
-        graph, output_str = self._run_doit(outdated_tasks,
-                                           reporter=OutdatedReporter)
-        outdated_list = json.loads(output_str)
+        reporter = OutdatedReporter(StringIO(), None)
+        with self.profiler.phase('doit-outdated'):
+            graph, _ = self._run_doit(['outdated'], reporter=reporter)
+        self.graph = graph
+        self.changed = reporter.changed
         # dict of outdated with position
         outdated = {}
-        order = {p:i for i,p in enumerate(graph.topsort())}
-        for test in outdated_list:
+        with self.profiler.phase('topsort'):
+            order = {p:i for i,p in enumerate(graph.topsort())}
+        for test in reporter.outdated:
             outdated[test] = order[test]
         return outdated
 
-    def save_success(self, success):
-        """mark doit test tasks as sucessful"""
-        tasks = ['dep-json']
+    def load_history(self, paths):
+        """:return dict: path: history entry (only paths with history)"""
+        with self.profiler.phase('load-history'):
+            return self._load('history', paths)
+
+    def _load(self, kind, paths):
+        """:return dict: path: value from state store"""
+        store = StateStore(self.DB_FILE, self.readonly)
+        values = store.get_all(kind, paths)
+        store.close()
+        return values
+
+    def load_fixtures(self, paths):
+        """:return dict: path: list of fixtures used (for paths with info)"""
+        return self._load('fixtures', paths)
+
+    def save_fixtures(self, fixtures):
+        """:param fixtures: (dict) path: list of fixture names used"""
+        store = StateStore(self.DB_FILE)
+        for path, used in fixtures.items():
+            store.set('fixtures', path, sorted(used))
+        store.close()
+
+    def load_observed(self, paths):
+        """:return dict: path: list of files used by test on execution"""
+        return self._load('observed', paths)
+
+    def save_observed(self, observed):
+        """add files used by test files on execution to previous records
+
+        :param observed: (dict) test path: set of file paths
+        """
+        store = StateStore(self.DB_FILE)
+        for path, deps in observed.items():
+            previous = store.get('observed', path) or []
+            store.set('observed', path, sorted(deps.union(previous)))
+        store.close()
+
+    def select_lines(self, outdated):
+        """find outdated test files not affected by changes on line level
+
+        A test file is not affected if the only modified files are
+        python modules where all changed lines were neither executed by
+        the test file nor at import time (module level).
+        Test files without line information are always affected.
+
+        Must be called after get_outdated().
+        :return set(str): outdated test paths not affected
+        """
+        store = StateStore(self.DB_FILE, self.readonly)
+        snapshots = {}
+        digests = {}
+        unaffected = set()
+        with self.profiler.phase('select-lines') as info:
+            for test in outdated:
+                changed = self.changed.get(test)
+                if not changed or test in changed:
+                    continue
+                record = store.get('lines', test)
+                if record is None:
+                    continue
+                updated = dict(record)
+                for dep in changed:
+                    if dep not in record:
+                        break
+                    if dep not in snapshots:
+                        snapshots[dep] = store.get('snapshot', dep) or {}
+                    md5, intervals = record[dep]
+                    snap = snapshots[dep].get(md5)
+                    if (not snap or not snap['import'] or
+                            'spans' not in snap or not os.path.exists(dep)):
+                        break
+                    if dep not in digests:
+                        try:
+                            digests[dep] = (line_digests(dep),
+                                            statement_lines(dep))
+                        except SyntaxError:
+                            digests[dep] = None
+                    if digests[dep] is None:
+                        break
+                    diff = LineDiff(snap['lines'], digests[dep][0],
+                                    snap['statements'], digests[dep][1][0],
+                                    snap['spans'])
+                    if diff.touches(intervals) or diff.touches(snap['import']):
+                        break
+                    updated[dep] = [None, diff.remap(intervals)]
+                    self._line_imports[dep] = diff.remap(snap['import'])
+                else:
+                    unaffected.add(test)
+                    self._line_updates[test] = updated
+            info['files'] = len(unaffected)
+        store.close()
+        return unaffected
+
+    def save_lines(self, executed, success):
+        """save lines executed by successful test files
+
+        :param executed: (dict) context: dict module path: set of line numbers
+                         where context is a test path or '' for lines
+                         executed at import time (or shared fixtures)
+        :param success: (list - str) successful test paths
+        """
+        modules = set()
+        for lines in executed.values():
+            modules.update(lines)
+        modules.update(dep for record in self._line_updates.values()
+                       for dep, (md5, _) in record.items() if md5 is None)
+        modules = [m for m in modules if os.path.exists(m)]
+        with self.profiler.phase('save-lines', files=len(modules)):
+            store = StateStore(self.DB_FILE)
+            md5s = {}
+            for module in modules:
+                with open(module, 'rb') as fp:
+                    md5s[module] = hashlib.md5(fp.read()).hexdigest()
+                snapshots = store.get('snapshot', module) or {}
+                snap = snapshots.pop(md5s[module], None)
+                imported = set(executed.get('', {}).get(module, ()))
+                if snap:
+                    imported.update(iter_intervals(snap['import']))
+                imported.update(iter_intervals(
+                    self._line_imports.get(module, ())))
+                statements, spans = statement_lines(module)
+                snapshots[md5s[module]] = {
+                    'lines': line_digests(module),
+                    'statements': statements,
+                    'spans': spans,
+                    'import': to_intervals(imported),
+                }
+                while len(snapshots) > self.LINE_SNAPSHOTS:
+                    snapshots.pop(next(iter(snapshots)))
+                store.set('snapshot', module, snapshots)
+
+            for test, record in self._line_updates.items():
+                for dep, entry in record.items():
+                    if entry[0] is None:
+                        entry[0] = md5s.get(dep)
+                store.set('lines', test, record)
+            for test in success:
+                if test not in executed or test in self._line_updates:
+                    continue
+                record = {}
+                for node in self.graph.nodes[test].all_deps():
+                    if node.name in md5s and node.name != test:
+                        record[node.name] = [
+                            md5s[node.name],
+                            to_intervals(executed[test].get(node.name, ()))]
+                store.set('lines', test, record)
+            store.close()
+
+    def save_history(self, durations, failed, collected=None):
+        """save test durations and result of executed test files
+
+        :param durations: (dict) path: dict nodeid: duration (seconds)
+        :param failed: (set - str) path of test files with failures
+        :param collected: (dict) path: set of nodeids collected in session,
+                          items no longer collected (removed, renamed...)
+                          are removed from history
+        """
+        with self.profiler.phase('save-history', files=len(durations)):
+            store = StateStore(self.DB_FILE)
+            for path, items in durations.items():
+                entry = (store.get('history', path) or
+                         {'items': {}, 'failed': []})
+                if collected is not None and path in collected:
+                    keep = collected[path]
+                    entry['items'] = {nodeid: duration for nodeid, duration
+                                      in entry['items'].items()
+                                      if nodeid in keep}
+                entry['items'].update(items)
+                results = entry['failed'] + [path in failed]
+                entry['failed'] = results[-self.HISTORY_RUNS:]
+                store.set('history', path, entry)
+            store.close()
+
+    def load_fixture_setup(self, fixtures):
+        """:return dict: fixture id: setup duration (seconds)"""
+        return self._load('fixture-setup', fixtures)
+
+    def save_fixture_setup(self, durations):
+        """:param durations: (dict) fixture id: setup duration (seconds)"""
+        if not durations:
+            return
+        store = StateStore(self.DB_FILE)
+        for fixture, duration in durations.items():
+            store.set('fixture-setup', fixture, duration)
+        store.close()
+
+    def get_durations(self, paths, history):
+        """get expected duration of test files
+
+        Tests without recorded duration use the median of known durations.
+
+        :param history: (dict) as returned by load_history()
+        :return dict: path: duration (seconds)
+        """
+        known = {path: sum(entry['items'].values())
+                 for path, entry in history.items()}
+        values = sorted(known.values())
+        default = values[len(values) // 2] if values else self.DEFAULT_DURATION
+        return {path: known.get(path, default) for path in paths}
+
+    def explain(self, outdated):
+        """find a shortest import path from outdated test files
+        to each of its modified dependencies
+
+        Must be called after get_outdated().
+        :param outdated: (iterable - str) test paths
+        :return dict: test path: list of tuples (modified file, path)
+                      where path is a list of modules from test to modified
+                      file, None if not an import (i.e. non-python file)
+        """
+        with self.profiler.phase('explain') as info:
+            pairs = [(test, changed) for test in outdated
+                     for changed in self.changed.get(test, ())]
+            info['pairs'] = len(pairs)
+            paths = self.graph.shortest_paths(pairs)
+        result = defaultdict(list)
+        for test, changed in pairs:
+            result[test].append((changed, paths[test, changed]))
+        return result
+
+    def get_distance(self, path):
+        """:return int: distance from outdated test to closest modified file"""
+        return self.graph.distance(path, set(self.changed[path]))
+
+    def order_outdated(self, outdated, strategy='topsort'):
+        """get execution order of outdated test files
+
+        Test files with same order on `strategy` are sorted topologically.
+
+        :param outdated: (dict) as returned by get_outdated()
+        :param strategy: (str) key from ORDER_STRATEGIES
+        :return list: path of outdated test files
+        """
+        key = ORDER_STRATEGIES[strategy](self, outdated)
+        return sorted(outdated, key=lambda p: (key(p), outdated[p]))
+
+    @property
+    def levels(self):
+        if self._levels is None:
+            self._levels = self.graph.levels()
+        return self._levels
+
+    def level_gate(self, path, failed):
+        """check if a test file should not be executed because of failures
+        on tests from lower dependency levels.
+
+        A test file is gated if its dependencies include a modified file
+        from the dependencies of a failed test file on a lower level.
+
+        :param path: (str) outdated test file
+        :param failed: (iterable - str) outdated test files with failures
+        :return str: failed test file that gates `path` or None
+        """
+        level = self.levels[path]
+        deps = None
+        for fail in failed:
+            if self.levels[fail] >= level:
+                continue
+            if deps is None:
+                deps = set(n.name for n in self.graph.nodes[path].all_deps())
+            suspects = set(self.changed[fail])
+            suspects.discard(fail)
+            if not suspects.isdisjoint(deps):
+                return fail
+        return None
+
+    def select_budget(self, outdated, budget):
+        """select outdated tests with higher risk-per-second within budget
+
+        risk is higher for a test closer (in import graph) to a modified
+        file and for tests with recent failures.
+        :param outdated: (dict) as returned by get_outdated()
+        :param budget: (float) seconds
+        :return dict: selected subset of `outdated`
+        """
+        history = self.load_history(outdated)
+        durations = self.get_durations(outdated, history)
+
+        rank = []
+        for path in outdated:
+            distance = self.get_distance(path)
+            risk = 1.0 / (1 + (distance or 0))
+            risk += sum(history.get(path, {}).get('failed', []))
+            duration = max(durations[path], 0.001)
+            rank.append((-risk / duration, outdated[path], path, duration))
+
+        selected = {}
+        used = 0.0
+        for _, _, path, duration in sorted(rank):
+            # always select at least one test
+            if used + duration > budget and selected:
+                continue
+            selected[path] = outdated[path]
+            used += duration
+        return selected
+
+    def save_success(self, success, fixtures=None, observed=None):
+        """mark doit test tasks as sucessful
+
+        :param fixtures: (dict) path: list of fixture names used by
+                         successful test files (fixture_deps mode only)
+        :param observed: (dict) path: set of files used by executed
+                         test files (record_deps mode only)
+        """
+        if fixtures:
+            self.save_fixtures(fixtures)
+        if observed:
+            self.save_observed(observed)
+        tasks = ['dep-graph']
         for path in success:
-            tasks.append("outdated:%s" % path)
-        self._run_doit(tasks, doit_vars={'success':True})
+            tasks.append("outdated:%s" % outdated_name(path, self.env_key))
+        with self.profiler.phase('doit-save-success'):
+            self._run_doit(tasks, doit_vars={'success':True})
+        store = StateStore(self.DB_FILE)
+        store.set('env', self.env_key, {'environment': self.environment,
+                                        'last_run': time.time()})
+        store.close()
+
+    def gc(self, force=True):
+        """compact state file
+
+        Remove entries of files that do not exist anymore
+        (`get_dep` and `outdated` tasks, history, fixtures, observed,
+        lines and snapshot), setup duration of fixtures from removed
+        folders, distributions of removed python installations
+        and results of environments that are not one of the `ENV_RETAIN`
+        most recently used.
+
+        :param force: (bool) if False only compact if state file is bigger
+                      than GC_MIN_SIZE and GC_GROWTH times its size
+                      after last compaction
+        :return dict: None if not compacted. keys: `before`, `after`
+                      (size in bytes), `kept` (number of entries),
+                      `removed` (dict kind: number of entries)
+        """
+        size = db_size(self.DB_FILE)
+        if not size:
+            return None
+        if not force:
+            if size < self.GC_MIN_SIZE:
+                return None
+            last = self._load('gc', ['last']).get('last')
+            if last and size < last['size'] * self.GC_GROWTH:
+                return None
+
+        removed = defaultdict(int)
+        kept = []
+        def keep(entries):
+            used = {}  # env key: last run
+            for key, value in entries.items():
+                kind, _, env_key = key.partition(':')
+                if kind == 'env':
+                    entry = json.loads(value.decode('utf-8'))['value']
+                    used[env_key] = entry.get('last_run', 0)
+            retained = set(sorted(used, key=used.get,
+                                  reverse=True)[:self.ENV_RETAIN])
+            for key in entries:
+                kind, sep, name = key.partition(':')
+                env_key = None
+                if kind == 'env':
+                    env_key = name
+                elif sep and kind in self.GC_PATH_KINDS:
+                    if kind == 'outdated':
+                        name, env_key = split_outdated_name(name)
+                    elif kind == 'fixture-setup':
+                        name = name.rpartition('::')[0]  # see fixture_id()
+                    if not os.path.exists(name):
+                        removed[kind] += 1
+                        continue
+                if env_key is not None and env_key not in retained:
+                    removed[kind] += 1
+                    continue
+                kept.append(key)
+            return kept
+
+        with self.profiler.phase('gc') as info:
+            sizes = compact_db(self.DB_FILE, keep)
+            if sizes is None:
+                return None
+            info['entries'] = len(kept)
+            info['removed'] = sum(removed.values())
+        store = StateStore(self.DB_FILE)
+        store.set('gc', 'last', {'size': sizes[1]})
+        store.close()
+        return {'before': sizes[0], 'after': sizes[1], 'kept': len(kept),
+                'removed': dict(removed)}
+
+
+    def get_graph(self):
+        """build graph of imports (without checking outdated tests)
+        :return DepGraph:
+        """
+        self.graph, _ = self._run_doit(['dep-graph'])
+        self.graph.nodes  # force creation while doit is loaded
+        return self.graph
 
+    def print_deps(self, fmt='text', deps_filter=None):
+        """print list of all python modules being tracked and its dependencies
 
-    def print_deps(self):
-        """print list of all python modules being tracked and its dependencies"""
-        self._run_doit(['print-deps'])
+        :param fmt: (str) one of DepGraph.DEPS_FORMATS
+        :param deps_filter: (str) 'tests' or path of a folder
+        """
+        self._run_doit(['print-deps'], deps_format=fmt,
+                       deps_filter=deps_filter)
 
     def create_dot_graph(self, graph_type='dot'):
         """create a graph of imports in dot format
@@ -469,10 +3102,574 @@ class IncrementalControl(object):
 
 
 
+######### zygote: pre-warmed forked runner
+# The zygote imports third-party modules used by the project once and
+# forks a child process to execute each pytest run requested through a
+# unix socket. The standard streams of the client are passed to the child
+# (SCM_RIGHTS) so its output goes directly to the client terminal.
+# Watched modules are never imported by the zygote.
+
+ZYGOTE_SOCKET = '.pytest-zygote.sock'
+
+
+def send_fds(sock, fds):
+    """send file descriptors through a unix socket (with 1 byte of data)"""
+    sock.sendmsg([b'F'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                           array('i', fds))])
+
+
+def recv_fds(sock, max_fds):
+    """:return list - int: file descriptors received from a unix socket"""
+    fds = array('i')
+    _, ancdata, _, _ = sock.recvmsg(
+        1, socket.CMSG_SPACE(max_fds * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    return list(fds)
+
+
+def peer_uid(sock):
+    """:return int: user id of process connected to a unix socket,
+    None if not supported (only linux)
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+class Zygote(object):
+    """server that forks a pre-warmed process for each pytest execution
+
+    Modules imported before forking:
+      - `pytest` and top-level external modules from the graph file
+      - modules imported by previous executions (learned from children)
+    Modules from watched folders or CWD are never imported, so the
+    incremental decision is done with fresh imports of project modules.
+
+    Only requests from a client of the same user, with the same CWD,
+    python executable and `sys.path` are served.
+
+    :ivar pkg_folders: (list - str) watched folders
+    :ivar socket_path: (str) path of unix socket
+    :ivar preloaded: (set - str) name of modules imported by the zygote
+    :ivar failed: (set - str) name of modules that failed to import
+    """
+    def __init__(self, pkg_folders, socket_path=ZYGOTE_SOCKET,
+                 graph_file='deps.graph'):
+        self.cwd = os.getcwd()
+        self.sys_path = list(sys.path)
+        self.pkg_folders = [os.path.abspath(p) for p in pkg_folders]
+        self._local = tuple(set(os.path.join(p, '')
+                                for p in self.pkg_folders + [self.cwd]))
+        self.socket_path = socket_path
+        self.graph_file = graph_file
+        self.preloaded = set()
+        self.failed = set()
+        self._sock = None
+        self._children = {} # read end of pipe: data received from child
+
+    def is_external(self, path):
+        """:return bool: path is not in a watched folder or CWD"""
+        return not os.path.abspath(path).startswith(self._local)
+
+    def _external_spec(self, name):
+        """:return bool: module can be found and is not a watched module"""
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            return False
+        if spec is None:
+            return False
+        if spec.has_location:
+            return self.is_external(spec.origin)
+        locations = list(spec.submodule_search_locations or [])
+        return all(self.is_external(p) for p in locations)
+
+    def initial_modules(self):
+        """:return list - str: pytest and external modules from graph file"""
+        names = set(['pytest'])
+        if GraphFile.is_valid(self.graph_file):
+            externals = GraphFile(self.graph_file).to_dict()[1]
+            for mods in externals.values():
+                names.update(mods)
+        return sorted(n for n in names if self._external_spec(n))
+
+    def preload(self, names):
+        """import modules, errors are ignored
+
+        Watched modules imported as a side-effect are removed from
+        `sys.modules`.
+        """
+        for name in names:
+            if name in sys.modules:
+                self.preloaded.add(name)
+                continue
+            if name in self.failed:
+                continue
+            try:
+                importlib.import_module(name)
+            except (Exception, SystemExit):
+                self.failed.add(name)
+            else:
+                self.preloaded.add(name)
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, '__file__', None)
+            if path and name != '__main__' and not self.is_external(path):
+                del sys.modules[name]
+        # do not touch preloaded objects on collection (copy-on-write)
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def learned_modules(self, before):
+        """modules imported by a child process that might be preloaded
+
+        Modules rewritten by pytest assertion rewriting are excluded,
+        pytest can not rewrite a module already imported.
+
+        :param before: (set - str) name of modules imported before
+        :return list - str:
+        """
+        learned = []
+        for name in set(sys.modules) - before:
+            module = sys.modules[name]
+            path = getattr(module, '__file__', None)
+            if not path or not self.is_external(path):
+                continue
+            loader = getattr(module, '__loader__', None)
+            if type(loader).__name__ == 'AssertionRewritingHook':
+                continue
+            learned.append(name)
+        return sorted(learned)
+
+    def check(self, request):
+        """:return str: error message if request can not be served"""
+        if request.get('cwd') != self.cwd:
+            return 'zygote serves {}, client on {}'.format(
+                self.cwd, request.get('cwd'))
+        if request.get('executable') != sys.executable:
+            return 'zygote uses {}, client {}'.format(
+                sys.executable, request.get('executable'))
+        if request.get('path') != self.sys_path:
+            # forked process would import modules from zygote sys.path
+            return 'zygote sys.path differs from client (PYTHONPATH?)'
+        return None
+
+    def serve(self):
+        """listen for requests until interrupted (SIGINT or SIGTERM)"""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path) # stale socket
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # requests are executed as the zygote user, socket must be private
+        umask = os.umask(0o177)
+        try:
+            self._sock.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+        self._sock.listen(16)
+        # SIGTERM must not be caught as an import error by preload()
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            while True:
+                ready, _, _ = select.select(
+                    [self._sock] + list(self._children), [], [], 1.0)
+                for obj in ready:
+                    if obj is self._sock:
+                        self._accept()
+                    else:
+                        self._read_child(obj)
+                self._reap()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._sock.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def _reap(self):
+        """wait for finished children (avoid zombies)"""
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+
+    def _read_child(self, fd):
+        """read name of modules imported by a child, preload on EOF"""
+        data = os.read(fd, 65536)
+        if data:
+            self._children[fd] += data
+            return
+        os.close(fd)
+        data = self._children.pop(fd)
+        try:
+            names = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return
+        self.preload(names)
+
+    def _accept(self):
+        conn, _ = self._sock.accept()
+        fds = []
+        try:
+            uid = peer_uid(conn)
+            if uid is not None and uid != os.getuid():
+                conn.sendall(json.dumps(
+                    {'error': 'client from another user'}).encode('utf-8'))
+                return
+            fds = recv_fds(conn, 3)
+            data = conn.makefile('rb').read()
+            request = json.loads(data.decode('utf-8'))
+            error = None if len(fds) == 3 else 'standard streams not received'
+            error = error or self.check(request)
+            if error:
+                conn.sendall(json.dumps({'error': error}).encode('utf-8'))
+                return
+            sys.stdout.flush()
+            sys.stderr.flush()
+            read_fd, write_fd = os.pipe()
+            if os.fork() == 0:
+                os.close(read_fd)
+                try:
+                    self._child(conn, fds, request, write_fd)
+                finally:
+                    os._exit(1)
+            os.close(write_fd)
+            self._children[read_fd] = b''
+        finally:
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+
+    def _child(self, conn, fds, request, learn_fd):
+        """execute pytest on the forked process, never returns"""
+        self._sock.close()
+        for fd in self._children:
+            os.close(fd)
+        for num, fd in enumerate(fds):
+            os.dup2(fd, num)
+            os.close(fd)
+        sys.stdin = sys.__stdin__ = open(0, 'r', closefd=False)
+        sys.stdout = sys.__stdout__ = open(1, 'w', buffering=1, closefd=False)
+        sys.stderr = sys.__stderr__ = open(2, 'w', buffering=1, closefd=False)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = ['pytest'] + request['args']
+        before = set(sys.modules)
+        exit_code = 3 # pytest internal error
+        try:
+            conn.sendall(
+                (json.dumps({'pid': os.getpid()}) + '\n').encode('utf-8'))
+            exit_code = int(pytest.main(request['args']))
+        except SystemExit as exc:
+            exit_code = exc.code if isinstance(exc.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            with open(learn_fd, 'wb') as pipe:
+                pipe.write(json.dumps(
+                    self.learned_modules(before)).encode('utf-8'))
+            conn.sendall(
+                (json.dumps({'exit': exit_code}) + '\n').encode('utf-8'))
+            os._exit(0)
+
+
+def zygote_run(args, socket_path=ZYGOTE_SOCKET):
+    """execute pytest on a process forked by the zygote,
+    executed on current process if the zygote is not available
+
+    :param args: (list - str) pytest command line arguments
+    :return int: pytest exit code
+    """
+    exit_code = None
+    if hasattr(socket, 'AF_UNIX') and os.path.exists(socket_path):
+        exit_code = _zygote_request(args, socket_path)
+    if exit_code is None:
+        exit_code = pytest.main(args)
+    return int(exit_code)
+
+
+def _zygote_request(args, socket_path):
+    """:return int: exit code, None if request was not served"""
+    request = {
+        'args': args,
+        'cwd': os.getcwd(),
+        'env': dict(os.environ),
+        'executable': sys.executable,
+        'path': sys.path,
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return None
+        sys.stdout.flush()
+        sys.stderr.flush()
+        send_fds(sock, [0, 1, 2])
+        sock.sendall(json.dumps(request).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        reader = sock.makefile('rb')
+        pid = None
+        while True:
+            try:
+                line = reader.readline()
+            except KeyboardInterrupt:
+                if pid is None:
+                    raise
+                os.kill(pid, signal.SIGINT)
+                continue
+            if not line:
+                # connection closed without exit code: child crashed
+                return 3 if pid else None
+            msg = json.loads(line.decode('utf-8'))
+            if 'error' in msg:
+                sys.stderr.write('zygote: {}\n'.format(msg['error']))
+                return None
+            if 'pid' in msg:
+                pid = msg['pid']
+            else:
+                return msg['exit']
+    finally:
+        sock.close()
+
+
+
+######### library API
+
+class Query(object):
+    """query import graph and saved test results without running pytest
+
+    Must be used from the folder where pytest is executed (it uses the same
+    state file). Paths are absolute.
+    Use the same modes (fixtures, recorded deps, extra deps) used when
+    running pytest, otherwise results might differ from `--inc`.
+
+    :cvar TEST_PATTERNS: (tuple - str) glob of test file names
+    :ivar control: (IncrementalControl)
+    """
+    TEST_PATTERNS = ('test_*.py', '*_test.py')
+
+    def __init__(self, paths=None, test_files=None, patterns=None,
+                 env_vars=(), plugins=(), db_file=None, fixture_deps=False,
+                 record_deps=False, extra_deps=None):
+        """
+        :param paths: (list - str) watched folders (default: CWD)
+        :param test_files: (list - str) test files, default to watched
+                           files matching `patterns`
+        :param patterns: (list - str) glob of test file names
+        :param env_vars: (list - str) see ini option `inc_env_vars`
+        :param plugins: (list - str) plugins from pytest command line
+        :param db_file: (str) path of state file
+        :param fixture_deps: (bool) see option `--inc-fixtures`
+        :param record_deps: (bool) see option `--inc-record-deps`
+        :param extra_deps: (dict) test path: list of non-python file
+                           dependencies (pytest config file, `inc_extra_deps`)
+        """
+        pkg_folders = [os.path.abspath(p) for p in (paths or [os.getcwd()])]
+        self.control = IncrementalControl(pkg_folders)
+        if db_file:
+            self.control.DB_FILE = db_file
+        self.control.fixture_deps = fixture_deps
+        self.control.record_deps = record_deps
+        if extra_deps:
+            self.control.extra_deps = {
+                os.path.abspath(test): [os.path.abspath(p) for p in deps]
+                for test, deps in extra_deps.items()}
+        self.control.environment = get_environment(env_vars, plugins)
+        if test_files is None:
+            patterns = patterns or self.TEST_PATTERNS
+            test_files = [
+                p for p in self.control.py_files
+                if any(fnmatch.fnmatch(os.path.basename(p), pattern)
+                       for pattern in patterns)]
+        self.control.test_files = sorted(
+            set(os.path.abspath(p) for p in test_files))
+
+    def affected(self, changed):
+        """test files that depend on any of the given files,
+        regardless of saved results
+
+        :param changed: (list - str) path of modified files
+        :return list: test paths
+        """
+        graph = self.control.get_graph()
+        changed = [os.path.abspath(p) for p in changed]
+        dependents = graph.dependents(changed)
+        return [p for p in self.control.test_files if p in dependents]
+
+    def outdated(self):
+        """test files modified, or with modified dependencies,
+        since its last successful execution
+
+        :return dict: test path: list of modified files
+        """
+        outdated = self.control.get_outdated()
+        return {p: sorted(self.control.changed[p]) for p in sorted(outdated)}
+
+    def graph(self):
+        """:return dict: module path: list of imported modules"""
+        graph = self.control.get_graph()
+        return {name: sorted(dep.name for dep in node.deps)
+                for name, node in sorted(graph.nodes.items())}
+
+    def explain(self, tests=None):
+        """why test files are outdated
+
+        :param tests: (list - str) test paths (default: all test files)
+        :return dict: test path: dict with keys
+            `outdated` (bool), `changed` (list - str modified files),
+            `paths` (dict modified file: shortest import path)
+        """
+        outdated = self.outdated()
+        tests = self.control.test_files if tests is None else tests
+        tests = [os.path.abspath(p) for p in tests]
+        explain = self.control.explain(p for p in tests if p in outdated)
+        result = {}
+        for test in tests:
+            result[test] = {
+                'outdated': test in outdated,
+                'changed': outdated.get(test, []),
+                'paths': {changed: path for changed, path in explain[test]},
+            }
+        return result
+
+    def gc(self):
+        """compact state file, see IncrementalControl.gc()"""
+        return self.control.gc()
+
+
+def _relpaths(value):
+    """convert absolute paths in result of Query methods to relative"""
+    if isinstance(value, str):
+        return os.path.relpath(value) if os.path.isabs(value) else value
+    if isinstance(value, dict):
+        return {_relpaths(k): _relpaths(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_relpaths(v) for v in value]
+    return value
+
+
+def main(argv=None):
+    """command line interface: `python -m pytest_incremental`
+
+    Print result of a Query method as JSON.
+    Commands `zygote` and `run` execute pytest on pre-warmed processes.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m pytest_incremental',
+        description='query pytest-incremental state without running pytest')
+    parser.add_argument(
+        '--inc-path', dest='paths', action='append', default=[],
+        help='file path of a package to be watched (default: CWD)')
+    parser.add_argument(
+        '--test-pattern', dest='patterns', action='append', default=[],
+        help='glob of test file names (default: {})'.format(
+            ' '.join(Query.TEST_PATTERNS)))
+    parser.add_argument(
+        '--env-var', dest='env_vars', action='append', default=[],
+        help='environment variable from ini option inc_env_vars')
+    parser.add_argument(
+        '-p', dest='plugins', action='append', default=[],
+        help='plugin from pytest command line')
+    parser.add_argument(
+        '--inc-fixtures', dest='fixture_deps', action='store_true',
+        help='same as pytest option --inc-fixtures')
+    parser.add_argument(
+        '--inc-record-deps', dest='record_deps', action='store_true',
+        help='same as pytest option --inc-record-deps')
+    parser.add_argument('--absolute', action='store_true',
+                        help='output absolute paths')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    cmd = subparsers.add_parser(
+        'affected', help='test files that depend on given files')
+    cmd.add_argument('files', nargs='+')
+    subparsers.add_parser(
+        'outdated', help='outdated test files and its modified dependencies')
+    subparsers.add_parser('graph', help='imports of all modules')
+    cmd = subparsers.add_parser(
+        'deps', help='all (recursive) dependencies of modules')
+    cmd.add_argument('--format', choices=DepGraph.DEPS_FORMATS,
+                     default='jsonl')
+    cmd.add_argument('--filter', metavar='tests|PATH',
+                     help='only test files or modules from PATH')
+    cmd = subparsers.add_parser(
+        'explain', help='modified dependencies of test files')
+    cmd.add_argument('tests', nargs='*')
+    subparsers.add_parser(
+        'gc', help='remove entries of deleted files from state file')
+    cmd = subparsers.add_parser(
+        'zygote', help='server to run pytest on pre-warmed processes')
+    cmd.add_argument('--socket', default=ZYGOTE_SOCKET)
+    cmd = subparsers.add_parser(
+        'run', help='run pytest on a process forked by the zygote')
+    cmd.add_argument('--socket', default=ZYGOTE_SOCKET)
+    cmd.add_argument('args', nargs=argparse.REMAINDER,
+                     help='pytest arguments (after --)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'zygote':
+        zygote = Zygote(args.paths or [os.getcwd()], args.socket)
+        start = time.time()
+        zygote.preload(zygote.initial_modules())
+        sys.stderr.write('zygote: preloaded {} modules in {:.2f}s, '
+                         'listening on {}\n'.format(
+                             len(zygote.preloaded), time.time() - start,
+                             args.socket))
+        zygote.serve()
+        return 0
+    if args.command == 'run':
+        pytest_args = args.args
+        if pytest_args[:1] == ['--']:
+            pytest_args = pytest_args[1:]
+        return zygote_run(pytest_args, args.socket)
+
+    query = Query(args.paths, patterns=args.patterns,
+                  env_vars=args.env_vars, plugins=args.plugins,
+                  fixture_deps=args.fixture_deps,
+                  record_deps=args.record_deps)
+    if args.command == 'deps':
+        # streamed, not a single JSON document
+        query.control.print_deps(args.format, args.filter)
+        return 0
+    if args.command == 'affected':
+        result = query.affected(args.files)
+    elif args.command == 'outdated':
+        result = query.outdated()
+    elif args.command == 'graph':
+        result = query.graph()
+    elif args.command == 'gc':
+        result = query.gc()
+    else:
+        result = query.explain(args.tests or None)
+    if not args.absolute:
+        result = _relpaths(result)
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+
+
 ### py.test integration
 
 import glob
+import fnmatch
 import pytest
+try:
+    import coverage
+except ImportError: # pragma: no cover
+    coverage = None
 
 def pytest_addoption(parser):
     '''py.test hook: register argparse-style options and config values'''
@@ -489,10 +3686,23 @@ def pytest_addoption(parser):
         '--inc-outdated', action="store_true",
         dest="list_outdated", default=False,
         help="print list of outdated test files")
+    group.addoption(
+        '--inc-explain', action="store_true",
+        dest="inc_explain", default=False,
+        help="print modified files that caused a test file to be outdated "
+             "and a shortest import path to it")
     group.addoption(
         '--inc-deps', action="store_true",
         dest="list_dependencies", default=False,
         help="print list of python modules being tracked and its dependencies")
+    group.addoption(
+        '--inc-deps-format', choices=DepGraph.DEPS_FORMATS,
+        dest="inc_deps_format", default='text',
+        help="output format of --inc-deps (default: text)")
+    group.addoption(
+        '--inc-deps-filter', metavar='tests|PATH',
+        dest="inc_deps_filter", default=None,
+        help="--inc-deps only for test files or modules from PATH")
     group.addoption(
         '--inc-graph', action="store_const", const='dot',
         dest="graph_dependencies", default=None,
@@ -501,6 +3711,163 @@ def pytest_addoption(parser):
         '--inc-graph-image', action="store_const", const='image',
         dest="graph_dependencies", default=None,
         help="create graph file of dependencies in SVG format 'deps.svg'")
+    group.addoption(
+        '--inc-budget', action="store", type=float, metavar="SECONDS",
+        dest="inc_budget", default=None,
+        help="execute only outdated tests with higher risk-per-second "
+             "that fit in the given time (based on previous durations)")
+    group.addoption(
+        '--inc-order', action="store", choices=sorted(ORDER_STRATEGIES),
+        dest="inc_order", default='topsort',
+        help="execution order of outdated test files. "
+             "topsort: dependencies first (default); "
+             "failed: recently failed first; duration: fastest first; "
+             "closest: closest to a modified file first; "
+             "fixtures: group test files using same expensive "
+             "package scoped fixtures")
+    group.addoption(
+        '--inc-level-gate', action="store_true",
+        dest="inc_level_gate", default=False,
+        help="execute outdated tests grouped by dependency level, skip tests "
+             "affected by modules with failures on lower levels")
+    group.addoption(
+        '--inc-profile', action="store_true",
+        dest="inc_profile", default=False,
+        help="print time spent on each phase of the incremental plugin")
+    group.addoption(
+        '--inc-profile-trace', action="store", metavar="FILE",
+        dest="inc_profile_trace", default=None,
+        help="write profile (implies --inc-profile) as JSON file "
+             "in Chrome trace-event format")
+    group.addoption(
+        '--inc-signature', choices=FILE_SIGNATURES,
+        dest="inc_signature", default='md5',
+        help="signature of file contents. md5 (default); git: use blob ids "
+             "from git index for files not modified (if not in a git "
+             "repository md5 is used)")
+    group.addoption(
+        '--inc-background', action="store_true",
+        dest="inc_background", default=False,
+        help="hash and parse modified files on a background thread "
+             "while tests are collected")
+    group.addoption(
+        '--inc-demand', action="store_true",
+        dest="inc_demand", default=False,
+        help="analyse imports only of modules reachable from collected "
+             "test files (instead of all modules from watched paths). "
+             "All watched paths are still listed to find modules")
+    group.addoption(
+        '--inc-readonly', action="store_true",
+        dest="inc_readonly", default=False,
+        help="select tests from saved state but never write it "
+             "(results are not saved)")
+    group.addoption(
+        '--inc-gc', action="store_true",
+        dest="inc_gc", default=False,
+        help="compact state file at the end of the session, removing "
+             "entries of deleted files (also done automatically "
+             "when the file grows)")
+    group.addoption(
+        '--inc-fixtures', action="store_true",
+        dest="inc_fixtures", default=False,
+        help="test files depend only on fixtures they use from conftest "
+             "files (instead of whole conftest files)")
+    group.addoption(
+        '--inc-lines', action="store_true",
+        dest="inc_lines", default=False,
+        help="skip outdated test files that did not execute any of the "
+             "modified lines (requires coverage)")
+    group.addoption(
+        '--inc-record-deps', action="store_const", const='imports',
+        dest="inc_record_deps", default=None,
+        help="record modules imported during test execution and use them "
+             "as dependencies (complement static import analysis)")
+    group.addoption(
+        '--inc-record-deps-open', action="store_const", const='open',
+        dest="inc_record_deps", default=None,
+        help="same as --inc-record-deps and also record files "
+             "(from watched paths) opened for reading")
+    parser.addini(
+        'inc_extra_deps', type='linelist', default=[],
+        help="non-python file dependencies of test files. One entry per line "
+             "in the format: <test files glob>: <file glob> [<file glob>...]")
+    parser.addini(
+        'inc_env_vars', type='linelist', default=[],
+        help="environment variables that affect test results. "
+             "Test results are saved separately for each value")
+
+
+def get_extra_deps(config, items):
+    """get non-python file dependencies of collected test files
+
+    - pytest configuration file (pytest.ini, pyproject.toml, setup.cfg...)
+    - ini option `inc_extra_deps`, globs relative to rootdir
+    - marker `inc_deps`, globs relative to test file folder
+
+    :return dict: test path: set of file paths
+    """
+    rootdir = str(config.rootdir)
+    patterns = []  # (test glob, list of file glob)
+    for line in config.getini('inc_extra_deps'):
+        test_glob, sep, file_globs = line.partition(':')
+        if not sep:
+            msg = "Invalid inc_extra_deps entry (missing ':'): {}"
+            raise pytest.UsageError(msg.format(line))
+        patterns.append((test_glob.strip(), file_globs.split()))
+
+    expanded = {}  # glob: list of paths
+    def expand(base, pattern):
+        full = os.path.join(base, pattern)
+        if full not in expanded:
+            # `**` also matches folders, only files are dependencies
+            expanded[full] = [os.path.abspath(p) for p in
+                              glob.glob(full, recursive=True)
+                              if os.path.isfile(p)]
+        return expanded[full]
+
+    inifile = (getattr(config, 'inipath', None) or
+               getattr(config, 'inifile', None))
+    config_files = [os.path.abspath(str(inifile))] if inifile else []
+    extra = {}
+    for item in items:
+        path = str(item.fspath)
+        deps = extra.get(path)
+        if deps is None:
+            deps = extra[path] = set(config_files)
+            rel_path = os.path.relpath(path, rootdir)
+            for test_glob, file_globs in patterns:
+                if fnmatch.fnmatch(rel_path, test_glob):
+                    for file_glob in file_globs:
+                        deps.update(expand(rootdir, file_glob))
+        for mark in item.iter_markers('inc_deps'):
+            for file_glob in mark.args:
+                deps.update(expand(os.path.dirname(path), file_glob))
+    return extra
+
+
+def fixture_id(fixturedef, rootdir):
+    """:return str: name of fixture qualified by (absolute) path of the
+    folder where it is defined
+    """
+    path = os.path.normpath(os.path.join(rootdir, fixturedef.baseid))
+    return '{}::{}'.format(path, fixturedef.argname)
+
+
+def package_fixtures(item):
+    """package scoped fixtures used by a test item
+
+    Fixtures with a scope lower than package are set up for each test file
+    (or class), and session ones only once, regardless of the order test
+    files are executed.
+    :return list - str: fixture ids
+    """
+    info = getattr(item, '_fixtureinfo', None)
+    if info is None:
+        return []
+    rootdir = str(item.config.rootdir)
+    return [fixture_id(defs[-1], rootdir)
+            for defs in info.name2fixturedefs.values()
+            if defs and defs[-1].scope == 'package']
 
 
 def pytest_configure(config):
@@ -508,9 +3875,13 @@ def pytest_configure(config):
 
     py.test hook: called after parsing cmd optins and loading plugins.
     '''
+    config.addinivalue_line(
+        'markers',
+        'inc_deps(*globs): non-python files the test depends on '
+        '(pytest-incremental), relative to the test file folder')
     opt = config.option
     if any((opt.incremental, opt.list_outdated, opt.list_dependencies,
-            opt.graph_dependencies)):
+            opt.graph_dependencies, opt.inc_explain)):
         config._incremental = IncrementalPlugin()
         config.pluginmanager.register(config._incremental)
 
@@ -524,6 +3895,236 @@ def pytest_unconfigure(config):
 
 
 
+class DepsRecorder(object):
+    """record watched files used while tests from a test file are executed
+
+    Detects modules imported through `__import__` (import statement),
+    `importlib.import_module()` and any module added to `sys.modules`.
+    Optionally also files opened for reading with `open()`.
+
+    :ivar current: (str) path of test file being executed
+    :ivar observed: (dict) test path: set of file paths
+    """
+    def __init__(self, watched_files, watched_dirs=None, ignore=()):
+        """
+        :param watched_files: (set - str) python modules to be recorded
+        :param watched_dirs: (list - str) record opened files from folders
+        :param ignore: (iterable - str) opened files not to be recorded
+        """
+        self.watched_files = watched_files
+        self.watched_dirs = None
+        if watched_dirs:
+            self.watched_dirs = tuple(os.path.join(d, '') for d in watched_dirs)
+        self.ignore = set(ignore)
+        self.current = None
+        self.observed = defaultdict(set)
+        self._modules = None  # snapshot of sys.modules keys
+        self._orig = None
+
+    def start(self):
+        """install hooks"""
+        self._orig = (builtins.__import__, importlib.import_module,
+                      builtins.open)
+        self._modules = set(sys.modules)
+        builtins.__import__ = self._import
+        importlib.import_module = self._import_module
+        if self.watched_dirs:
+            builtins.open = self._open
+
+    def stop(self):
+        """remove hooks, does nothing if not started"""
+        if self._orig is None:
+            return
+        self.set_current(None)
+        (builtins.__import__, importlib.import_module,
+         builtins.open) = self._orig
+        self._orig = None
+
+    def set_current(self, path):
+        """set test file being executed"""
+        if len(sys.modules) != len(self._modules):
+            modules = set(sys.modules)
+            if self.current is not None:
+                for name in modules - self._modules:
+                    self._record(sys.modules.get(name))
+            self._modules = modules
+        self.current = path
+
+    def _record(self, module):
+        path = getattr(module, '__file__', None)
+        if path in self.watched_files:
+            self.observed[self.current].add(path)
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = self._orig[0](name, globals, locals, fromlist, level)
+        if self.current is not None:
+            if fromlist:
+                self._record(module)
+                for attr in fromlist:
+                    sub = getattr(module, attr, None)
+                    if isinstance(sub, types.ModuleType):
+                        self._record(sub)
+            elif level == 0:
+                self._record(sys.modules.get(name))
+        return module
+
+    def _import_module(self, name, package=None):
+        module = self._orig[1](name, package)
+        if self.current is not None:
+            self._record(module)
+        return module
+
+    def _open(self, file, mode='r', *args, **kwargs):
+        fp = self._orig[2](file, mode, *args, **kwargs)
+        if (self.current is not None and isinstance(file, (str, os.PathLike))
+                and not any(c in mode for c in 'wax+')):
+            path = os.path.abspath(file)
+            if (path.startswith(self.watched_dirs) and
+                    path not in self.ignore and '__pycache__' not in path):
+                self.observed[self.current].add(path)
+        return fp
+
+
+class LineRecorder(object):
+    """record lines executed by each test file using coverage
+
+    Lines executed at import time and on setup of fixtures
+    with scope higher than "function" are recorded with context ''.
+    """
+    def __init__(self, py_files):
+        """
+        :param py_files: (list - str) python modules to be recorded
+        """
+        self.paths = {os.path.realpath(p): p for p in py_files}
+        folders = set(os.path.dirname(p) for p in self.paths)
+        self.cov = coverage.Coverage(
+            data_file=None, config_file=False,
+            include=[os.path.join(f, '*') for f in folders])
+        self.current = None
+
+    def start(self):
+        self.cov.start()
+
+    def set_current(self, path):
+        """set test file being executed"""
+        self.current = path
+        self.cov.switch_context(path or '')
+
+    def stop(self):
+        """stop recording
+        :return dict: context: dict module path: set of line numbers
+        """
+        self.cov.stop()
+        data = self.cov.get_data()
+        executed = defaultdict(lambda: defaultdict(set))
+        for measured in data.measured_files():
+            path = self.paths.get(os.path.realpath(measured))
+            if path is None:
+                continue
+            for line, contexts in data.contexts_by_lineno(measured).items():
+                for context in contexts:
+                    executed[context][path].add(line)
+        return executed
+
+
+class ItemResults(object):
+    """results of selected test items
+
+    Sessions might have millions of items (parametrized tests),
+    nodeids are interned to integer ids and data of items are kept in
+    arrays indexed by id. Passed items are counted by test file.
+
+    :ivar files: (list - str) test files with selected items
+    :ivar file_ids: (dict) test path: index in `files`
+    :ivar item_ids: (dict) nodeid: item id
+    :ivar failed: (set - str) test paths with failed items
+    """
+    REPORTED = 1
+    PASSED = 2
+
+    def __init__(self):
+        self.files = []
+        self.file_ids = {}
+        self.item_ids = {}
+        self.failed = set()
+        self._file_items = array('I')  # file id: number of items
+        self._file_passed = array('I')  # file id: number of passed items
+        self._item_file = array('I')  # item id: file id
+        self._item_state = bytearray()  # item id: 0, REPORTED or PASSED
+        self._item_durations = array('d')  # item id: seconds
+
+    def add(self, path, nodeids):
+        """add selected items from a test file"""
+        file_id = self.file_ids[path] = len(self.files)
+        self.files.append(path)
+        before = len(self.item_ids)
+        start = len(self._item_file)
+        self.item_ids.update(zip(nodeids, itertools.count(start)))
+        # duplicated nodeids use the id of its last item
+        self._file_items.append(len(self.item_ids) - before)
+        self._file_passed.append(0)
+        num = len(nodeids)
+        self._item_file.extend(itertools.repeat(file_id, num))
+        self._item_state.extend(bytes(num))
+        self._item_durations.extend(itertools.repeat(0.0, num))
+
+    def path(self, nodeid):
+        """:return str: test path of a selected item, None if not selected"""
+        item = self.item_ids.get(nodeid)
+        return None if item is None else self.files[self._item_file[item]]
+
+    def add_report(self, report):
+        """record result of setup/call/teardown of an item
+
+        An item passed if it has reports and none of them failed.
+        """
+        item = self.item_ids.get(report.nodeid)
+        if item is None:
+            return
+        self._item_durations[item] += report.duration
+        state = self._item_state
+        if report.failed:
+            self.failed.add(self.files[self._item_file[item]])
+            if not state[item]:
+                state[item] = self.REPORTED
+        elif state[item] != self.PASSED:
+            state[item] = self.PASSED
+            self._file_passed[self._item_file[item]] += 1
+
+    def passed(self, path):
+        """:return bool: all selected items from test file passed
+                         (True if it has no selected items)"""
+        file_id = self.file_ids.get(path)
+        if file_id is None:
+            return True
+        return (path not in self.failed and
+                self._file_passed[file_id] == self._file_items[file_id])
+
+    def durations(self, exclude=()):
+        """:param exclude: (set - str) test paths not included
+        :return dict: test path: dict nodeid: duration (seconds),
+                      only items with reports
+        """
+        durations = defaultdict(dict)
+        for nodeid, item in self.item_ids.items():
+            if self._item_state[item]:
+                path = self.files[self._item_file[item]]
+                if path not in exclude:
+                    durations[path][nodeid] = self._item_durations[item]
+        return durations
+
+    def nodeids(self, exclude=()):
+        """:param exclude: (set - str) test paths not included
+        :return dict: test path: set of nodeids, reported or not
+        """
+        nodeids = defaultdict(set)
+        for nodeid, item in self.item_ids.items():
+            path = self.files[self._item_file[item]]
+            if path not in exclude:
+                nodeids[path].add(nodeid)
+        return nodeids
+
+
 class IncrementalPlugin(object):
     """pytest-incremental plugin class
 
@@ -536,27 +4137,43 @@ class IncrementalPlugin(object):
              up-to-date tests from test items
     * pytest_runtestloop: print info on up-to-date (not excuted) on terminal
     * pytest_runtest_logreport: collect result from individual tests
-    * pytest_sessionfinish (save_success): save successful tasks in doit db
+    * pytest_sessionfinish (save_success): save successful tasks in doit db,
+                          compact it (gc)
     """
 
     def __init__(self):
         # command line options
         self.list_outdated = False
         self.list_dependencies = False
+        self.deps_format = 'text'
+        self.deps_filter = None
+        self.explain = False
         self.graph_dependencies = None
+        self.budget = None
+        self.order = 'topsort'
+        self.level_gate = False
+        self.profile_trace = None
+        self.gc = False
         self.run = None
 
+        # Profiler, set on sessionstart
+        self.profiler = None
+
         # IncrementalControl, set on sessionstart
         self.control = None
 
         # test information gathering during collect phase
         self.uptodate_paths = set()  # test paths that are up-to-date
-        self.outofdate = defaultdict(list)  # path: list of nodeid
+        self.over_budget = set()  # outdated test paths not selected
+        self.gated = {}  # outdated path skipped by level gate: failed path
         self.test_files = None  # list of collected test files
-
-        # sets of nodeid's set on logreport
-        self.passed = set()
-        self.failed = set()
+        self.results = ItemResults()  # selected items
+        self.fixturenames = defaultdict(set)  # path: fixtures used by items
+        self.recorder = None  # DepsRecorder, set if recording deps
+        self.lines = None  # LineRecorder, set if line level selection
+        self.unaffected = set()  # outdated paths with no modified line run
+        self.fixture_setup = {}  # fixture id: setup duration (seconds)
+        self.gc_report = None  # result of IncrementalControl.gc()
 
 
     def pytest_sessionstart(self, session):
@@ -567,8 +4184,18 @@ class IncrementalPlugin(object):
 
         opts = session.config.option
         self.list_outdated = opts.list_outdated
+        self.explain = opts.inc_explain
         self.list_dependencies = opts.list_dependencies
+        self.deps_format = opts.inc_deps_format
+        self.deps_filter = opts.inc_deps_filter
         self.graph_dependencies = opts.graph_dependencies
+        self.budget = opts.inc_budget
+        self.order = opts.inc_order
+        self.level_gate = opts.inc_level_gate
+        self.profile_trace = opts.inc_profile_trace
+        self.gc = opts.inc_gc
+        self.profiler = Profiler(
+            enabled=bool(opts.inc_profile or self.profile_trace))
         self.run = not any((self.list_outdated,
                             self.list_dependencies,
                             self.graph_dependencies))
@@ -579,7 +4206,36 @@ class IncrementalPlugin(object):
         if not pkg_folders:
             pkg_folders = [os.getcwd()]
 
-        self.control = IncrementalControl(pkg_folders)
+        self.control = IncrementalControl(pkg_folders, profiler=self.profiler)
+        self.control.fixture_deps = opts.inc_fixtures
+        self.control.demand = opts.inc_demand
+        self.control.signature = opts.inc_signature
+        self.control.readonly = opts.inc_readonly
+        self.control.environment = get_environment(
+            session.config.getini('inc_env_vars'),
+            getattr(opts, 'plugins', None) or ())
+        if opts.inc_lines:
+            # test files not affected on line level are saved as successful,
+            # runs without line level selection must not use these results
+            self.control.environment['lines'] = True
+        self.control.record_deps = bool(opts.inc_record_deps)
+        if opts.inc_record_deps and self.run and not opts.inc_readonly:
+            watched_dirs = None
+            if opts.inc_record_deps == 'open':
+                watched_dirs = pkg_folders
+            ignore = [os.path.abspath(p) for p in
+                      (IncrementalControl.DB_FILE, 'deps.graph')]
+            self.recorder = DepsRecorder(set(self.control.py_files),
+                                         watched_dirs, ignore)
+        self.control.line_deps = opts.inc_lines
+        if opts.inc_lines and self.run and not opts.inc_readonly:
+            if coverage is None:
+                raise pytest.UsageError('--inc-lines requires coverage')
+            # start before collection to record lines executed on import
+            self.lines = LineRecorder(self.control.py_files)
+            self.lines.start()
+        if opts.inc_background:
+            self.control.start_prefetch()
 
 
     def pytest_collection_modifyitems(self, session, config, items):
@@ -594,6 +4250,7 @@ class IncrementalPlugin(object):
         test_files = set((str(i.fspath) for i in items))
         self.test_files = test_files
         self.control.test_files = test_files
+        self.control.extra_deps = get_extra_deps(config, items)
 
         # list dependencies doesnt care about current state of outdated
         if self.list_dependencies or self.graph_dependencies:
@@ -602,6 +4259,14 @@ class IncrementalPlugin(object):
         # execute doit to figure out which test modules are outdated
         # dict test_moodule path: relative order position
         outdated = self.control.get_outdated()
+        if self.control.line_deps and self.run:
+            self.unaffected = self.control.select_lines(outdated)
+            for path in self.unaffected:
+                del outdated[path]
+        if self.budget is not None and self.run:
+            selected = self.control.select_budget(outdated, self.budget)
+            self.over_budget = set(outdated) - set(selected)
+            outdated = selected
 
         # split items into 2 groups to be executed or not
         item_by_mod = defaultdict(list)
@@ -609,21 +4274,34 @@ class IncrementalPlugin(object):
         for colitem in items:
             path = str(colitem.fspath)
             if path in outdated:
-                self.outofdate[path].append(colitem.nodeid)
+                if self.control.fixture_deps:
+                    self.fixturenames[path].update(
+                        getattr(colitem, 'fixturenames', ()))
+                if self.order == 'fixtures':
+                    self.control.setup_fixtures[path].update(
+                        package_fixtures(colitem))
                 item_by_mod[path].append(colitem)
             else:
-                self.uptodate_paths.add(path)
+                if path not in self.over_budget and path not in self.unaffected:
+                    self.uptodate_paths.add(path)
                 deselected.append(colitem)
 
+        order = self.control.order_outdated(outdated, self.order)
+        if self.level_gate:
+            order.sort(key=self.control.levels.get)
         selected = []
-        for path, _ in sorted(outdated.items(), key=lambda x: x[1]):
+        for path in order:
             selected.extend(item_by_mod[path])
+            self.results.add(path, [i.nodeid for i in item_by_mod[path]])
         items[:] = selected
 
         # include number of tests deselected in report footer
         if deselected:
             config.hook.pytest_deselected(items=deselected)
 
+        if self.recorder and selected:
+            self.recorder.start()
+
 
 
 
@@ -635,8 +4313,10 @@ class IncrementalPlugin(object):
         if not self.run:
             if self.list_outdated:
                 self.print_outdated()
+                if self.explain:
+                    self.print_explain()
             elif self.list_dependencies:
-                self.control.print_deps()
+                self.control.print_deps(self.deps_format, self.deps_filter)
             elif self.graph_dependencies:
                 self.control.create_dot_graph(self.graph_dependencies)
                 print('Graph dot file written in deps.dot')
@@ -645,6 +4325,8 @@ class IncrementalPlugin(object):
             return 0 # dont execute tests
 
         self.print_uptodate_test_files()
+        if self.explain:
+            self.print_explain()
 
 
     def print_uptodate_test_files(self):
@@ -654,6 +4336,66 @@ class IncrementalPlugin(object):
         rel_paths = (os.path.relpath(p) for p in self.uptodate_paths)
         for test_file in sorted(rel_paths):
             print("{}  [up-to-date]".format(test_file))
+        rel_paths = (os.path.relpath(p) for p in self.over_budget)
+        for test_file in sorted(rel_paths):
+            print("{}  [outdated - over budget]".format(test_file))
+        rel_paths = (os.path.relpath(p) for p in self.unaffected)
+        for test_file in sorted(rel_paths):
+            print("{}  [up-to-date - modified lines not executed]".format(
+                test_file))
+
+    def pytest_terminal_summary(self, terminalreporter):
+        """report test files skipped by level gate and profile info"""
+        if self.gated:
+            terminalreporter.write_sep('=', 'incremental level gate')
+            for path, fail in sorted(self.gated.items()):
+                terminalreporter.write_line(
+                    "{}  [outdated - gated by {}]".format(
+                        os.path.relpath(path), os.path.relpath(fail)))
+        if self.gc_report:
+            report = self.gc_report
+            terminalreporter.write_sep('=', 'incremental gc')
+            removed = ', '.join('{}: {}'.format(kind, num) for kind, num
+                                in sorted(report['removed'].items()))
+            terminalreporter.write_line(
+                'removed {} entries{}, kept {}'.format(
+                    sum(report['removed'].values()),
+                    ' ({})'.format(removed) if removed else '',
+                    report['kept']))
+            terminalreporter.write_line(
+                'state file: {:,} -> {:,} bytes (reclaimed {:,} bytes)'.format(
+                    report['before'], report['after'],
+                    report['before'] - report['after']))
+        if self.profiler.enabled:
+            terminalreporter.write_sep('=', 'incremental profile')
+            for line in self.profiler.summary():
+                terminalreporter.write_line(line)
+            if self.profile_trace:
+                self.profiler.write_trace(self.profile_trace)
+                terminalreporter.write_line(
+                    'Profile trace written in {}'.format(self.profile_trace))
+
+    def print_explain(self):
+        """print modified files and import path for outdated test files"""
+        outdated = [p for p in self.test_files
+                    if p not in self.uptodate_paths]
+        explain = self.control.explain(outdated)
+        relpaths = {}
+        def rel(path):
+            if path not in relpaths:
+                relpaths[path] = os.path.relpath(path)
+            return relpaths[path]
+
+        print()
+        for test in sorted(outdated, key=rel):
+            print("{}  [outdated]".format(rel(test)))
+            for changed, path in sorted(explain[test],
+                                        key=lambda x: (len(x[1] or ()), x[0])):
+                if path is None:
+                    print("    {}".format(rel(changed)))
+                else:
+                    print("    {}: {}".format(
+                        rel(changed), ' -> '.join(rel(p) for p in path)))
 
     def print_outdated(self):
         """print list of outdated test files"""
@@ -672,38 +4414,106 @@ class IncrementalPlugin(object):
             print("All test files are up to date")
 
 
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_setup(self, item):
+        """set test file for DepsRecorder and
+        skip tests gated by failures on lower dependency levels"""
+        path = self.results.path(item.nodeid)
+        if self.recorder and self.recorder.current != path:
+            self.recorder.set_current(path)
+        if self.lines and self.lines.current != path:
+            self.lines.set_current(path)
+        if not self.level_gate or path is None:
+            return
+        if path not in self.gated:
+            fail = self.control.level_gate(path, self.results.failed)
+            if fail is None:
+                return
+            self.gated[path] = fail
+        pytest.skip("inc-level-gate: failures on {}".format(
+            os.path.relpath(self.gated[path])))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        """record setup duration of package scoped fixtures
+        (`--inc-order fixtures` only).
+
+        lines executed by fixtures shared by test files are not
+        recorded as executed by the current test file"""
+        if fixturedef.scope == 'function':
+            yield
+            return
+        if self.lines:
+            self.lines.cov.switch_context('')
+        start = time.perf_counter()
+        try:
+            outcome = yield
+        finally:
+            if self.lines:
+                self.lines.cov.switch_context(self.lines.current or '')
+        if (self.order == 'fixtures' and fixturedef.scope == 'package' and
+                outcome.excinfo is None):
+            rootdir = str(request.config.rootdir)
+            self.fixture_setup[fixture_id(fixturedef, rootdir)] = (
+                time.perf_counter() - start)
+
     def pytest_runtest_logreport(self, report):
         """save success and failures result so we can decide which files
         should be marked as successful in doit
 
         py.test hook: called on setup/call/teardown
         """
-        if report.failed:
-            self.failed.add(report.nodeid)
-        else:
-            self.passed.add(report.nodeid)
+        self.results.add_report(report)
 
     def pytest_sessionfinish(self, session):
         """save success in doit"""
         if not self.run:
             return
+        if self.recorder:
+            # also started when session is interrupted before any test
+            self.recorder.stop()
+        executed = None
+        if self.lines:
+            executed = self.lines.stop()
+        if self.control.readonly:
+            return
 
         # if some tests were deselected by a keyword we cant assure all tests
         # passed
         if getattr(session.config.option, 'keyword', None):
             print("\nWARNING: incremental not saving results because -k was used")
+            self.gc_report = self.control.gc(force=self.gc)
             return
 
+        results = self.results
         successful = []
         for path in self.test_files:
-            for nodeid in self.outofdate[path]:
-                if nodeid in self.failed:
-                    break
-                # check all items were really executed
-                # when user hits Ctrl-C sessionfinish still gets called
-                if nodeid not in self.passed:
-                    break
-            else:
+            # not executed, must be kept as outdated
+            if path in self.over_budget or path in self.gated:
+                continue
+            # check all items were really executed
+            # when user hits Ctrl-C sessionfinish still gets called
+            if results.passed(path):
                 successful.append(path)
 
-        self.control.save_success(os.path.abspath(f) for f in successful)
+        fixtures = None
+        if self.control.fixture_deps:
+            fixtures = {p: self.fixturenames[p] for p in successful
+                        if p in results.file_ids}
+        observed = None
+        if self.recorder:
+            observed = {p: deps for p, deps in self.recorder.observed.items()
+                        if p is not None}
+        self.control.save_success((os.path.abspath(f) for f in successful),
+                                  fixtures=fixtures, observed=observed)
+        if executed is not None:
+            self.control.save_lines(executed, successful)
+        self.control.save_history(results.durations(self.gated),
+                                  results.failed.difference(self.gated),
+                                  results.nodeids(self.gated))
+        self.control.save_fixture_setup(self.fixture_setup)
+        self.gc_report = self.control.gc(force=self.gc)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
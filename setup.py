@@ -31,8 +31,9 @@ setup(name = 'pytest-incremental',
       py_modules = ['pytest_incremental'],
       install_requires = [
           'import_deps >= 0.1.0',
-          'doit >= 0.31.1',
+          'doit >= 0.32.0',
           'pytest >= 6.0',
+          'importlib_metadata >= 4.4; python_version < "3.10"',
       ],
       entry_points = {
         'pytest11': ['pytest_incremental = pytest_incremental'],
@@ -1,5 +1,11 @@
 import os
 import sys
+import json
+import importlib
+
+import pytest
+
+from pytest_incremental import Query
 
 pytest_plugins = 'pytester', 'pytest_incremental'
 
@@ -37,6 +43,16 @@ def test_list_deps(testdir, capsys):
     assert ' - test_list_deps.py: test_list_deps.py' in out
 
 
+def test_list_deps_jsonl(testdir, capsys):
+    testdir.makepyfile(mod_a="X = 1\n")
+    testdir.makepyfile(test_a="import mod_a\n" + TEST_SAMPLE)
+    testdir.inline_run('--inc-deps', '--inc-deps-format', 'jsonl',
+                       '--inc-deps-filter', 'tests')
+    out = capsys.readouterr()[0].splitlines()
+    assert '{"node": "test_a.py", "deps": ["mod_a.py", "test_a.py"]}' in out
+    assert not [line for line in out if '"node": "mod_a.py"' in line]
+
+
 def test_list_outdated(testdir, capsys):
     test = testdir.makepyfile(TEST_SAMPLE)
     args = ['--inc-outdated', test]
@@ -60,6 +76,21 @@ def test_list_outdated_none(testdir, capsys):
     assert 'All test files are up to date' in out
 
 
+def test_explain(testdir, capsys):
+    testdir.makepyfile(mod_b="X = 1\n")
+    testdir.makepyfile(mod_a="import mod_b\n")
+    testdir.makepyfile(test_a="import mod_a\n" + TEST_SAMPLE)
+    testdir.makepyfile(test_b=TEST_SAMPLE)
+    testdir.inline_run('--inc')
+    testdir.makepyfile(mod_b="X = 2\n")
+    capsys.readouterr()
+    testdir.inline_run('--inc-outdated', '--inc-explain')
+    out = capsys.readouterr()[0].splitlines()
+    pos = out.index('test_a.py  [outdated]')
+    assert out[pos + 1] == '    mod_b.py: test_a.py -> mod_a.py -> mod_b.py'
+    assert 'test_b.py  [outdated]' not in out
+
+
 def test_graph(testdir, capsys):
     test = testdir.makepyfile(TEST_SAMPLE)
     args = ['-v', '--inc-graph', test]
@@ -202,3 +233,592 @@ def test_inc_path(testdir, capsys):
         line.startswith('sub/test_x.py::test_foo PASSED')
         for line in out
     )
+
+
+def test_budget(testdir, capsys):
+    testdir.makepyfile(test_a=TEST_SAMPLE, test_b=TEST_SAMPLE)
+    # no history, only one test file selected
+    rec = testdir.inline_run('--inc', '--inc-budget', '0')
+    assert count_calls(get_results(rec)) == 2
+    out = capsys.readouterr()[0].splitlines()
+    assert 'test_b.py  [outdated - over budget]' in out
+
+    # test not executed because of budget is still outdated
+    rec = testdir.inline_run('--inc')
+    results = get_results(rec)
+    assert count_calls(results) == 2
+    assert results['test_foo', 'call'] == 'passed'
+
+
+def test_order_failed(testdir):
+    TEST_FAIL = """
+def test_fail():
+    assert False
+"""
+    testdir.makepyfile(test_a=TEST_SAMPLE, test_b=TEST_FAIL)
+    testdir.inline_run('--inc')
+    # modify test_a so it is outdated again, it comes first on topsort
+    testdir.makepyfile(test_a=TEST_SAMPLE + "\n# modified\n")
+    rec = testdir.inline_run('--inc', '--inc-order', 'failed')
+    calls = [r.nodeid for r in rec.getreports() if r.when == 'call']
+    assert calls == ['test_b.py::test_fail', 'test_a.py::test_foo',
+                     'test_a.py::test_bar']
+
+
+def test_order_fixtures(testdir):
+    CONFTEST = """
+import time
+import pytest
+
+@pytest.fixture(scope='package')
+def db():
+    time.sleep(0.02)
+    with open('setup.log', 'a') as fp:
+        fp.write('db\\n')
+"""
+    testdir.makepyfile(lib="X = 1\n", app="import lib\n")
+    pkg_a = testdir.mkpydir('pkg_a')
+    pkg_a.join('conftest.py').write(CONFTEST)
+    pkg_a.join('test_1.py').write("def test_1(db):\n    pass\n")
+    pkg_a.join('test_3.py').write(
+        "import app\ndef test_3(db):\n    pass\n")
+    testdir.mkpydir('pkg_b').join('test_2.py').write(
+        "import lib\ndef test_2():\n    pass\n")
+    from pytest_incremental import StateStore
+    def setup_duration():
+        store = StateStore(str(testdir.tmpdir.join('.pytest-incremental')))
+        fixture = str(testdir.tmpdir.join('pkg_a')) + '::db'
+        duration = store.get('fixture-setup', fixture)
+        store.close()
+        return duration
+    def modify(version):
+        testdir.makepyfile(lib="X = {}\n".format(version))
+        testdir.tmpdir.join('pkg_a', 'test_1.py').write(
+            "def test_1(db):\n    pass\n# {}\n".format(version))
+        testdir.tmpdir.join('setup.log').remove()
+
+    testdir.inline_run('--inc')
+    # topsort executes pkg_b/test_2.py between tests from pkg_a
+    assert testdir.tmpdir.join('setup.log').read() == 'db\ndb\n'
+    # setup duration saved only for --inc-order fixtures
+    assert setup_duration() is None
+    modify(2)
+    testdir.inline_run('--inc', '--inc-order', 'fixtures')
+    assert testdir.tmpdir.join('setup.log').read() == 'db\ndb\n'
+    assert setup_duration() >= 0.02
+
+    modify(3)
+    rec = testdir.inline_run('--inc', '--inc-order', 'fixtures')
+    calls = [r.nodeid for r in rec.getreports() if r.when == 'call']
+    assert calls == ['pkg_a/test_1.py::test_1', 'pkg_a/test_3.py::test_3',
+                     'pkg_b/test_2.py::test_2']
+    assert testdir.tmpdir.join('setup.log').read() == 'db\n'
+
+
+def test_level_gate(testdir, capsys):
+    testdir.makepyfile(
+        lib="def foo():\n    return 'bar'\n",
+        app="import lib\ndef app():\n    return lib.foo()\n",
+        other="def other():\n    return 1\n",
+        test_lib="import lib\ndef test_lib():\n    assert lib.foo() == 'foo'\n",
+        test_app="import app\ndef test_app():\n    assert app.app()\n",
+        test_other="import other\ndef test_other():\n    assert other.other()\n",
+    )
+    rec = testdir.inline_run('--inc', '--inc-level-gate')
+    results = get_results(rec)
+    assert results['test_lib', 'call'] == 'failed'
+    assert results['test_app', 'setup'] == 'skipped'
+    assert results['test_other', 'call'] == 'passed'
+    out = capsys.readouterr()[0].splitlines()
+    assert 'test_app.py  [outdated - gated by test_lib.py]' in out
+
+    # gated test is still outdated
+    rec = testdir.inline_run('--inc')
+    results = get_results(rec)
+    assert results['test_app', 'call'] == 'passed'
+    assert ('test_other', 'call') not in results
+
+
+def test_profile(testdir, capsys):
+    test = testdir.makepyfile(TEST_SAMPLE)
+    testdir.inline_run('--inc', '--inc-profile-trace', 'trace.json', test)
+    out = capsys.readouterr()[0].splitlines()
+    assert any(line.startswith('doit-outdated ') for line in out)
+    assert 'Profile trace written in trace.json' in out
+    with open(str(testdir.tmpdir.join('trace.json'))) as fp:
+        events = json.load(fp)['traceEvents']
+    assert 'discovery' in [e['name'] for e in events]
+
+
+def test_background(testdir, capsys):
+    testdir.makepyfile(mod_a="X = 1\n")
+    testdir.makepyfile(test_a="import mod_a\n" + TEST_SAMPLE)
+    rec = testdir.inline_run('--inc', '--inc-background', '--inc-profile')
+    assert count_calls(get_results(rec)) == 2
+    out = capsys.readouterr()[0].splitlines()
+    assert any(line.startswith('prefetch-wait ') for line in out)
+    rec = testdir.inline_run('--inc', '--inc-background')
+    assert count_calls(get_results(rec)) == 0
+
+
+def test_gc(testdir, capsys):
+    testdir.makepyfile(mod_a="X = 1\n")
+    testdir.makepyfile(test_a="import mod_a\n" + TEST_SAMPLE)
+    testdir.makepyfile(test_b="import mod_a\n" + TEST_SAMPLE)
+    testdir.inline_run('--inc')
+    capsys.readouterr()
+    os.remove(str(testdir.tmpdir.join('test_b.py')))
+    rec = testdir.inline_run('--inc', '--inc-gc')
+    assert count_calls(get_results(rec)) == 0
+    out = capsys.readouterr()[0].splitlines()
+    assert ('removed 3 entries (get_dep: 1, history: 1, outdated: 1), '
+            'kept 9') in out
+
+
+def test_readonly(testdir):
+    testdir.makepyfile(mod_a="X = 1\n")
+    testdir.makepyfile(test_a="import mod_a\n" + TEST_SAMPLE)
+    rec = testdir.inline_run('--inc', '--inc-readonly')
+    assert count_calls(get_results(rec)) == 2
+    assert not testdir.tmpdir.listdir('.pytest-incremental*')
+    testdir.inline_run('--inc')
+    testdir.makepyfile(mod_a="X = 2\n")
+    for _ in range(2):
+        rec = testdir.inline_run('--inc', '--inc-readonly')
+        assert count_calls(get_results(rec)) == 2
+    rec = testdir.inline_run('--inc')
+    assert count_calls(get_results(rec)) == 2
+
+
+def test_fixtures(testdir):
+    CONFTEST = """
+import pytest
+import settings
+from helpers import cache
+
+pytest_plugins = ['myplugin']
+
+@pytest.fixture
+def db():
+    import helper
+    return helper.DB
+
+@pytest.fixture
+def web():
+    return 'web'
+"""
+    FIXTURE = "import pytest\n@pytest.fixture\ndef {}():\n    return {}\n"
+    testdir.makepyfile(
+        conftest=CONFTEST,
+        helper="DB = 'db'\n",
+        settings="DEBUG = False\n",
+        helpers=FIXTURE.format('cache', 1),
+        myplugin=FIXTURE.format('plug', 1),
+        test_a="def test_db(db):\n    assert db\n",
+        test_b="def test_web(web):\n    assert web\n",
+        test_c="def test_cache(cache):\n    assert cache\n",
+        test_d="def test_plug(plug):\n    assert plug\n",
+    )
+    def executed():
+        rec = testdir.inline_run('--inc', '--inc-fixtures')
+        return sorted(r.nodeid for r in rec.getreports() if r.when == 'call')
+
+    assert executed() == ['test_a.py::test_db', 'test_b.py::test_web',
+                          'test_c.py::test_cache', 'test_d.py::test_plug']
+    assert executed() == []
+
+    # change fixture re-exported by conftest, imported at module level
+    testdir.makepyfile(helpers=FIXTURE.format('cache', 2))
+    assert len(executed()) == 4
+
+    # change module imported by conftest only for its side-effects
+    testdir.makepyfile(settings="DEBUG = True\n")
+    assert len(executed()) == 4
+
+    # change fixture from a plugin listed in pytest_plugins
+    testdir.makepyfile(myplugin=FIXTURE.format('plug', 2))
+    # plugin fixtures might be used by any test
+    assert len(executed()) == 4
+
+    # change only fixture web
+    testdir.makepyfile(conftest=CONFTEST.replace("'web'", "'web2'"))
+    assert executed() == ['test_b.py::test_web']
+
+    # change module imported by fixture db
+    testdir.makepyfile(helper="DB = 'db2'\n")
+    assert executed() == ['test_a.py::test_db']
+
+    # change code not in a fixture
+    testdir.makepyfile(conftest=CONFTEST + "\nX = 1\n")
+    assert executed() == ['test_a.py::test_db', 'test_b.py::test_web',
+                          'test_c.py::test_cache', 'test_d.py::test_plug']
+
+
+def test_query_fixtures(testdir):
+    testdir.makepyfile(
+        conftest=("import pytest\n"
+                  "@pytest.fixture\ndef db():\n    return 'db'\n"
+                  "@pytest.fixture\ndef web():\n    return 'web'\n"),
+        test_a="def test_db(db):\n    assert db\n",
+        test_b="def test_web(web):\n    assert web\n",
+    )
+    def executed():
+        rec = testdir.inline_run('--inc', '--inc-fixtures')
+        return sorted(r.nodeid for r in rec.getreports() if r.when == 'call')
+
+    assert executed() == ['test_a.py::test_db', 'test_b.py::test_web']
+    conftest = testdir.tmpdir.join('conftest.py')
+    conftest.write(conftest.read().replace("'web'", "'web2'"))
+    # same answer as the plugin
+    query = Query(fixture_deps=True)
+    assert list(query.outdated()) == [str(testdir.tmpdir.join('test_b.py'))]
+    assert executed() == ['test_b.py::test_web']
+
+
+def test_extra_deps(testdir):
+    INI = "[pytest]\ninc_extra_deps =\n    test_a.py: data/*.json\n"
+    testdir.makeini(INI)
+    data = testdir.mkdir('data')
+    data.join('x.json').write('{}')
+    testdir.makepyfile(test_a=TEST_SAMPLE)
+    testdir.makepyfile(test_b="""
+import os
+import pytest
+
+@pytest.mark.inc_deps('*.txt')
+def test_txt():
+    pass
+""")
+    testdir.tmpdir.join('b.txt').write('b')
+    def executed():
+        rec = testdir.inline_run('--inc')
+        return sorted(set(r.nodeid.split('::')[0] for r in rec.getreports()
+                          if r.when == 'call'))
+
+    assert executed() == ['test_a.py', 'test_b.py']
+    assert executed() == []
+    data.join('x.json').write('{"x": 1}')
+    assert executed() == ['test_a.py']
+    data.join('y.json').write('{}')
+    assert executed() == ['test_a.py']
+    testdir.tmpdir.join('b.txt').write('b2')
+    assert executed() == ['test_b.py']
+    # pytest config file
+    testdir.makeini(INI + "addopts = -v\n")
+    assert executed() == ['test_a.py', 'test_b.py']
+
+
+def test_extra_deps_recursive(testdir):
+    testdir.makeini("[pytest]\ninc_extra_deps =\n    test_a.py: data/**\n")
+    data = testdir.mkdir('data')
+    data.mkdir('sub').join('x.json').write('{}')
+    testdir.makepyfile(test_a=TEST_SAMPLE)
+    def executed():
+        rec = testdir.inline_run('--inc')
+        assert rec.ret in (0, 5)
+        return sorted(set(r.nodeid.split('::')[0] for r in rec.getreports()
+                          if r.when == 'call'))
+
+    assert executed() == ['test_a.py']
+    assert executed() == []
+    data.join('sub', 'x.json').write('{"x": 1}')
+    assert executed() == ['test_a.py']
+
+
+def test_extra_deps_invalid(testdir, capsys):
+    testdir.makeini("[pytest]\ninc_extra_deps =\n    test_a.py data\n")
+    testdir.makepyfile(test_a=TEST_SAMPLE)
+    rec = testdir.inline_run('--inc')
+    err = capsys.readouterr()[1]
+    assert "Invalid inc_extra_deps entry (missing ':'): test_a.py data" in err
+    assert rec.ret != 0
+
+
+def test_record_deps(testdir):
+    testdir.makepyfile(dyn="X = 1\n")
+    testdir.makepyfile(test_a="""
+import importlib
+
+def test_dyn():
+    assert importlib.import_module('dyn').X
+""")
+    testdir.makepyfile(test_b=TEST_SAMPLE)
+    def executed(*args):
+        rec = testdir.inline_run('--inc', '--inc-record-deps', *args)
+        return sorted(set(r.nodeid.split('::')[0] for r in rec.getreports()
+                          if r.when == 'call'))
+
+    assert executed() == ['test_a.py', 'test_b.py']
+    assert executed() == []
+    # not a static dependency
+    testdir.makepyfile(dyn="X = 2\n")
+    assert executed() == ['test_a.py']
+    assert executed() == []
+    # observed deps are kept even if not recorded again
+    testdir.makepyfile(test_b=TEST_SAMPLE + "X = 1\n")
+    assert executed() == ['test_b.py']
+    testdir.makepyfile(dyn="X = 3\n")
+    assert executed() == ['test_a.py']
+
+
+def test_record_deps_collection_error(testdir):
+    import builtins
+    import importlib
+    orig = (builtins.__import__, importlib.import_module, builtins.open)
+    testdir.makepyfile(test_a=TEST_SAMPLE)
+    testdir.makepyfile(test_b="import not_a_module\n")
+    rec = testdir.inline_run('--inc', '--inc-record-deps-open')
+    assert rec.ret == 2
+    # hooks removed even if no test was executed
+    assert (builtins.__import__, importlib.import_module,
+            builtins.open) == orig
+
+
+def test_record_deps_open(testdir):
+    testdir.tmpdir.join('data.txt').write('x')
+    testdir.makepyfile(test_a="""
+def test_data():
+    with open('data.txt') as fp:
+        assert fp.read()
+""")
+    def executed():
+        rec = testdir.inline_run('--inc', '--inc-record-deps-open')
+        return sorted(set(r.nodeid.split('::')[0] for r in rec.getreports()
+                          if r.when == 'call'))
+
+    assert executed() == ['test_a.py']
+    assert executed() == []
+    testdir.tmpdir.join('data.txt').write('y')
+    assert executed() == ['test_a.py']
+
+
+def test_lines(testdir):
+    pytest.importorskip('coverage')
+    MOD = """
+X = 1
+
+def f():
+    return 1
+
+def g():
+    return 2
+"""
+    testdir.makepyfile(mod=MOD)
+    testdir.makepyfile(test_f="import mod\ndef test_f():\n    mod.f()\n")
+    testdir.makepyfile(test_g="import mod\ndef test_g():\n    mod.g()\n")
+    def executed():
+        rec = testdir.inline_run('--inc', '--inc-lines')
+        return sorted(set(r.nodeid.split('::')[0] for r in rec.getreports()
+                          if r.when == 'call'))
+
+    assert executed() == ['test_f.py', 'test_g.py']
+    assert executed() == []
+    # only test_g executes g()
+    testdir.makepyfile(mod=MOD.replace('return 2', 'return 3'))
+    assert executed() == ['test_g.py']
+    assert executed() == []
+    # line numbers of f() changed
+    MOD2 = MOD.replace('return 2', 'return 3').replace('X = 1', 'X = 1\n\n')
+    testdir.makepyfile(mod=MOD2)
+    assert executed() == []
+    testdir.makepyfile(mod=MOD2.replace('return 1', 'return 4'))
+    assert executed() == ['test_f.py']
+    # module level code
+    testdir.makepyfile(mod=MOD2.replace('X = 1', 'X = 2'))
+    assert executed() == ['test_f.py', 'test_g.py']
+
+
+def test_lines_readonly(testdir):
+    pytest.importorskip('coverage')
+    MOD = "def f():\n    return 1\n\ndef g():\n    return 2\n"
+    TEST = """import coverage, mod
+def test_f():
+    with open('coverage.txt', 'w') as fp:
+        fp.write(str(coverage.Coverage.current() is not None))
+    mod.f()
+"""
+    testdir.makepyfile(mod=MOD, test_f=TEST)
+    testdir.inline_run('--inc', '--inc-lines')
+    assert testdir.tmpdir.join('coverage.txt').read() == 'True'
+    # line level selection from saved state
+    testdir.makepyfile(mod=MOD.replace('return 2', 'return 3'))
+    rec = testdir.inline_run('--inc', '--inc-lines', '--inc-readonly')
+    assert count_calls(get_results(rec)) == 0
+    # lines are not recorded
+    testdir.makepyfile(test_f=TEST + "# modified\n")
+    rec = testdir.inline_run('--inc', '--inc-lines', '--inc-readonly')
+    assert count_calls(get_results(rec)) == 1
+    assert testdir.tmpdir.join('coverage.txt').read() == 'False'
+
+
+def test_lines_multiline_statement(testdir):
+    pytest.importorskip('coverage')
+    MOD = "def f():\n    return (\n        1,\n        2,\n    )\n"
+    testdir.makepyfile(mod=MOD)
+    testdir.makepyfile(
+        test_f="import mod\ndef test_f():\n    assert mod.f() == (1, 2)\n")
+    rec = testdir.inline_run('--inc', '--inc-lines')
+    assert count_calls(get_results(rec)) == 1
+    # modified line is not reported as executed by coverage
+    testdir.makepyfile(mod=MOD.replace('2,', '3,'))
+    rec = testdir.inline_run('--inc', '--inc-lines')
+    assert rec.countoutcomes() == [0, 0, 1]
+
+
+def test_lines_results_partition(testdir):
+    pytest.importorskip('coverage')
+    MOD = "def f():\n    return 1\n\ndef g():\n    return 2\n"
+    testdir.makepyfile(mod=MOD)
+    testdir.makepyfile(test_f="import mod\ndef test_f():\n    mod.f()\n")
+    testdir.inline_run('--inc')
+    testdir.inline_run('--inc', '--inc-lines')
+    testdir.makepyfile(mod=MOD.replace('return 2', 'return 3'))
+    rec = testdir.inline_run('--inc', '--inc-lines')
+    assert count_calls(get_results(rec)) == 0
+    # success on line level not used without line level selection
+    rec = testdir.inline_run('--inc')
+    assert count_calls(get_results(rec)) == 1
+    rec = testdir.inline_run('--inc', '--inc-lines')
+    assert count_calls(get_results(rec)) == 0
+
+
+def test_distributions(testdir, tmpdir_factory, monkeypatch):
+    from pytest_incremental import Distributions
+    if Distributions._metadata() is None:
+        pytest.skip('packages_distributions() not available')
+    # installed packages are outside watched path
+    site = tmpdir_factory.mktemp('site')
+    site.mkdir('fakedist').join('__init__.py').write('')
+    def install(version):
+        for info in site.listdir('*.dist-info'):
+            info.remove()
+        info = site.mkdir('fakedist-{}.dist-info'.format(version))
+        info.join('METADATA').write(
+            'Metadata-Version: 2.1\nName: fakedist\nVersion: {}\n'.format(
+                version))
+        info.join('top_level.txt').write('fakedist\n')
+        importlib.invalidate_caches()
+    install('1.0')
+    monkeypatch.syspath_prepend(str(site))
+    testdir.makepyfile(test_a="import fakedist\n" + TEST_SAMPLE)
+    testdir.makepyfile(test_b=TEST_SAMPLE)
+    def executed():
+        rec = testdir.inline_run('--inc', 'test_a.py', 'test_b.py')
+        return sorted(set(r.nodeid.split('::')[0] for r in rec.getreports()
+                          if r.when == 'call'))
+
+    assert executed() == ['test_a.py', 'test_b.py']
+    assert executed() == []
+    install('1.1')
+    assert executed() == ['test_a.py']
+    assert executed() == []
+
+
+def test_demand(testdir):
+    testdir.makepyfile(mod_a="X = 1\n", mod_b="X = 1\n")
+    testdir.makepyfile(test_a="import mod_a\n" + TEST_SAMPLE)
+    testdir.makepyfile(test_b="import mod_b\n" + TEST_SAMPLE)
+    def executed(*args):
+        rec = testdir.inline_run('--inc', '--inc-demand', *args)
+        return sorted(set(r.nodeid.split('::')[0] for r in rec.getreports()
+                          if r.when == 'call'))
+
+    assert executed('test_a.py') == ['test_a.py']
+    testdir.makepyfile(mod_b="X = 2\n")
+    assert executed('test_a.py') == []
+    assert executed() == ['test_b.py']
+    testdir.makepyfile(mod_a="import mod_b\n")
+    assert executed('test_a.py') == ['test_a.py']
+
+
+def test_package_init(testdir):
+    pkg = testdir.mkpydir('pkg')
+    pkg.join('mod.py').write('X = 1\n')
+    testdir.makepyfile(test_a="from pkg import mod\n" + TEST_SAMPLE)
+    rec = testdir.inline_run('--inc')
+    assert count_calls(get_results(rec)) == 2
+    # importing pkg.mod executes pkg/__init__.py
+    pkg.join('__init__.py').write('Y = 1\n')
+    rec = testdir.inline_run('--inc')
+    assert count_calls(get_results(rec)) == 2
+
+
+def test_environment(testdir, monkeypatch):
+    testdir.makeini("[pytest]\ninc_env_vars =\n    INC_TEST_ENV\n")
+    testdir.makepyfile(test_a=TEST_SAMPLE)
+    def executed(env):
+        monkeypatch.setenv('INC_TEST_ENV', env)
+        rec = testdir.inline_run('--inc')
+        return sorted(set(r.nodeid.split('::')[0] for r in rec.getreports()
+                          if r.when == 'call'))
+
+    assert executed('a') == ['test_a.py']
+    assert executed('a') == []
+    assert executed('b') == ['test_a.py']
+    assert executed('b') == []
+    # results from other environment are kept
+    assert executed('a') == []
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_zygote(testdir, tmpdir_factory):
+    import time
+    import subprocess
+    site = tmpdir_factory.mktemp('site')
+    counter = site.join('imported')
+    site.mkdir('fake3rd').join('__init__.py').write(
+        "import os\n"
+        "with open(os.environ['FAKE_COUNTER'], 'a') as fp:\n"
+        "    fp.write('x')\n")
+    testdir.makepyfile(mod_a="import fake3rd\nX = 1\n")
+    testdir.makepyfile(test_a="import mod_a\ndef test_x():\n"
+                       "    assert mod_a.X == 1\n")
+    env = dict(os.environ, FAKE_COUNTER=str(counter))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(site)] + [p for p in [os.environ.get('PYTHONPATH')] if p])
+    def run(*args):
+        return subprocess.run(
+            [sys.executable, '-m', 'pytest_incremental'] + list(args),
+            cwd=str(testdir.tmpdir), env=env, stdout=subprocess.PIPE,
+            universal_newlines=True)
+
+    # no zygote, executed on client process
+    result = run('run', '--', '--inc', '-p', 'no:cacheprovider')
+    assert result.returncode == 0
+    assert '1 passed' in result.stdout
+    assert counter.read() == 'x'
+
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'pytest_incremental', 'zygote'],
+        cwd=str(testdir.tmpdir), env=env)
+    try:
+        sock = testdir.tmpdir.join('.pytest-zygote.sock')
+        for _ in range(100):
+            if sock.exists():
+                break
+            time.sleep(0.05)
+        # third-party module imported by the zygote
+        assert counter.read() == 'xx'
+        testdir.makepyfile(mod_a="import fake3rd\nX = 2\n")
+        result = run('run', '--', '--inc', '-p', 'no:cacheprovider')
+        assert result.returncode == 1
+        assert '1 failed' in result.stdout
+        testdir.makepyfile(mod_a="import fake3rd\nX = 1\n")
+        result = run('run', '--', '--inc', '-p', 'no:cacheprovider')
+        assert result.returncode == 0
+        assert '1 passed' in result.stdout
+        result = run('run', '--', '--inc', '-p', 'no:cacheprovider')
+        assert result.returncode == 5
+        assert counter.read() == 'xx'
+        assert os.stat(str(sock)).st_mode & 0o777 == 0o600
+
+        # different sys.path, executed on client process
+        env['PYTHONPATH'] += os.pathsep + str(site.mkdir('other'))
+        testdir.makepyfile(mod_a="import fake3rd\nX = 2\n")
+        result = run('run', '--', '--inc', '-p', 'no:cacheprovider')
+        assert result.returncode == 1
+        assert counter.read() == 'xxx'
+    finally:
+        server.terminate()
+        server.wait()
+    assert not sock.exists()
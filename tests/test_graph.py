@@ -1,6 +1,9 @@
 from __future__ import unicode_literals
 
-from pytest_incremental import StringIO, GNode, DepGraph
+import pytest
+
+from pytest_incremental import StringIO, GNode, DepGraph, GraphFile
+from pytest_incremental import ModuleIndex, FileModuleIndex
 
 class Test_GNode(object):
     def test_repr(self):
@@ -135,6 +138,81 @@ class Test_DepGraph(object):
         assert '"d" -> "e"' in lines
 
 
+    def test_write_deps(self):
+        output = StringIO()
+        self.graph.write_deps(output)
+        lines = output.getvalue().splitlines()
+        assert len(lines) == 5
+        assert ' - b: b, c, d, e' in lines
+
+    def test_write_deps_jsonl(self):
+        output = StringIO()
+        self.graph.write_deps(output, 'jsonl', ['d', 'c'])
+        lines = output.getvalue().splitlines()
+        assert lines == ['{"node": "c", "deps": ["c"]}',
+                         '{"node": "d", "deps": ["c", "d", "e"]}']
+
+    def test_write_deps_csv(self):
+        output = StringIO()
+        self.graph.write_deps(output, 'csv', ['d'])
+        lines = output.getvalue().splitlines()
+        assert lines == ['node,dep', 'd,c', 'd,d', 'd,e']
+
+    def test_distance(self):
+        assert 0 == self.graph.distance('a', set(['a', 'e']))
+        assert 1 == self.graph.distance('a', set(['c', 'e']))
+        assert 3 == self.graph.distance('a', set(['e']))
+        assert None is self.graph.distance('b', set(['a']))
+
+    def test_distance_implicit_dep(self):
+        graph = DepGraph({'a': ['b'], 'b': [], 'conf': []})
+        graph.nodes['a'].implicit_deps.append(graph.nodes['conf'])
+        assert 1 == graph.distance('a', set(['conf']))
+
+    def test_dependents(self):
+        assert set(['a', 'b', 'd']) == self.graph.dependents(['d'])
+        assert set(['a', 'b', 'c', 'd']) == self.graph.dependents(['c', 'x'])
+
+    def test_shortest_paths(self):
+        paths = self.graph.shortest_paths(
+            [('a', 'e'), ('a', 'c'), ('b', 'c'), ('c', 'a'), ('e', 'e'),
+             ('a', 'x')])
+        assert paths == {
+            ('a', 'e'): ['a', 'b', 'd', 'e'],
+            ('a', 'c'): ['a', 'c'],
+            ('b', 'c'): ['b', 'd', 'c'],
+            ('c', 'a'): None,
+            ('e', 'e'): ['e'],
+            ('a', 'x'): None,
+        }
+
+    def test_dependents_implicit_dep(self):
+        graph = DepGraph({'a': ['b'], 'b': [], 'conf': []})
+        graph.nodes['b'].implicit_deps.append(graph.nodes['conf'])
+        assert set(['a', 'b', 'conf']) == graph.dependents(['conf'])
+
+
+    def test_levels(self):
+        assert {'a': 3, 'b': 2, 'd': 1, 'c': 0, 'e': 0} == self.graph.levels()
+
+    def test_levels_cycle(self):
+        graph = DepGraph({
+            'a': ['b'],
+            'b': ['c'],
+            'c': ['b', 'd'],
+            'd': [],
+            'e': ['a', 'd'],
+        })
+        assert {'a': 2, 'b': 1, 'c': 1, 'd': 0, 'e': 3} == graph.levels()
+
+    def test_levels_deep_chain(self):
+        # no recursion limit
+        graph = DepGraph({str(i): [str(i+1)] for i in range(5000)})
+        levels = graph.levels()
+        assert levels['5000'] == 0
+        assert levels['0'] == 5000
+
+
     def test_topsort_simple(self):
         graph = DepGraph({
             'a': ['c'],
@@ -179,3 +257,62 @@ class Test_DepGraph(object):
             'd': []
         })
         assert ['d', 'a', 'b', 'c'] == graph.topsort()
+
+
+class Test_GraphFile(object):
+    deps = {
+        'a': ['b', 'c'],
+        'b': ['d'],
+        'c': [],
+        'd': ['c', 'e'],
+        'e': [],
+        '\xe7': ['a'],
+    }
+
+    def test_read(self, tmpdir):
+        path = str(tmpdir.join('deps.graph'))
+        GraphFile.write(path, self.deps, {'a': ['six', 'attr'], 'c': ['six']})
+        graph_file = GraphFile(path)
+        assert graph_file.num_nodes == 6
+        assert graph_file.find('\xe7') == 5
+        assert graph_file.find('x') is None
+        assert [graph_file.name(n) for n in graph_file.deps(0)] == ['b', 'c']
+        assert graph_file.get_externals('a') == ['six', 'attr']
+        assert graph_file.get_externals('e') == []
+        assert graph_file.get_externals('x') == ()
+        assert graph_file.topsort() == DepGraph(self.deps).topsort()
+
+    def test_graph(self, tmpdir):
+        path = str(tmpdir.join('deps.graph'))
+        GraphFile.write(path, self.deps)
+        graph = DepGraph.from_file(GraphFile(path))
+        assert len(graph.nodes) == 6
+        assert 'x' not in graph.nodes
+        b_deps = [n.name for n in graph.nodes['b'].all_deps()]
+        assert set(b_deps) == set(['c', 'e', 'b', 'd'])
+        assert graph.nodes['a'] is graph.nodes['\xe7'].deps.pop()
+
+    def test_invalid(self, tmpdir):
+        path = str(tmpdir.join('deps.graph'))
+        tmpdir.join('deps.graph').write('{}')
+        assert not GraphFile.is_valid(path)
+        assert not GraphFile.is_valid(str(tmpdir.join('missing')))
+        with pytest.raises(ValueError):
+            GraphFile(path)
+        GraphFile.write(path, self.deps)
+        assert GraphFile.is_valid(path)
+
+    def test_module_index(self, tmpdir):
+        path = str(tmpdir.join('deps.graph'))
+        index = ModuleIndex(['/p/pkg/__init__.py', '/p/pkg/a.py',
+                             '/p/ns/b.py'], ['/p'])
+        GraphFile.write(path, self.deps, module_index=index)
+        saved = FileModuleIndex(GraphFile(path))
+        assert saved.digest == index.digest
+        assert saved.resolve('pkg.a.func') == '/p/pkg/a.py'
+        assert saved.resolve('ns.b') == '/p/ns/b.py'
+        assert saved.resolve('x') is None
+        assert saved.fqn('/p/pkg/a.py') == ['pkg', 'a']
+        assert '/p/x.py' not in saved
+        assert saved.to_dict() == index.to_dict()
+        assert saved.package_init('/p/pkg/a.py') == '/p/pkg/__init__.py'
@@ -1,13 +1,24 @@
 import os
 import re
+import sys
+import json
+import shutil
+import subprocess
 
 from io import StringIO
 import pytest
 from doit.cmd_run import Run
 from doit.cmd_base import DodoTaskLoader
 
-from pytest_incremental import IncrementalTasks
+from pytest_incremental import IncrementalTasks, GraphFile
 from pytest_incremental import IncrementalControl, OutdatedReporter
+from pytest_incremental import CountReporter, Profiler, ConftestFixtures
+from pytest_incremental import DepsRecorder, LineDiff, ItemResults
+from pytest_incremental import statement_lines
+from pytest_incremental import Distributions, stdlib_modules
+from pytest_incremental import to_intervals, intervals_overlap
+from pytest_incremental import Query, main, ModuleIndex
+from pytest_incremental import GitIndex, git_blob_id
 
 
 #### fixture for "doit.db". create/remove for every test
@@ -59,7 +70,7 @@ def cmd_run(request, depfile_name):
 def rm_generated_deps(request):
     """remove deps.* files generated from running tasks on sample-inc folder"""
     def remove():
-        for path in ('deps.json', 'deps.dot', 'deps.svg'):
+        for path in ('deps.graph', 'deps.dot', 'deps.svg'):
             try:
                 os.remove(os.path.join(SAMPLE_DIR, path))
             except OSError:
@@ -76,7 +87,7 @@ class TestTasks(object):
         # leaving the output from tasks directly into stdout but not on
         # specified outstream
         out = capsys.readouterr()[0].splitlines()
-        assert '.  dep-json' in got
+        assert '.  dep-graph' in got
         assert ' - mod2.py: mod1.py, mod2.py' in out
         mod2_deps = 'mod1.py, mod2.py, tt/conftest.py, tt/tt_mod2.py'
         assert ' - tt/tt_mod2.py: ' + mod2_deps in out
@@ -101,9 +112,209 @@ class TestTasks(object):
 
 
 
+class TestIncrementalTasksGraph(object):
+    def create_graph(self, tmpdir, deps):
+        graph_file = str(tmpdir.join('deps.graph'))
+        GraphFile.write(graph_file, deps)
+        return IncrementalTasks([], [], graph_file=graph_file).create_graph()
+
+    def implicit(self, graph, path):
+        return sorted(n.name for n in graph.nodes[path].implicit_deps)
+
+    def test_conftest_deps(self, tmpdir):
+        graph = self.create_graph(tmpdir, {
+            '/p/conftest.py': [],
+            '/p/a/conftest.py': [],
+            '/p/a/b/test_x.py': [],
+            '/p/a/mod.py': [],
+            '/p/mod.py': [],
+            '/other/mod.py': [],
+        })
+        assert self.implicit(graph, '/p/conftest.py') == []
+        assert self.implicit(graph, '/p/a/conftest.py') == ['/p/conftest.py']
+        assert self.implicit(graph, '/p/a/b/test_x.py') == [
+            '/p/a/conftest.py', '/p/conftest.py']
+        assert self.implicit(graph, '/p/a/mod.py') == [
+            '/p/a/conftest.py', '/p/conftest.py']
+        assert self.implicit(graph, '/p/mod.py') == ['/p/conftest.py']
+        assert self.implicit(graph, '/other/mod.py') == []
+
+    def test_conftest_sibling_prefix(self, tmpdir):
+        graph = self.create_graph(tmpdir, {
+            '/p/app/conftest.py': [],
+            '/p/app/mod.py': [],
+            '/p/app2/mod.py': [],
+            '/p/app2/myconftest.py': [],
+        })
+        assert self.implicit(graph, '/p/app/mod.py') == ['/p/app/conftest.py']
+        assert self.implicit(graph, '/p/app2/mod.py') == []
+
+
+CONFTEST_SAMPLE = """
+import pytest
+import settings
+
+@pytest.fixture
+def db():
+    import helper
+    return helper.connect()
+
+@pytest.fixture(scope='session', name='web_app')
+def make_web():
+    # a comment
+    return 'web'
+
+@pytest.fixture
+def other():
+    from helper import other as other_helper
+    return other_helper
+
+def pytest_configure(config):
+    pass
+"""
+
+class TestModuleIndex(object):
+    files = ['/p/pkg/__init__.py', '/p/pkg/mod.py', '/p/pkg/sub/__init__.py',
+             '/p/pkg/sub/a.py', '/p/src/ns/b.py', '/p/tests/test_x.py']
+
+    def test_fqn(self):
+        index = ModuleIndex(self.files, ['/p'])
+        assert index.fqn('/p/pkg/sub/a.py') == ['pkg', 'sub', 'a']
+        assert index.fqn('/p/pkg/__init__.py') == ['pkg', '__init__']
+        assert index.fqn('/p/src/ns/b.py') == ['b']
+        assert '/p/pkg/sub/a.py' in index
+        assert '/p/pkg/x.py' not in index
+
+    def test_resolve(self):
+        index = ModuleIndex(self.files, ['/p'])
+        assert index.resolve('pkg') == '/p/pkg/__init__.py'
+        assert index.resolve('pkg.sub.a') == '/p/pkg/sub/a.py'
+        assert index.resolve('pkg.sub.a.func') == '/p/pkg/sub/a.py'
+        assert index.resolve('pkg.sub.func') == '/p/pkg/sub/__init__.py'
+        # namespace package on src-layout
+        assert index.resolve('ns.b') == '/p/src/ns/b.py'
+        assert index.resolve('tests.test_x') == '/p/tests/test_x.py'
+        assert index.resolve('os.path') is None
+        assert index.resolve('other') is None
+
+    def test_package_init(self):
+        index = ModuleIndex(self.files)
+        init = '/p/pkg/__init__.py'
+        sub_init = '/p/pkg/sub/__init__.py'
+        assert index.package_init('/p/pkg/sub/a.py') == sub_init
+        assert index.package_init(sub_init) == init
+        assert index.package_init(init) is None
+        assert index.package_init('/p/tests/test_x.py') is None
+
+    def test_digest(self):
+        digest = ModuleIndex(self.files).digest
+        assert digest == ModuleIndex(list(reversed(self.files))).digest
+        assert digest != ModuleIndex(self.files[1:]).digest
+        assert digest != ModuleIndex(self.files, ['/p']).digest
+
+
+def git(cwd, *args):
+    return subprocess.check_output(('git',) + args, cwd=str(cwd)).decode()
+
+@pytest.fixture
+def git_repo(tmpdir):
+    if shutil.which('git') is None:  # pragma: no cover
+        pytest.skip('git not available')
+    git(tmpdir, 'init', '-q')
+    tmpdir.join('mod.py').write('X = 1\n')
+    tmpdir.mkdir('pkg').join('test_a.py').write('import mod\n')
+    tmpdir.join('new.py').write('N = 1\n')
+    # avoid racily clean entries (modified on same time index is written)
+    for path in ('mod.py', 'pkg/test_a.py'):
+        os.utime(str(tmpdir.join(path)), (1000000000, 1000000000))
+    git(tmpdir, 'add', 'mod.py', 'pkg/test_a.py')
+    git(tmpdir, 'add', '-N', 'new.py')  # intent-to-add uses version 3
+    return tmpdir
+
+
+class TestGitIndex(object):
+    @pytest.mark.parametrize('version', ['3', '4'])
+    def test_blob_id(self, git_repo, version):
+        git(git_repo, 'update-index', '--index-version', version)
+        index = GitIndex.find(str(git_repo.join('pkg')))
+        assert index.work_tree == str(git_repo)
+        mod = str(git_repo.join('mod.py'))
+        expected = git(git_repo, 'hash-object', 'mod.py').strip()
+        assert index.blob_id(mod, os.stat(mod)) == expected
+        assert git_blob_id(mod) == expected
+        test_a = str(git_repo.join('pkg', 'test_a.py'))
+        assert index.blob_id(test_a, os.stat(test_a)) is not None
+        # intent-to-add and untracked
+        new = str(git_repo.join('new.py'))
+        assert index.blob_id(new, os.stat(new)) is None
+        # modified
+        git_repo.join('mod.py').write('X = 2\n')
+        assert index.blob_id(mod, os.stat(mod)) is None
+
+    def test_not_git(self, tmpdir):
+        assert GitIndex.find(str(tmpdir)) is None
+
+
+class TestConftestFixtures(object):
+    def get_fixtures(self, tmpdir, source):
+        conftest = tmpdir.join('conftest.py')
+        conftest.write(source)
+        helper = tmpdir.join('helper.py')
+        helper.write('def connect(): pass\n')
+        tmpdir.join('other.py').write('')
+        self.settings = tmpdir.join('settings.py')
+        self.settings.write('')
+        paths = [str(conftest), str(helper), str(self.settings)]
+        return ConftestFixtures(str(conftest), ModuleIndex(paths)), str(helper)
+
+    def test_fixtures(self, tmpdir):
+        info, helper = self.get_fixtures(tmpdir, CONFTEST_SAMPLE)
+        assert set(info.fingerprints) == set(['', 'db', 'web_app', 'other'])
+        assert info.imports['db'] == set([helper])
+        assert info.imports['other'] == set([helper])
+        assert info.imports['web_app'] == set()
+        # module level imports are executed when conftest is loaded
+        assert info.imports[''] == set([str(self.settings)])
+
+    def test_get_used(self, tmpdir):
+        info, helper = self.get_fixtures(tmpdir, CONFTEST_SAMPLE)
+        fingerprints, imports = info.get_used(['db', 'tmpdir'])
+        assert set(fingerprints) == set(['', 'db'])
+        assert imports == set([helper, str(self.settings)])
+        fingerprints, imports = info.get_used(['web_app'])
+        assert set(fingerprints) == set(['', 'web_app'])
+        assert imports == set([str(self.settings)])
+
+    def test_fingerprint_ignore_format(self, tmpdir):
+        info, _ = self.get_fixtures(tmpdir, CONFTEST_SAMPLE)
+        source = CONFTEST_SAMPLE.replace("# a comment", "")
+        source = source.replace("def pytest_configure(config):",
+                                "def pytest_configure(config) :")
+        info2, _ = self.get_fixtures(tmpdir, source)
+        assert info.fingerprints == info2.fingerprints
+
+        source = CONFTEST_SAMPLE.replace("'web'", "'web2'")
+        info3, _ = self.get_fixtures(tmpdir, source)
+        assert info.fingerprints['web_app'] != info3.fingerprints['web_app']
+        assert info.fingerprints['db'] == info3.fingerprints['db']
+        assert info.fingerprints[''] == info3.fingerprints['']
+
+
 class FakeTask(object):
-    def __init__(self, name):
+    def __init__(self, name, has_subtask=False):
         self.name = name
+        self.has_subtask = has_subtask
+
+class TestCountReporter(object):
+    def test_stats(self):
+        rep = CountReporter(StringIO(), None)
+        rep.execute_task(FakeTask('get_dep', has_subtask=True))
+        rep.execute_task(FakeTask('get_dep:a.py'))
+        rep.skip_uptodate(FakeTask('get_dep:b.py'))
+        rep.skip_uptodate(FakeTask('outdated:c.py'))
+        assert rep.stats == {'get_dep': {'hit': 1, 'miss': 1},
+                             'outdated': {'hit': 1, 'miss': 0}}
+
 class TestOutdatedRerporter(object):
     def test_output(self):
         output = StringIO()
@@ -115,6 +326,23 @@ class TestOutdatedRerporter(object):
         rep.complete_run()
         assert output.getvalue() == '["xxx", "yyy"]'
 
+    def test_output_env_key(self):
+        output = StringIO()
+        rep = OutdatedReporter(output, None)
+        rep.execute_task(FakeTask('outdated:x@y.py@0123456789ab'))
+        # '@' in path without env key
+        rep.execute_task(FakeTask('outdated:x@z.py'))
+        rep.complete_run()
+        assert output.getvalue() == '["x@y.py", "x@z.py"]'
+
+    def test_changed(self):
+        rep = OutdatedReporter(StringIO(), None)
+        task = FakeTask('outdated:xxx')
+        task.dep_changed = ['a.py']
+        rep.execute_task(task)
+        rep.execute_task(FakeTask('outdated:yyy'))
+        assert rep.changed == {'xxx': ['a.py'], 'yyy': []}
+
     def test_failure(self):
         output = StringIO()
         rep = OutdatedReporter(output, None)
@@ -130,6 +358,193 @@ class TestOutdatedRerporter(object):
         pytest.raises(Exception, rep.runtime_error, 'error msg')
 
 
+class TestProfiler(object):
+    def test_phase(self):
+        profiler = Profiler()
+        with profiler.phase('foo', files=1) as info:
+            info['bytes'] = 10
+        with profiler.phase('foo', files=2):
+            pass
+        profiler.count('foo', hit=3, miss=1)
+        stat = profiler.stats['foo']
+        assert stat['calls'] == 2
+        assert stat['wall'] >= 0
+        assert stat['counters'] == {'files': 3, 'bytes': 10,
+                                    'hit': 3, 'miss': 1}
+        assert len(profiler.events) == 2
+        assert profiler.events[0]['args']['bytes'] == 10
+        summary = profiler.summary()
+        assert summary[1].startswith('foo ')
+        assert ' 75%  bytes=10 files=3 hit=3 miss=1' in summary[1]
+
+    def test_phase_exception(self):
+        profiler = Profiler()
+        with pytest.raises(ValueError):
+            with profiler.phase('foo'):
+                raise ValueError()
+        assert profiler.stats['foo']['calls'] == 1
+
+    def test_disabled(self):
+        profiler = Profiler(enabled=False)
+        with profiler.phase('foo') as info:
+            info['files'] = 1
+        profiler.count('foo', hit=1)
+        assert profiler.stats == {}
+        assert profiler.events == []
+
+    def test_write_trace(self, tmpdir):
+        profiler = Profiler()
+        with profiler.phase('foo'):
+            pass
+        trace_file = str(tmpdir.join('trace.json'))
+        profiler.write_trace(trace_file)
+        with open(trace_file) as fp:
+            events = json.load(fp)['traceEvents']
+        assert [e['name'] for e in events] == ['foo']
+        assert events[0]['ph'] == 'X'
+
+
+class TestDepsRecorder(object):
+    def test_record(self, tmpdir, monkeypatch):
+        tmpdir.join('rec_a.py').write('')
+        tmpdir.join('rec_b.py').write('')
+        tmpdir.join('data.txt').write('x')
+        monkeypatch.syspath_prepend(str(tmpdir))
+        path_a = str(tmpdir.join('rec_a.py'))
+        path_b = str(tmpdir.join('rec_b.py'))
+        data = str(tmpdir.join('data.txt'))
+        recorder = DepsRecorder({path_a, path_b}, [str(tmpdir)])
+        recorder.start()
+        try:
+            __import__('rec_a')
+            recorder.set_current('t1')
+            # already imported, not in sys.modules delta
+            import rec_a
+            assert rec_a
+            recorder.set_current('t2')
+            import importlib
+            importlib.import_module('rec_b')
+            with open(data) as fp:
+                fp.read()
+        finally:
+            recorder.stop()
+            sys.modules.pop('rec_a', None)
+            sys.modules.pop('rec_b', None)
+        assert recorder.observed == {'t1': {path_a}, 't2': {path_b, data}}
+
+
+class FakeReport(object):
+    def __init__(self, nodeid, failed=False, duration=0.5):
+        self.nodeid = nodeid
+        self.failed = failed
+        self.duration = duration
+
+class TestItemResults(object):
+    def test_results(self):
+        results = ItemResults()
+        results.add('a.py', ['a.py::t1', 'a.py::t2'])
+        results.add('b.py', ['b.py::t1'])
+        results.add('c.py', ['c.py::t1', 'c.py::t1'])
+        assert results.path('b.py::t1') == 'b.py'
+        assert results.path('x.py::t1') is None
+        for nodeid in ('a.py::t1', 'b.py::t1', 'c.py::t1', 'x.py::t1'):
+            results.add_report(FakeReport(nodeid))
+            results.add_report(FakeReport(nodeid))
+        results.add_report(FakeReport('b.py::t1', failed=True))
+        # a.py::t2 not executed
+        assert not results.passed('a.py')
+        assert not results.passed('b.py')
+        assert results.passed('c.py')
+        assert results.passed('x.py')  # no selected items
+        assert results.failed == set(['b.py'])
+        assert results.durations(exclude=['c.py']) == {
+            'a.py': {'a.py::t1': 1.0}, 'b.py': {'b.py::t1': 1.5}}
+        assert results.nodeids(exclude=['c.py']) == {
+            'a.py': set(['a.py::t1', 'a.py::t2']), 'b.py': set(['b.py::t1'])}
+
+
+class TestDistributions(object):
+    def test_stdlib_modules(self, monkeypatch):
+        monkeypatch.delattr(sys, 'stdlib_module_names', raising=False)
+        names = stdlib_modules()
+        assert set(['os', 'json', 'email', 'sys']).issubset(names)
+        assert 'pytest' not in names
+        assert 'site-packages' not in names
+
+    def test_cache(self, monkeypatch):
+        dists = Distributions()
+        if dists._metadata() is None:
+            pytest.skip('packages_distributions() not available')
+        versions = dists.versions(['pytest', 'os'])
+        assert list(versions) == ['pytest']
+        assert dists.modified
+        assert dists.cache['key'] == dists.cache_key()
+
+        # metadata not read again
+        monkeypatch.setattr(Distributions, '_metadata', None)
+        cached = Distributions()
+        cached.cache = dists.cache
+        assert cached.versions(['pytest']) == versions
+        assert not cached.modified
+
+    def test_not_installed(self):
+        dists = Distributions()
+        if dists._metadata() is None:
+            pytest.skip('packages_distributions() not available')
+        # removed after cache was saved
+        dists.cache = {'key': dists.cache_key(), 'versions': {},
+                       'packages': {'gone': ['gone-not-installed']}}
+        assert dists.versions(['gone']) == {'gone-not-installed': None}
+
+
+class TestLineDiff(object):
+    def test_intervals(self):
+        intervals = to_intervals([7, 1, 2, 3, 5])
+        assert intervals == [1, 3, 5, 5, 7, 7]
+        assert intervals_overlap(intervals, 2, 2)
+        assert intervals_overlap(intervals, 4, 5)
+        assert intervals_overlap(intervals, 6, 9)
+        assert not intervals_overlap(intervals, 4, 4)
+        assert not intervals_overlap(intervals, 8, 10)
+
+    def test_diff(self):
+        old = ['def f():', 'x = 1', 'return x', '', 'def g():', 'return 2']
+        new = ['def f():', 'x = 1', '# comment', 'return x', '',
+               'def g():', 'return 3']
+        diff = LineDiff(old, new, to_intervals([1, 2, 3, 5, 6]),
+                        to_intervals([1, 2, 4, 6, 7]),
+                        [1, 1, 2, 2, 3, 3, 5, 5, 6, 6])
+        assert not diff.touches([1, 3])
+        assert diff.touches([6, 6])
+        assert diff.remap([1, 3]) == [1, 2, 4, 4]
+
+    def test_diff_new_statement(self):
+        old = ['def f():', 'x = 1', '', 'return x']
+        new = ['def f():', 'x = 1', 'x += 1', 'return x']
+        diff = LineDiff(old, new, to_intervals([1, 2, 4]),
+                        to_intervals([1, 2, 3, 4]), [1, 1, 2, 2, 4, 4])
+        assert diff.touches([4, 4])
+
+    def test_diff_multiline_statement(self, tmpdir):
+        source = tmpdir.join('mod.py')
+        source.write('def f():\n    return (\n        1,\n        2,\n    )\n'
+                     'X = 1\n')
+        statements, spans = statement_lines(str(source))
+        assert statements == [1, 2, 6, 6]
+        assert spans == [1, 1, 2, 5, 6, 6]
+        old = ['def f():', 'return (', '1,', '2,', ')', 'X = 1']
+        # modified line not reported as executed
+        new = ['def f():', 'return (', '1,', '3,', ')', 'X = 1']
+        diff = LineDiff(old, new, statements, statements, spans)
+        assert diff.touches([1, 2])
+        assert not diff.touches([6, 6])
+        # line inserted in statement
+        new = ['def f():', 'return (', '1,', '2,', '3,', ')', 'X = 1']
+        diff = LineDiff(old, new, statements, statements, spans)
+        assert diff.touches([2, 2])
+        assert not diff.touches([6, 6])
+
+
 class TestIncrementalControl(object):
     tt_conf = os.path.join(SAMPLE_DIR, 'tt/conftest.py')
     tt_mod1 = os.path.join(SAMPLE_DIR, 'tt/tt_mod1.py')
@@ -156,6 +571,271 @@ class TestIncrementalControl(object):
         control.save_success([self.tt_mod2])
         assert set(control.get_outdated().keys()) == set([self.tt_mod1])
 
+    def test_outdated_profile(self, depfile_name, rm_generated_deps):
+        profiler = Profiler()
+        control = IncrementalControl([SAMPLE_DIR], profiler=profiler)
+        control.DB_FILE = depfile_name
+        control.test_files = [self.tt_mod1, self.tt_mod2]
+        control.get_outdated()
+        control.save_success([self.tt_mod2])
+        control.get_outdated()
+        stats = profiler.stats
+        assert stats['discovery']['counters']['files'] == 6
+        assert stats['get_dep']['calls'] == 6
+        assert stats['doit-outdated']['calls'] == 2
+        assert stats['doit-save-success']['calls'] == 1
+        assert stats['task:outdated']['counters'] == {'hit': 1, 'miss': 4}
+        assert stats['file-check']['counters']['hit'] > 0
+        # md5 calculated on save of get_dep tasks and all deps of tt_mod2
+        assert stats['hash']['counters']['files'] == 6 + 4
+
+    def test_graph_file_uptodate(self, depfile_name, rm_generated_deps):
+        profiler = Profiler()
+        control = IncrementalControl([SAMPLE_DIR], profiler=profiler)
+        control.DB_FILE = depfile_name
+        control.test_files = [self.tt_mod1, self.tt_mod2]
+        control.get_outdated()
+        control.get_outdated()
+        # graph file is written only when imports are modified
+        assert profiler.stats['dep-graph']['calls'] == 1
+        assert profiler.stats['create-graph']['calls'] == 2
+
+    def test_demand(self, depfile_name, rm_generated_deps):
+        profiler = Profiler()
+        control = IncrementalControl([SAMPLE_DIR], profiler=profiler)
+        control.DB_FILE = depfile_name
+        control.demand = True
+        control.test_files = [self.tt_mod1]
+        assert list(control.get_outdated()) == [self.tt_mod1]
+        mod1 = os.path.join(SAMPLE_DIR, 'mod1.py')
+        assert control.scope == set([self.tt_mod1, self.tt_conf, mod1])
+        assert profiler.stats['get_dep']['calls'] == 3
+        assert set(control.graph.nodes) == control.scope
+
+        # graph file keeps import info of modules not in scope
+        control.test_files = [self.tt_mod2]
+        assert list(control.get_outdated()) == [self.tt_mod2]
+        assert len(control.scope) == 4
+        assert len(control.graph.nodes) == 5
+        # module index is read from graph file
+        index_stats = profiler.stats['module-index']
+        assert index_stats['counters'] == {'files': 6, 'saved': 1}
+
+        # imports of modules not modified are read from graph file
+        parsed = profiler.stats['get_dep']['calls']
+        control = IncrementalControl([SAMPLE_DIR], profiler=profiler)
+        control.DB_FILE = depfile_name
+        control.demand = True
+        control.test_files = [self.tt_mod2]
+        assert list(control.get_outdated()) == [self.tt_mod2]
+        assert len(control.scope) == 4
+        assert profiler.stats['get_dep']['calls'] == parsed
+
+    def test_prefetch(self, depfile_name, rm_generated_deps):
+        profiler = Profiler()
+        control = IncrementalControl([SAMPLE_DIR], profiler=profiler)
+        control.DB_FILE = depfile_name
+        control.test_files = [self.tt_mod1, self.tt_mod2]
+        control.start_prefetch()
+        got = control.get_outdated()
+        assert set(got.keys()) == set([self.tt_mod1, self.tt_mod2])
+        stats = profiler.stats
+        assert stats['prefetch']['counters']['files'] == 6
+        assert stats['prefetch-wait']['calls'] == 1
+        # imports and md5 from background are used by doit tasks
+        assert stats['get_dep']['calls'] == 6
+        assert 'hash' not in stats
+        control.save_success([self.tt_mod1, self.tt_mod2])
+
+        # only files modified after last execution
+        profiler = Profiler()
+        control = IncrementalControl([SAMPLE_DIR], profiler=profiler)
+        control.DB_FILE = depfile_name
+        control.test_files = [self.tt_mod1, self.tt_mod2]
+        control.start_prefetch()
+        assert control.get_outdated() == {}
+        assert profiler.stats['prefetch']['counters']['files'] == 0
+
+    def test_git_signature(self, git_repo, depfile_name, monkeypatch):
+        monkeypatch.chdir(git_repo)
+        test_a = str(git_repo.join('pkg', 'test_a.py'))
+        def outdated():
+            profiler = Profiler()
+            control = IncrementalControl([str(git_repo)], profiler=profiler)
+            control.DB_FILE = depfile_name
+            control.signature = 'git'
+            control.test_files = [test_a]
+            return control, profiler, control.get_outdated()
+
+        control, profiler, got = outdated()
+        assert list(got) == [test_a]
+        control.save_success([test_a])
+        # tracked files are not hashed
+        assert profiler.stats['hash']['counters']['files'] == 1
+        assert profiler.stats['git-index']['counters']['hit'] > 0
+        # modified content with same size
+        git_repo.join('mod.py').write('X = 2\n')
+        assert list(outdated()[2]) == [test_a]
+
+    def test_gc(self, tmpdir, depfile_name, rm_generated_deps):
+        test_x = str(tmpdir.join('test_x.py'))
+        tmpdir.join('test_x.py').write('def test_x(): pass\n')
+        control = IncrementalControl([SAMPLE_DIR, str(tmpdir)])
+        control.DB_FILE = depfile_name
+        control.ENV_RETAIN = 1
+        control.test_files = [self.tt_mod1, test_x]
+        control.get_outdated()
+        control.save_success([self.tt_mod1, test_x])
+        control.save_history({test_x: {'test_x.py::test_x': 0.1}}, set())
+        control.save_fixture_setup({str(tmpdir.join('gone')) + '::db': 0.5,
+                                    str(tmpdir) + '::web': 0.2})
+        # results of an older environment
+        control.environment = dict(control.environment, python='other')
+        control.save_success([self.tt_mod1])
+        assert control.gc(force=False) is None  # smaller than GC_MIN_SIZE
+
+        tmpdir.join('test_x.py').remove()
+        report = control.gc()
+        assert report['removed'] == {'get_dep': 1, 'outdated': 2,
+                                     'history': 1, 'env': 1,
+                                     'fixture-setup': 1}
+        assert report['after'] <= report['before']
+        assert control.load_history([test_x]) == {}
+        environment = control.environment
+        control = IncrementalControl([SAMPLE_DIR, str(tmpdir)])
+        control.DB_FILE = depfile_name
+        control.environment = environment
+        control.test_files = [self.tt_mod1]
+        assert control.get_outdated() == {}
+        assert control.gc()['removed'] == {}
+
+    def test_readonly(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.join('mod.py').write('X = 1\n')
+        tmpdir.join('test_a.py').write('import mod\n')
+        test_a = str(tmpdir.join('test_a.py'))
+        def control(readonly=True):
+            control = IncrementalControl([str(tmpdir)])
+            control.DB_FILE = str(tmpdir.join('.pytest-incremental'))
+            control.readonly = readonly
+            control.test_files = [test_a]
+            return control
+        def files():
+            return {p.basename: p.read_binary() for p in tmpdir.listdir()}
+
+        # no state file
+        assert list(control().get_outdated()) == [test_a]
+        assert sorted(files()) == ['mod.py', 'test_a.py']
+
+        seed = control(readonly=False)
+        seed.get_outdated()
+        seed.save_success([test_a])
+        assert control().get_outdated() == {}
+        # modified imports, graph is kept in memory
+        tmpdir.join('mod.py').write('import os\n')
+        saved = files()
+        ro_control = control()
+        assert list(ro_control.get_outdated()) == [test_a]
+        assert ro_control.graph.nodes[test_a].deps
+        assert list(control().get_outdated()) == [test_a]
+        assert files() == saved
+
+    def test_outdated_changed(self, depfile_name, rm_generated_deps):
+        control = IncrementalControl([SAMPLE_DIR])
+        control.DB_FILE = depfile_name
+        control.test_files = [self.tt_mod1]
+        control.get_outdated()
+        # never executed, all deps are considered changed
+        assert set(control.changed[self.tt_mod1]) == set(
+            [self.tt_conf, self.tt_mod1, os.path.join(SAMPLE_DIR, 'mod1.py')])
+
+    def test_history(self, depfile_name):
+        control = IncrementalControl([SAMPLE_DIR])
+        control.DB_FILE = depfile_name
+        control.save_history({'a.py': {'a.py::t1': 0.5}}, set(['a.py']))
+        control.save_history({'a.py': {'a.py::t2': 0.1}}, set())
+        got = control.load_history(['a.py', 'b.py'])
+        assert list(got.keys()) == ['a.py']
+        assert got['a.py']['items'] == {'a.py::t1': 0.5, 'a.py::t2': 0.1}
+        assert got['a.py']['failed'] == [True, False]
+
+    def test_history_removed_item(self, depfile_name):
+        control = IncrementalControl([SAMPLE_DIR])
+        control.DB_FILE = depfile_name
+        control.save_history({'a.py': {'a.py::t1': 0.5, 'a.py::t2': 0.1}},
+                             set(), {'a.py': set(['a.py::t1', 'a.py::t2'])})
+        # t2 removed, t3 collected but not executed
+        control.save_history({'a.py': {'a.py::t1': 0.4}}, set(),
+                             {'a.py': set(['a.py::t1', 'a.py::t3'])})
+        got = control.load_history(['a.py'])
+        assert got['a.py']['items'] == {'a.py::t1': 0.4}
+        assert control.get_durations(['a.py'], got) == {'a.py': 0.4}
+
+    def test_order_outdated(self, depfile_name, rm_generated_deps):
+        control = IncrementalControl([SAMPLE_DIR])
+        control.DB_FILE = depfile_name
+        control.test_files = [self.tt_mod1, self.tt_mod2]
+        outdated = control.get_outdated()
+        topsort = [self.tt_mod1, self.tt_mod2]
+        assert control.order_outdated(outdated) == topsort
+        assert control.order_outdated(outdated, 'closest') == topsort
+        assert control.order_outdated(outdated, 'failed') == topsort
+
+        control.save_history({self.tt_mod1: {'t1': 2.0},
+                              self.tt_mod2: {'t2': 1.0}},
+                             set([self.tt_mod2]))
+        reverse = [self.tt_mod2, self.tt_mod1]
+        assert control.order_outdated(outdated, 'failed') == reverse
+        assert control.order_outdated(outdated, 'duration') == reverse
+
+    def test_order_fixtures(self, depfile_name, rm_generated_deps):
+        mod1 = os.path.join(SAMPLE_DIR, 'mod1.py')
+        mod2 = os.path.join(SAMPLE_DIR, 'mod2.py')
+        control = IncrementalControl([SAMPLE_DIR])
+        control.DB_FILE = depfile_name
+        control.test_files = [mod1, mod2, self.tt_mod1]
+        outdated = control.get_outdated()
+        topsort = [mod1, mod2, self.tt_mod1]
+        assert control.order_outdated(outdated) == topsort
+        control.setup_fixtures[mod1].update(['::db', 'tt::web'])
+        control.setup_fixtures[self.tt_mod1].update(['::db'])
+        # no setup durations
+        assert control.order_outdated(outdated, 'fixtures') == topsort
+        control.save_fixture_setup({'::db': 0.5, 'tt::web': 0.001})
+        assert control.order_outdated(outdated, 'fixtures') == [
+            mod1, self.tt_mod1, mod2]
+
+    def test_order_closest(self, depfile_name, rm_generated_deps):
+        control = IncrementalControl([SAMPLE_DIR])
+        control.DB_FILE = depfile_name
+        control.test_files = [self.tt_mod1, self.tt_mod2]
+        outdated = control.get_outdated()
+        mod2 = os.path.join(SAMPLE_DIR, 'mod2.py')
+        control.changed = {self.tt_mod1: [self.tt_conf], self.tt_mod2: [mod2]}
+        assert control.order_outdated(outdated, 'closest') == [
+            self.tt_mod1, self.tt_mod2]
+        # mod1 is 2 steps away from tt_mod2
+        control.changed[self.tt_mod1] = [os.path.join(SAMPLE_DIR, 'mod1.py')]
+        control.changed[self.tt_mod2] = [self.tt_mod2]
+        assert control.order_outdated(outdated, 'closest') == [
+            self.tt_mod2, self.tt_mod1]
+
+    def test_select_budget(self, depfile_name, rm_generated_deps):
+        control = IncrementalControl([SAMPLE_DIR])
+        control.DB_FILE = depfile_name
+        control.test_files = [self.tt_mod1, self.tt_mod2]
+        outdated = control.get_outdated()
+        control.save_history({self.tt_mod1: {"t1": 1.5},
+                              self.tt_mod2: {'t2': 1.0}}, set())
+        assert control.select_budget(outdated, 2) == {
+            self.tt_mod2: outdated[self.tt_mod2]}
+        assert control.select_budget(outdated, 10) == outdated
+        # at least one test is always selected
+        assert list(control.select_budget(outdated, 0)) == [self.tt_mod2]
+        # recent failure increases risk
+        control.save_history({self.tt_mod1: {}}, set([self.tt_mod1]))
+        assert list(control.select_budget(outdated, 0)) == [self.tt_mod1]
+
 
     def test_list_deps(self, depfile_name, rm_generated_deps, capsys):
         control = IncrementalControl([SAMPLE_DIR])
@@ -188,3 +868,52 @@ class TestIncrementalControl(object):
         assert '"tt/tt_mod1.py" -> "mod1.py"' in out
         assert '"tt/tt_mod2.py" -> "mod2.py"' in out
 
+
+
+class TestQuery(object):
+    tt_mod1 = os.path.join(SAMPLE_DIR, 'tt/tt_mod1.py')
+    tt_mod2 = os.path.join(SAMPLE_DIR, 'tt/tt_mod2.py')
+    mod1 = os.path.join(SAMPLE_DIR, 'mod1.py')
+    mod2 = os.path.join(SAMPLE_DIR, 'mod2.py')
+
+    def query(self, depfile_name):
+        return Query([SAMPLE_DIR], patterns=['tt_*.py'],
+                     db_file=depfile_name)
+
+    def test_test_files(self, depfile_name):
+        assert self.query(depfile_name).control.test_files == [
+            self.tt_mod1, self.tt_mod2]
+
+    def test_affected(self, depfile_name, rm_generated_deps):
+        query = self.query(depfile_name)
+        assert query.affected([self.mod2]) == [self.tt_mod2]
+        assert query.affected([self.mod1]) == [self.tt_mod1, self.tt_mod2]
+        conftest = os.path.join(SAMPLE_DIR, 'tt/conftest.py')
+        assert query.affected([conftest]) == [self.tt_mod1, self.tt_mod2]
+
+    def test_outdated(self, depfile_name, rm_generated_deps):
+        query = self.query(depfile_name)
+        assert sorted(query.outdated()) == [self.tt_mod1, self.tt_mod2]
+        query.control.save_success([self.tt_mod1])
+        query = self.query(depfile_name)
+        assert list(query.outdated()) == [self.tt_mod2]
+        explain = query.explain([self.tt_mod1, self.tt_mod2])
+        assert explain[self.tt_mod1] == {
+            'outdated': False, 'changed': [], 'paths': {}}
+        assert explain[self.tt_mod2]['outdated']
+        assert self.mod2 in explain[self.tt_mod2]['changed']
+        assert explain[self.tt_mod2]['paths'][self.mod1] == [
+            self.tt_mod2, self.mod2, self.mod1]
+
+    def test_graph(self, depfile_name, rm_generated_deps):
+        graph = self.query(depfile_name).graph()
+        assert graph[self.mod2] == [self.mod1]
+        assert graph[self.mod1] == []
+
+    def test_main(self, tmpdir, monkeypatch, capsys):
+        monkeypatch.chdir(tmpdir)
+        assert main(['--inc-path', SAMPLE_DIR, '--test-pattern', 'tt_*.py',
+                     'affected', self.mod2]) == 0
+        out = capsys.readouterr()[0]
+        assert json.loads(out) == [
+            os.path.relpath(self.tt_mod2, str(tmpdir))]